@@ -0,0 +1,121 @@
+"""
+Compare loading the numeric compound columns as json rows from
+/api/compounds with loading them from the columnar snapshot, either as .npy
+downloads from /api/columns or memory-mapped from disk. Uses the Flask test
+client so no server is needed.
+
+A snapshot is written first if the db doesn't have an up to date one.
+
+Usage (from the repository root):
+
+    python -m benchmarks.columns [db name without .sqlite] [runs]
+"""
+import statistics
+import sys
+import time
+
+import numpy as np
+import requests
+
+from dashapp import getter
+from flaskapp import app as flaskapp
+from flaskapp import database, queries, snapshot
+
+COLUMNS = ["molecular_weight", "ALogP", "num_rings"]
+
+
+def from_json(client) -> dict:
+    """
+    Load COLUMNS from the json rows of /api/compounds
+
+    Returns:
+        dict: the array of each column
+    """
+    response = client.get(f"/api/compounds?fields={','.join(COLUMNS)}")
+    rows = response.get_json()
+    return {
+        column: np.array([row[column] for row in rows], dtype=float)
+        for column in COLUMNS
+    }
+
+
+def from_npy(client) -> dict:
+    """
+    Load COLUMNS from the .npy files served by /api/columns
+
+    Returns:
+        dict: the array of each column
+    """
+    columns = {}
+    for column in COLUMNS:
+        response = requests.Response()
+        response._content = client.get(f"/api/columns/compound/{column}").get_data()
+        columns[column] = getter.parse_npy(response)
+    return columns
+
+
+def from_mmap(directory: str) -> dict:
+    """
+    Memory-map COLUMNS from the snapshot and sum them, so the pages are read
+
+    Returns:
+        dict: the array of each column
+    """
+    snapshot._load.cache_clear()
+    columns = {
+        column: snapshot.load_column(directory, "compound", column)
+        for column in COLUMNS
+    }
+    for array in columns.values():
+        np.nansum(array)
+    return columns
+
+
+def benchmark(db_name: str = None, runs: int = 5):
+    """
+    Print the median time taken by each way of loading the columns
+
+    Args:
+        db_name (str): the db to serve, defaulting to the app's own
+        runs (int): how many times to repeat each measurement
+    """
+    if db_name:
+        flaskapp.mydb = db_name
+    directory = snapshot.snapshot_dir(database.local_name(flaskapp.mydb))
+    with database.get_engine(flaskapp.mydb).connect() as connection:
+        with database.connect(flaskapp.mydb, readonly=True) as session:
+            version = queries.get_dataset_version(session)[0]
+        manifest = snapshot.read_manifest(directory)
+        if manifest is None or manifest["version"] != version:
+            snapshot.write_snapshot(connection, directory, version)
+    client = flaskapp.app.test_client()
+
+    loaders = {
+        "json rows": lambda: from_json(client),
+        "npy over http": lambda: from_npy(client),
+        "npy mmap": lambda: from_mmap(directory),
+    }
+    results = {name: load() for name, load in loaders.items()}
+    for name, columns in results.items():
+        for column in COLUMNS:
+            assert np.array_equal(
+                columns[column], results["json rows"][column], equal_nan=True
+            ), f"{name} {column} differs from the json rows"
+
+    print(f"{'loader':<16}{'ms':>10}")
+    for name, load in loaders.items():
+        times = []
+        for _ in range(runs):
+            flaskapp.response_cache.clear()
+            flaskapp.compressed_cache.clear()
+            start = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - start)
+        print(f"{name:<16}{statistics.median(times) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    benchmark(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
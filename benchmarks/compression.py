@@ -0,0 +1,74 @@
+"""
+Measure the bytes sent and the time taken to answer API requests with and
+without compression, using the Flask test client so no server is needed.
+
+Each request is timed cold (nothing cached) and warm (the compressed body
+already cached), and the median of a few runs is reported.
+
+Usage (from the repository root):
+
+    python -m benchmarks.compression [db name without .sqlite] [runs]
+"""
+import statistics
+import sys
+import time
+
+from flaskapp import app as flaskapp
+
+URLS = [
+    "/api/compounds",
+    "/api/compounds?limit=100",
+    "/api/compounds?stream=1",
+    "/api/assays",
+    "/api/assays?format=ndjson",
+]
+ENCODINGS = ["identity", "gzip", "br"]
+
+
+def time_request(client, url: str, encoding: str) -> tuple:
+    """
+    Make one request and read the whole response
+
+    Returns:
+        tuple: (bytes on the wire, seconds taken)
+    """
+    start = time.perf_counter()
+    response = client.get(url, headers={"Accept-Encoding": encoding})
+    size = len(response.get_data())
+    return size, time.perf_counter() - start
+
+
+def benchmark(db_name: str = None, runs: int = 5):
+    """
+    Print bytes on the wire and cold/warm latency for every URL and encoding
+
+    Args:
+        db_name (str): the db to serve, defaulting to the app's own
+        runs (int): how many times to repeat each measurement
+    """
+    if db_name:
+        flaskapp.mydb = db_name
+    client = flaskapp.app.test_client()
+
+    print(f"{'url':<32}{'encoding':<10}{'bytes':>12}{'cold ms':>10}{'warm ms':>10}")
+    for url in URLS:
+        for encoding in ENCODINGS:
+            cold, warm = [], []
+            for _ in range(runs):
+                flaskapp.response_cache.clear()
+                flaskapp.compressed_cache.clear()
+                size, seconds = time_request(client, url, encoding)
+                cold.append(seconds)
+                warm.append(time_request(client, url, encoding)[1])
+            print(
+                f"{url:<32}{encoding:<10}{size:>12}"
+                f"{statistics.median(cold) * 1000:>10.1f}"
+                f"{statistics.median(warm) * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    benchmark(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
@@ -0,0 +1,152 @@
+"""
+Time how long the Dash page builders take for 1k, 100k and 1M rows of
+synthetic API data, both for the DataFrame post-processing on its own and
+for the whole page (which includes building the plotly figures).
+
+The getter is swapped for one returning the synthetic rows (and the
+summaries and density bins the API would work out for them), so neither the
+API nor the db is involved, and pages are built without the page cache.
+Above SCATTER_MAX_POINTS compounds the scatter plot is drawn from the
+density bins.
+
+Usage (from the repository root):
+
+    python -m benchmarks.page_build [sizes...]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_compound
+from dashapp import dashapp, getter
+
+SIZES = [1000, 100000, 1000000]
+COMPOUND_COLUMNS = [
+    "compound_id",
+    "molecular_weight",
+    "ALogP",
+    "molecular_formula",
+    "num_rings",
+]
+
+
+def synthetic_rows(num_rows: int) -> tuple:
+    """
+    Make num_rows compounds and num_rows assay results, shaped like the API's
+    responses
+
+    Returns:
+        tuple: (compounds, assays)
+    """
+    rng = random.Random(0)
+    compounds, assays = [], []
+    compound_id = 0
+    while len(compounds) < num_rows or len(assays) < num_rows:
+        compound_id += 1
+        compound = synthetic_compound(compound_id, rng)
+        assays.extend(compound.pop("assay_results"))
+        compounds.append({column: compound[column] for column in COMPOUND_COLUMNS})
+    return compounds[:num_rows], assays[:num_rows]
+
+
+def synthetic_summaries(compounds: list, assays: list) -> tuple:
+    """
+    Work out what the API's summary endpoints would return for the synthetic
+    rows, see flaskapp.queries.compound_trendlines and assay_counts
+
+    Returns:
+        tuple: (compounds summary, assays summary)
+    """
+    trendlines = []
+    for num_rings, group in pd.DataFrame(compounds).groupby("num_rings"):
+        x, y = group["molecular_weight"], group["ALogP"]
+        slope = intercept = r_squared = None
+        if len(group) > 1:
+            slope, intercept = np.polyfit(x, y, 1)
+            r_squared = np.corrcoef(x, y)[0, 1] ** 2
+        trendlines.append(
+            {
+                "num_rings": num_rings,
+                "count": len(group),
+                "slope": slope,
+                "intercept": intercept,
+                "r_squared": r_squared,
+                "x_min": x.min(),
+                "x_max": x.max(),
+            }
+        )
+    counts = pd.DataFrame(assays).groupby(["target", "result"]).size()
+    counts = counts.reset_index(name="count").to_dict("records")
+    return {"trendlines": trendlines}, {"counts": counts}
+
+
+def synthetic_density(compounds: list, bins: int) -> dict:
+    """
+    Work out what the API's density endpoint would return for the synthetic
+    rows, see flaskapp.queries.compound_density
+
+    Returns:
+        dict: the total count and the bins
+    """
+    df = pd.DataFrame(compounds)
+    keys = [df["num_rings"]]
+    for column in ["molecular_weight", "ALogP"]:
+        values = df[column]
+        width = (values.max() - values.min()) / bins * 1.000001 or 1.0
+        keys.append(((values - values.min()) // width).astype(int))
+    grouped = df.groupby(keys).agg(
+        num_rings=("num_rings", "first"),
+        count=("num_rings", "size"),
+        molecular_weight=("molecular_weight", "mean"),
+        ALogP=("ALogP", "mean"),
+    )
+    return {"count": len(df), "bins": grouped.to_dict("records")}
+
+
+def timed(function, *args) -> float:
+    """
+    Return how long function(*args) takes, in seconds
+    """
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def benchmark(sizes: list = SIZES):
+    """
+    Print the post-processing and page-build times for each number of rows
+
+    Args:
+        sizes (list): the numbers of rows to try
+    """
+    print(f"{'rows':>9}{'compounds df s':>16}{'assays df s':>13}{'page s':>9}")
+    # Build each page once first, unreported, so one-off imports (e.g.
+    # statsmodels for the trendlines) aren't counted
+    for i, size in enumerate([10] + list(sizes)):
+        compounds, assays = synthetic_rows(size)
+        compounds_summary, assays_summary = synthetic_summaries(compounds, assays)
+        density = synthetic_density(compounds, dashapp.SCATTER_BINS)
+        getter.get_compounds = lambda params=None: compounds
+        getter.count_compounds = lambda params=None: len(compounds)
+        getter.get_compounds_density = lambda params: density
+        getter.get_assays = lambda params=None: assays
+        getter.get_compounds_summary = lambda: compounds_summary
+        getter.get_assays_summary = lambda: assays_summary
+        getter.get_dataset_version = lambda: 0
+
+        compounds_df = timed(dashapp.compounds_plot_frame, compounds, COMPOUND_COLUMNS)
+        assays_df = timed(dashapp.assays_table_frame, assays)
+        # Call the builders under memoized_page, which would otherwise hand
+        # back the page built for the previous size
+        page = timed(dashapp.compounds_page.__wrapped__) + timed(
+            dashapp.assays_page.__wrapped__
+        )
+        if i:
+            print(f"{size:>9}{compounds_df:>16.3f}{assays_df:>13.3f}{page:>9.2f}")
+
+
+if __name__ == "__main__":
+    benchmark([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,89 @@
+"""
+Compare how many rows per second each way of turning db rows into a
+response body manages: the ORM loading model instances that jsonify encodes
+through their dataclass fields (how the API used to do it), against Core
+selects of plain tuples (queries.list_page) encoded with the standard
+library's json, orjson and msgpack. Compounds are listed with their assay
+results.
+
+Usage (from the repository root):
+
+    python -m benchmarks.serialization [db name without .sqlite] [rows] [runs]
+"""
+import json
+import statistics
+import sys
+import time
+
+from flask import jsonify
+from sqlalchemy.orm import selectinload
+
+from flaskapp import app as flaskapp
+from flaskapp import database, queries, serializers
+from flaskapp.models import Assay, Compound
+
+
+def orm_jsonify(session, model, rows: int) -> bytes:
+    """
+    Load rows instances of model with the ORM and encode them with jsonify
+    """
+    query = session.query(model).order_by(queries.primary_key(model))
+    if model is Compound:
+        query = query.options(selectinload(Compound.assay_results))
+    with flaskapp.app.app_context():
+        return jsonify(query.limit(rows).all()).get_data()
+
+
+def core_rows(session, model, rows: int) -> list:
+    """
+    Load rows rows of model as dicts with a Core select
+    """
+    params = queries.parse_list_args(model, {"limit": str(rows)})
+    return queries.list_page(session, model, params).rows
+
+
+ENCODERS = {
+    "core + json": lambda data: json.dumps(
+        data, sort_keys=True, separators=(",", ":")
+    ).encode(),
+    "core + msgpack": serializers.dumps_msgpack,
+}
+if serializers.orjson is not None:
+    ENCODERS["core + orjson"] = serializers.dumps_json
+
+
+def benchmark(db_name: str = None, rows: int = 10000, runs: int = 5):
+    """
+    Print the rows per second of each way of building a response body
+
+    Args:
+        db_name (str): the db to read, defaulting to the app's own
+        rows (int): how many rows to serialize each time
+        runs (int): how many times to repeat each measurement
+    """
+    db_name = db_name or flaskapp.mydb
+    ways = {"orm + jsonify": orm_jsonify}
+    for name, encode in ENCODERS.items():
+        ways[name] = lambda session, model, rows, encode=encode: encode(
+            core_rows(session, model, rows)
+        )
+
+    print(f"{'model':<10}{'path':<16}{'rows/s':>12}{'bytes':>12}")
+    for model in [Compound, Assay]:
+        for name, serialize in ways.items():
+            times = []
+            for _ in range(runs):
+                with database.connect(db_name, readonly=True) as session:
+                    start = time.perf_counter()
+                    body = serialize(session, model, rows)
+                    times.append(time.perf_counter() - start)
+            rate = rows / statistics.median(times)
+            print(f"{model.__name__:<10}{name:<16}{rate:>12,.0f}{len(body):>12,}")
+
+
+if __name__ == "__main__":
+    benchmark(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 5,
+    )
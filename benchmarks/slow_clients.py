@@ -0,0 +1,105 @@
+"""
+Measure how a running API server copes with many slow clients: open
+connections that send their request headers one byte at a time, then time
+ordinary requests made while they're all still connected.
+
+Run the servers first (see runservers.py; set asgi_port in settings.json to
+serve flaskapp/asgi.py too), then compare the two, e.g.:
+
+    python -m benchmarks.slow_clients http://127.0.0.1:5000 1000
+    python -m benchmarks.slow_clients http://127.0.0.1:5001 1000
+"""
+import asyncio
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit
+
+PATH = "/api/compounds?limit=25"
+REQUESTS = 20
+# Seconds between the bytes a slow client sends
+TRICKLE_INTERVAL = 1.0
+# Seconds to wait for any one request before counting it as failed
+TIMEOUT = 10.0
+
+
+async def slow_client(host: str, port: int, stop: asyncio.Event):
+    """
+    Connect and trickle a request's headers out until stop is set
+    """
+    request = f"GET {PATH} HTTP/1.1\r\nHost: {host}\r\n".encode()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return
+    try:
+        for byte in request:
+            if stop.is_set():
+                break
+            writer.write(bytes([byte]))
+            await writer.drain()
+            await asyncio.sleep(TRICKLE_INTERVAL)
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+async def timed_request(host: str, port: int) -> float:
+    """
+    Make one ordinary request and read the whole response
+
+    Returns:
+        float: seconds taken, or None if it failed or timed out
+    """
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), TIMEOUT
+        )
+        writer.write(
+            f"GET {PATH} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode()
+        )
+        response = await asyncio.wait_for(reader.read(), TIMEOUT)
+        writer.close()
+    except (OSError, asyncio.TimeoutError):
+        return None
+    if not response.startswith(b"HTTP/1.1 200"):
+        return None
+    return time.perf_counter() - start
+
+
+async def benchmark(url: str, slow_clients: int):
+    """
+    Print the latency of REQUESTS requests to url made while slow_clients
+    slow clients are connected
+    """
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    stop = asyncio.Event()
+    clients = [
+        asyncio.ensure_future(slow_client(host, port, stop))
+        for _ in range(slow_clients)
+    ]
+    # Let them all connect
+    await asyncio.sleep(2)
+
+    times = [await timed_request(host, port) for _ in range(REQUESTS)]
+    stop.set()
+    await asyncio.gather(*clients)
+
+    answered = [t for t in times if t is not None]
+    print(f"{url} with {slow_clients} slow clients:")
+    print(f"  answered {len(answered)}/{REQUESTS}")
+    if answered:
+        print(f"  median {statistics.median(answered) * 1000:.1f}ms")
+        print(f"  max {max(answered) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        benchmark(
+            sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:5000",
+            int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+        )
+    )
@@ -0,0 +1,81 @@
+"""
+Write a synthetic compounds json file, shaped like flaskapp/data/compounds.json,
+for load testing the ETL flow and the apps.
+
+Usage (from the repository root):
+
+    python -m benchmarks.synthetic 1000000 /tmp/compounds_1m.json
+"""
+import json
+import random
+import sys
+
+TARGETS = [
+    "Bromodomain-containing protein 4",
+    "Bromodomain-containing protein 3",
+    "Bromodomain-containing protein 2",
+]
+RESULTS = ["IC50", "Ki", "Kd"]
+OPERATORS = ["=", "=", "=", ">", "<"]
+FRAGMENTS = ["c1ccccc1", "C(=O)N", "Cl", "F", "OC", "N1CCNCC1", "c2ccncc2", "S(=O)(=O)"]
+
+
+def synthetic_compound(compound_id: int, rng: random.Random) -> dict:
+    """
+    Make one random compound record with between 0 and 4 assay results
+
+    Args:
+        compound_id (int): the id to give the compound; assay result ids are
+            derived from it so they are unique too
+        rng (random.Random): the random number generator to use
+
+    Returns:
+        dict: the compound record
+    """
+    num_rings = rng.randint(1, 5)
+    molecular_weight = round(rng.uniform(200, 650), 5)
+    assays = [
+        {
+            "result_id": compound_id * 10 + i,
+            "target": rng.choice(TARGETS),
+            "result": rng.choice(RESULTS),
+            "operator": rng.choice(OPERATORS),
+            "value": round(rng.lognormvariate(5, 2), 1),
+            "unit": "nM",
+        }
+        for i in range(rng.randint(0, 4))
+    ]
+    return {
+        "compound_id": compound_id,
+        "smiles": "".join(rng.choice(FRAGMENTS) for _ in range(num_rings + 2)),
+        "molecular_weight": molecular_weight,
+        "ALogP": round(molecular_weight / 120 + rng.gauss(0, 1), 3),
+        "molecular_formula": f"C{rng.randint(10, 40)}H{rng.randint(10, 40)}N2O2",
+        "num_rings": num_rings,
+        "image": f"images/{compound_id}.png",
+        "assay_results": assays,
+    }
+
+
+def write_synthetic_json(path: str, num_compounds: int, seed: int = 0):
+    """
+    Write num_compounds synthetic compounds to path as a json array, one
+    compound at a time so huge files can be made with little memory
+
+    Args:
+        path (str): where to write the json file
+        num_compounds (int): how many compounds to write
+        seed (int): the random seed, so files are reproducible
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[")
+        for i in range(num_compounds):
+            if i:
+                file.write(",\n")
+            json.dump(synthetic_compound(i + 1, rng), file)
+        file.write("]\n")
+
+
+if __name__ == "__main__":
+    write_synthetic_json(sys.argv[2], int(sys.argv[1]))
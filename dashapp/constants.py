@@ -20,13 +20,44 @@ if all([HOST == "0.0.0.0", platform.system() == "Windows"]):
 FLASK_PORT = server_info["flask_port"]
 DASH_PORT = server_info["dash_port"]
 
+# Where the Dash app gets its data: "http" fetches it from the Flask API,
+# "sqlite" reads the database directly, which only works when both apps
+# run on the same machine
+DATA_BACKEND = server_info.get("data_backend", "http")
+if DATA_BACKEND not in ["http", "sqlite"]:
+    raise ValueError(f"Unknown data_backend in settings.json: {DATA_BACKEND}")
+
+# Above scatter_max_points compounds, the compounds scatter plot shows
+# scatter_bins x scatter_bins density bins instead of every compound
+SCATTER_MAX_POINTS = server_info.get("scatter_max_points", 10000)
+SCATTER_BINS = server_info.get("scatter_bins", 100)
+# Plots of more individual compounds than this are drawn with WebGL
+# (scattergl) rather than SVG
+WEBGL_POINTS = 1000
+
+# Built pages are cached in memory and, if page_cache_dir is set, in that
+# directory too, where every process serving the Dash app can share them
+PAGE_CACHE_DIR = server_info.get("page_cache_dir")
+
+# Most ids the API's batch endpoints take in one request, as in flaskapp/app.py
+MAX_BATCH_IDS = 10000
+
 FLASK_BASE = "http://" + HOST + ":" + FLASK_PORT
 DASH_BASE = "http://" + HOST + ":" + DASH_PORT
 
 API_BASE = FLASK_BASE + "/api"
 API_COMPOUNDS = API_BASE + "/compounds"
+API_COMPOUNDS_BATCH = API_COMPOUNDS + "/batch"
+API_COMPOUNDS_COUNT = API_COMPOUNDS + "/count"
+API_COMPOUNDS_SUMMARY = API_COMPOUNDS + "/summary"
+API_COMPOUNDS_DENSITY = API_COMPOUNDS + "/density"
 API_SINGLE_COMPOUND = API_BASE + "/compound/{}"
+API_VERSION = API_BASE + "/version"
+API_COLUMNS = API_BASE + "/columns/{}/{}"
 API_ASSAYS = API_BASE + "/assays"
+API_ASSAYS_BATCH = API_ASSAYS + "/batch"
+API_ASSAYS_COUNT = API_ASSAYS + "/count"
+API_ASSAYS_SUMMARY = API_ASSAYS + "/summary"
 API_SINGLE_ASSAY = API_BASE + "/assay/{}"
 
 COMPOUNDS = DASH_BASE + "/compounds"
@@ -1,19 +1,109 @@
-from dash import Dash, html, dcc, Input, Output, callback, dash_table
+from dash import Dash, html, dcc, Input, Output, callback, dash_table, no_update
 import dash_bio as dashbio
 from flask import Flask
+from flask_compress import Compress
+import functools
+import pickle
 import plotly.express as px
+import plotly.graph_objects as go
 import pandas as pd
 import re
+import requests
 import warnings
 
 from dashapp import getter
+from dashapp.constants import (
+    PAGE_CACHE_DIR,
+    SCATTER_BINS,
+    SCATTER_MAX_POINTS,
+    WEBGL_POINTS,
+)
+from flaskapp.cache import FileCache, LRUCache
 
 # Get rid of warnings that aren't helpful
 warnings.simplefilter(action="ignore", category=FutureWarning)
-pd.options.mode.chained_assignment = None
 
 server = Flask(__name__)
-app = Dash(server=server)
+# The tables are only added to the layout when their page is visited, so
+# their callbacks can't be checked against the initial layout
+app = Dash(server=server, suppress_callback_exceptions=True)
+
+# Compress the page bundles and callback responses. Dash only enables gzip by
+# default because brotli's highest qualities are slow; quality 4 isn't.
+server.config.update(
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_MIN_SIZE=1024,
+)
+Compress(server)
+
+# Rows per page of the compounds and assays tables. The tables are paged,
+# sorted and filtered by the API, so only the visible page reaches the browser.
+PAGE_SIZE = 25
+
+# Built pages, keyed by page, its arguments and the dataset version
+page_cache = LRUCache(max_entries=256, max_bytes=128 * 1024 * 1024)
+page_file_cache = FileCache(PAGE_CACHE_DIR) if PAGE_CACHE_DIR else None
+_page_cache_version = {"version": None}
+
+# Columns of the compounds scatter plot
+SCATTER_COLUMNS = [
+    "compound_id",
+    "molecular_weight",
+    "ALogP",
+    "molecular_formula",
+    "num_rings",
+]
+
+# Columns of the compounds and assays tables, and those the API can sort and
+# filter them on
+COMPOUND_TABLE_COLUMNS = [
+    "compound_id",
+    "molecular_weight",
+    "ALogP",
+    "molecular_formula",
+    "num_rings",
+    "assay_results",
+]
+COMPOUND_QUERY_COLUMNS = COMPOUND_TABLE_COLUMNS[:-1]
+ASSAY_TABLE_COLUMNS = ["result_id", "target", "result", "operator", "value", "unit"]
+ASSAY_QUERY_COLUMNS = ASSAY_TABLE_COLUMNS
+NUMERIC_COLUMNS = [
+    "compound_id",
+    "molecular_weight",
+    "ALogP",
+    "num_rings",
+    "assay_results",
+    "result_id",
+    "value",
+]
+
+# DataTable filter operators (less any s or i case prefix) and the API
+# operators they translate to
+FILTER_OPERATORS = {
+    "=": "eq",
+    "eq": "eq",
+    "!=": "ne",
+    "ne": "ne",
+    "<": "lt",
+    "lt": "lt",
+    "<=": "lte",
+    "le": "lte",
+    ">": "gt",
+    "gt": "gt",
+    ">=": "gte",
+    "ge": "gte",
+    "contains": "contains",
+}
+# One part of a DataTable filter query e.g. {molecular_weight} s> 400, up to
+# the && before the next part. Quoted values may hold spaces and && too.
+FILTER_PART = re.compile(
+    r"\{(?P<column>[^}]+)\}\s+[si]?"
+    r"(?P<operator>>=|<=|!=|<|>|=|eq|ne|lt|le|gt|ge|contains)\s+"
+    r"(?P<value>\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`|.+?)"
+    r"(?:\s+&&\s+|\s*$)"
+)
+FILTER_SEPARATOR = re.compile(r"\s+&&\s+")
 
 # Set up main template page
 app.layout = html.Div(
@@ -32,6 +122,37 @@ app.layout = html.Div(
 )
 
 
+def memoized_page(page):
+    """
+    Decorate a page builder so the pages it builds are kept in page_cache
+    (and page_file_cache, if there is one) until the dataset version changes
+    """
+
+    @functools.wraps(page)
+    def wrapper(*args):
+        version = getter.get_dataset_version()
+        if version != _page_cache_version["version"]:
+            page_cache.clear()
+            _page_cache_version["version"] = version
+
+        key = (page.__name__, args, version)
+        layout = page_cache.get(key)
+        if layout is not None:
+            return layout
+
+        if page_file_cache is not None:
+            layout = page_file_cache.get(key)
+        if layout is None:
+            layout = page(*args)
+            if page_file_cache is not None:
+                page_file_cache.set(key, layout)
+        page_cache.set(key, layout, size=len(pickle.dumps(layout)))
+        return layout
+
+    return wrapper
+
+
+@memoized_page
 def single_compound_page(compound_id: str) -> html.Div:
     """
     Given a compound id, get the compound's data from our API and construct
@@ -50,11 +171,8 @@ def single_compound_page(compound_id: str) -> html.Div:
     if not compound:
         return error_404()
 
-    assays = compound["assay_results"]
-
-    # Construct our pandas dataframe & order the columns
-    df = pd.DataFrame(assays)
-    df = df[["result_id", "target", "result", "operator", "value", "unit"]]
+    # Construct our pandas dataframe, with links for the assay IDs
+    df = assays_table_frame(compound["assay_results"])
 
     # Create our plots/tables
     smiles_plot = dashbio.Jsme(
@@ -63,10 +181,6 @@ def single_compound_page(compound_id: str) -> html.Div:
         height="35vh",
     )
 
-    # Create links for the assay IDs (markdown format)
-    for i, id in enumerate(df["result_id"]):
-        df["result_id"][i] = f"[{id}](/assays/{id})"
-
     id_col = [
         {"name": i, "id": i, "presentation": "markdown"}
         for i in df.columns
@@ -81,7 +195,7 @@ def single_compound_page(compound_id: str) -> html.Div:
         sort_action="native",
         sort_by=[{"column_id": "value", "direction": "desc"}],
         filter_action="native",
-        id=f"compound-{compound_id}-assay-table"
+        id=f"compound-{compound_id}-assay-table",
     )
 
     # Put our plots in divs along with any headings or other text
@@ -113,73 +227,217 @@ def single_compound_page(compound_id: str) -> html.Div:
     )
 
 
-def compounds_page() -> html.Div:
+def markdown_links(ids: pd.Series, path: str) -> pd.Series:
     """
-    Get all compound data from our API and construct an html.Div object showing
-    interesting data regarding the compounds
+    Turn a column of ids into markdown links to their pages, e.g. 694811 into
+    [694811](/compounds/694811)
+
+    Args:
+        ids (pd.Series): the ids
+        path (str): the path of the pages e.g. /compounds
 
     Returns:
-        html.Div: a Python (dash) object to be rendered in html by the app
-            engine
+        pd.Series: the links
     """
-    # Get compounds data from our API & put it in a pandas df
-    compounds = getter.get_compounds()
-
-    # Construct our pandas dataframe & order the colums
-    df = pd.DataFrame.from_dict(compounds)
-    df = df[
-        [
-            "compound_id",
-            "molecular_weight",
-            "ALogP",
-            "molecular_formula",
-            "num_rings",
-            "assay_results",
-        ]
-    ]
+    ids = ids.astype(str)
+    return "[" + ids + f"]({path}/" + ids + ")"
+
+
+def assays_table_frame(assays: list) -> pd.DataFrame:
+    """
+    Put assay results from the API in a pandas df for display in a table,
+    with links to each assay's page
+
+    Args:
+        assays (list): the assay results, as returned by the API
+
+    Returns:
+        pd.DataFrame: the table's data, in column order
+    """
+    df = pd.DataFrame(assays, columns=ASSAY_TABLE_COLUMNS)
+    df["result_id"] = markdown_links(df["result_id"], "/assays")
+    return df
+
+
+def compounds_plot_frame(compounds: list, columns: list) -> pd.DataFrame:
+    """
+    Put compounds from the API in a pandas df for plotting
+
+    Args:
+        compounds (list): the compounds, as returned by the API
+        columns (list): the columns to keep, in order
 
+    Returns:
+        pd.DataFrame: the plot's data
+    """
+    df = pd.DataFrame(compounds, columns=columns)
     # change from int to str to get discrete rather than continuous categories
-    for i, nr in enumerate(df["num_rings"]):
-        df["num_rings"][i] = str(nr)
+    df["num_rings"] = df["num_rings"].astype(str)
+    return df
 
-    # Display the count of assay_results as an int in the table
-    for i, ar in enumerate(df["assay_results"]):
-        df["assay_results"][i] = len(ar)
 
-    # Create scatter plot
-    scatter = px.scatter(
-        df,
+def add_trendlines(figure: go.Figure, trendlines: list):
+    """
+    Draw a precomputed OLS trendline over each num_rings trace of the
+    compounds scatter plot, in the trace's colour, as px.scatter's
+    trendline="ols" would have
+
+    Args:
+        figure (go.Figure): the scatter plot, with one trace per num_rings
+        trendlines (list): the fitted lines from the API, see
+            flaskapp.queries.compound_trendlines
+    """
+    by_num_rings = {str(trendline["num_rings"]): trendline for trendline in trendlines}
+    for trace in list(figure.data):
+        trendline = by_num_rings.get(trace.name)
+        if not trendline or trendline["slope"] is None:
+            continue
+        slope, intercept = trendline["slope"], trendline["intercept"]
+        x = [trendline["x_min"], trendline["x_max"]]
+        figure.add_trace(
+            go.Scatter(
+                x=x,
+                y=[slope * value + intercept for value in x],
+                mode="lines",
+                line_color=trace.marker.color,
+                name=trace.name,
+                legendgroup=trace.legendgroup,
+                showlegend=False,
+                hovertemplate=(
+                    "<b>OLS trendline</b><br>"
+                    f"ALogP = {slope:g} * molecular_weight + {intercept:g}<br>"
+                    f"R<sup>2</sup>={trendline['r_squared']:f}<br><br>"
+                    f"Number of rings={trace.name}<extra></extra>"
+                ),
+            )
+        )
+
+
+def compounds_scatter(x_range: list = None, y_range: list = None) -> go.Figure:
+    """
+    Plot molecular weight against ALogP, coloured by number of rings, for the
+    compounds within x_range and y_range, along with the trendlines
+
+    Up to SCATTER_MAX_POINTS compounds are plotted one point each (with
+    WebGL above WEBGL_POINTS). Beyond that the API bins them (see
+    getter.get_compounds_density) and each bin is plotted as one point,
+    sized by the number of compounds in it.
+
+    Args:
+        x_range (list): the [lowest, highest] molecular weight to plot, or
+            None for all of them
+        y_range (list): the [lowest, highest] ALogP to plot, or None for all
+            of them
+
+    Returns:
+        go.Figure: the scatter plot
+    """
+    params = {}
+    if x_range:
+        params["molecular_weight__gte"], params["molecular_weight__lte"] = x_range
+    if y_range:
+        params["ALogP__gte"], params["ALogP__lte"] = y_range
+    count = getter.count_compounds(params)
+
+    title = "Trends in molecular weight vs ALogP by number of rings"
+    plot_kwargs = dict(
         x="molecular_weight",
         y="ALogP",
         color="num_rings",
-        hover_data=["compound_id", "molecular_formula"],
-        trendline="ols",
-        trendline_scope="trace",
         labels={"molecular_weight": "Molecular weight", "num_rings": "Number of rings"},
         category_orders={"num_rings": ["5", "4", "3", "2", "1"]},
     )
+    if count <= SCATTER_MAX_POINTS:
+        # Get compounds data from our API (skipping columns we don't plot) &
+        # put it in a pandas df
+        params["fields"] = ",".join(SCATTER_COLUMNS)
+        compounds = getter.get_compounds(params)
+        df = compounds_plot_frame(compounds, SCATTER_COLUMNS)
+        scatter = px.scatter(
+            df,
+            hover_data=["compound_id", "molecular_formula"],
+            render_mode="webgl" if count > WEBGL_POINTS else "svg",
+            **plot_kwargs,
+        )
+    else:
+        params["bins"] = SCATTER_BINS
+        bins = getter.get_compounds_density(params)["bins"]
+        df = compounds_plot_frame(
+            bins, ["molecular_weight", "ALogP", "num_rings", "count"]
+        )
+        scatter = px.scatter(
+            df, size="count", hover_data=["count"], render_mode="webgl", **plot_kwargs
+        )
+        title += f"<br><sub>{count} compounds, binned; zoom in for detail</sub>"
+
+    # Add the trendlines, fitted by the API rather than from the points here
+    add_trendlines(scatter, getter.get_compounds_summary()["trendlines"])
     scatter.update_layout(
-        title={
-            "text": "Trends in molecular weight vs ALogP by number of rings",
-            "xanchor": "center",
-            "x": 0.5,
-        }
+        title={"text": title, "xanchor": "center", "x": 0.5},
+        xaxis_range=x_range,
+        yaxis_range=y_range,
     )
+    return scatter
 
-    # Create links for the compound IDs (markdown format)
-    for i, id in enumerate(df["compound_id"]):
-        df["compound_id"][i] = f"[{id}](/compounds/{id})"
 
-    cols = [{"name": i, "id": i, "presentation": "markdown"} for i in df.columns]
+def axis_range(relayout_data: dict, axis: str) -> list:
+    """
+    Pull the range an axis was zoomed or panned to out of a graph's
+    relayoutData
 
-    compounds_table = dash_table.DataTable(
-        data=df.to_dict("records"),
-        columns=cols,
-        sort_action="native",
-        sort_by=[{"column_id": "value", "direction": "desc"}],
-        filter_action="native",
-        id="compounds-table",
-    )
+    Args:
+        relayout_data (dict): the relayoutData of the graph
+        axis (str): the axis e.g. "xaxis"
+
+    Returns:
+        list: the [lowest, highest] value shown on the axis, or None if it
+            wasn't changed or was reset
+    """
+    if f"{axis}.range" in relayout_data:
+        return sorted(relayout_data[f"{axis}.range"])
+    if f"{axis}.range[0]" in relayout_data and f"{axis}.range[1]" in relayout_data:
+        return sorted(
+            [relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]]
+        )
+    return None
+
+
+@callback(
+    Output("compounds-weight-alogp-scatter", "figure"),
+    Input("compounds-weight-alogp-scatter", "relayoutData"),
+    prevent_initial_call=True,
+)
+def zoom_compounds_scatter(relayout_data: dict) -> go.Figure:
+    """
+    Redraw the compounds scatter plot for the range zoomed or panned to,
+    fetching only the compounds (or bins) within it, or for every compound
+    when the zoom is reset
+    """
+    relayout_data = relayout_data or {}
+    x_range = axis_range(relayout_data, "xaxis")
+    y_range = axis_range(relayout_data, "yaxis")
+    reset = any(key.endswith(".autorange") for key in relayout_data)
+    if not (x_range or y_range or reset):
+        # e.g. the plot was resized
+        return no_update
+    return compounds_scatter(x_range, y_range)
+
+
+@memoized_page
+def compounds_page() -> html.Div:
+    """
+    Get all compound data from our API and construct an html.Div object showing
+    interesting data regarding the compounds
+
+    Returns:
+        html.Div: a Python (dash) object to be rendered in html by the app
+            engine
+    """
+    # Create scatter plot
+    scatter = compounds_scatter()
+
+    # The table's data is filled in a page at a time by update_compounds_table
+    compounds_table = paged_table("compounds-table", COMPOUND_TABLE_COLUMNS, [])
     compounds_table_div = html.Div(
         [html.H4("Table of compounds"), compounds_table], className="content-container"
     )
@@ -187,12 +445,14 @@ def compounds_page() -> html.Div:
     return html.Div(
         children=[
             html.H2(children="Compounds summary"),
+            # Zooming in redraws the plot, see zoom_compounds_scatter
             dcc.Graph(id="compounds-weight-alogp-scatter", figure=scatter),
             compounds_table_div,
         ]
     )
 
 
+@memoized_page
 def single_assay_page(result_id: str) -> html.Div:
     """
     Given a result_id, get the assay's data from our API and construct
@@ -228,6 +488,7 @@ def single_assay_page(result_id: str) -> html.Div:
     )
 
 
+@memoized_page
 def assays_page() -> html.Div:
     """
     Get all assay data from our API and construct an html.Div object showing
@@ -237,16 +498,15 @@ def assays_page() -> html.Div:
         html.Div: a Python (dash) object to be rendered in html by the app
             engine
     """
-    # Get compounds data from our API & put it in a pandas df
-    assays = getter.get_assays()
+    # Get the number of assay results per target and result from our API & put
+    # it in a pandas df
+    counts = getter.get_assays_summary()["counts"]
+    df = pd.DataFrame(counts, columns=["target", "result", "count"])
 
-    # Construct our pandas dataframe & order the colums
-    df = pd.DataFrame.from_dict(assays)
-    df = df[["result_id", "target", "result", "operator", "value", "unit"]]
-
-    bar = px.histogram(
+    bar = px.bar(
         df,
         x="target",
+        y="count",
         color="target",
         pattern_shape="result",
         category_orders={
@@ -266,25 +526,12 @@ def assays_page() -> html.Div:
         }
     )
 
-    # Create links for the assay IDs (markdown format)
-    for i, id in enumerate(df["result_id"]):
-        df["result_id"][i] = f"[{id}](/assays/{id})"
-
-    id_col = [
-        {"name": i, "id": i, "presentation": "markdown"}
-        for i in df.columns
-        if i == "result_id"
-    ]
-    cols_no_id = [{"name": i, "id": i} for i in df.columns if i != "result_id"]
-    cols = id_col + cols_no_id
-
-    assay_table = dash_table.DataTable(
-        data=df.to_dict("records"),
-        columns=cols,
-        sort_action="native",
-        sort_by=[{"column_id": "value", "direction": "desc"}],
-        filter_action="native",
-        id="assays-table",
+    # The table's data is filled in a page at a time by update_assays_table
+    assay_table = paged_table(
+        "assays-table",
+        ASSAY_TABLE_COLUMNS,
+        [{"column_id": "value", "direction": "desc"}],
+        markdown_columns=["result_id"],
     )
 
     assay_table_div = html.Div(
@@ -300,6 +547,187 @@ def assays_page() -> html.Div:
     )
 
 
+def paged_table(
+    id: str, columns: list, sort_by: list, markdown_columns: list = None
+) -> dash_table.DataTable:
+    """
+    Create a DataTable that is paged, sorted and filtered by a callback (see
+    table_query_params) rather than in the browser
+
+    Args:
+        id (str): the id of the table
+        columns (list): the column ids of the table
+        sort_by (list): the initial sort, in DataTable sort_by format
+        markdown_columns (list): the columns holding markdown; all of them
+            if not given
+
+    Returns:
+        dash_table.DataTable: the empty table
+    """
+    if markdown_columns is None:
+        markdown_columns = columns
+    cols = []
+    for column in columns:
+        col = {"name": column, "id": column}
+        col["type"] = "numeric" if column in NUMERIC_COLUMNS else "text"
+        if column in markdown_columns:
+            col["presentation"] = "markdown"
+        cols.append(col)
+
+    return dash_table.DataTable(
+        columns=cols,
+        page_action="custom",
+        page_current=0,
+        page_size=PAGE_SIZE,
+        sort_action="custom",
+        sort_mode="single",
+        sort_by=sort_by,
+        filter_action="custom",
+        filter_query="",
+        id=id,
+    )
+
+
+def filter_params(filter_query: str, columns: list) -> dict:
+    """
+    Translate a DataTable filter query e.g.
+    '{molecular_weight} s> 400 && {molecular_formula} contains "Cl"' into API
+    filters e.g. {"molecular_weight__gt": "400", "molecular_formula__contains":
+    "Cl"}
+
+    Filters on columns the API can't filter on, and with operators it
+    doesn't have, are ignored.
+
+    Args:
+        filter_query (str): the filter_query of the DataTable
+        columns (list): the columns the API can filter on
+
+    Returns:
+        dict: the API filters
+    """
+    params = {}
+    query, pos = (filter_query or "").strip(), 0
+    while pos < len(query):
+        matched = FILTER_PART.match(query, pos)
+        if not matched:
+            # A part the API can't do e.g. {smiles} is blank, so skip it
+            separator = FILTER_SEPARATOR.search(query, pos)
+            if not separator:
+                break
+            pos = separator.end()
+            continue
+        pos = matched.end()
+        if matched["column"] not in columns:
+            continue
+        value = matched["value"].strip()
+        # Values with spaces or symbols are quoted, with quotes escaped
+        if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'`":
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        operator = FILTER_OPERATORS[matched["operator"]]
+        params[f"{matched['column']}__{operator}"] = value
+    return params
+
+
+def table_query_params(
+    page_current: int, page_size: int, sort_by: list, filter_query: str, columns: list
+) -> dict:
+    """
+    Translate the paging, sorting and filtering of a DataTable into API query
+    parameters
+
+    Args:
+        page_current (int): the page of the table being shown, from 0
+        page_size (int): the rows per page of the table
+        sort_by (list): the sort_by of the DataTable
+        filter_query (str): the filter_query of the DataTable
+        columns (list): the columns the API can sort and filter on
+
+    Returns:
+        dict: the API query parameters
+    """
+    params = filter_params(filter_query, columns)
+    params["offset"] = (page_current or 0) * page_size
+    params["limit"] = page_size
+    if sort_by and sort_by[0]["column_id"] in columns:
+        direction = "-" if sort_by[0]["direction"] == "desc" else ""
+        params["sort"] = direction + sort_by[0]["column_id"]
+    return params
+
+
+@callback(
+    Output("compounds-table", "data"),
+    Output("compounds-table", "page_count"),
+    Input("compounds-table", "page_current"),
+    Input("compounds-table", "page_size"),
+    Input("compounds-table", "sort_by"),
+    Input("compounds-table", "filter_query"),
+)
+def update_compounds_table(
+    page_current: int, page_size: int, sort_by: list, filter_query: str
+) -> tuple:
+    """
+    Fetch the page of compounds shown in the compounds table
+
+    Returns:
+        tuple: the rows of the page and the number of pages
+    """
+    params = table_query_params(
+        page_current, page_size, sort_by, filter_query, COMPOUND_QUERY_COLUMNS
+    )
+    params["fields"] = ",".join(COMPOUND_TABLE_COLUMNS)
+    try:
+        compounds = getter.get_compounds(params)
+        count = getter.count_compounds(
+            filter_params(filter_query, COMPOUND_QUERY_COLUMNS)
+        )
+    except (ValueError, requests.HTTPError):
+        # e.g. text typed into a numeric column's filter
+        return [], 1
+
+    rows = []
+    for compound in compounds:
+        # Copy, as the getter may hand the same rows out again
+        row = dict(compound)
+        # Link to the compound's page, and show how many assay results it has
+        row["compound_id"] = f"[{row['compound_id']}](/compounds/{row['compound_id']})"
+        row["assay_results"] = len(row["assay_results"])
+        rows.append(row)
+    return rows, max(1, -(-count // page_size))
+
+
+@callback(
+    Output("assays-table", "data"),
+    Output("assays-table", "page_count"),
+    Input("assays-table", "page_current"),
+    Input("assays-table", "page_size"),
+    Input("assays-table", "sort_by"),
+    Input("assays-table", "filter_query"),
+)
+def update_assays_table(
+    page_current: int, page_size: int, sort_by: list, filter_query: str
+) -> tuple:
+    """
+    Fetch the page of assays shown in the assays table
+
+    Returns:
+        tuple: the rows of the page and the number of pages
+    """
+    params = table_query_params(
+        page_current, page_size, sort_by, filter_query, ASSAY_QUERY_COLUMNS
+    )
+    try:
+        assays = getter.get_assays(params)
+        count = getter.count_assays(filter_params(filter_query, ASSAY_QUERY_COLUMNS))
+    except (ValueError, requests.HTTPError):
+        return [], 1
+
+    rows = [
+        {**assay, "result_id": f"[{assay['result_id']}](/assays/{assay['result_id']})"}
+        for assay in assays
+    ]
+    return rows, max(1, -(-count // page_size))
+
+
 def error_404() -> html.P:
     """
     Return a html.P object stating that the page does not exist
@@ -1,22 +1,397 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import threading
+import time
+
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from dashapp.constants import (
     API_ASSAYS,
+    API_ASSAYS_BATCH,
+    API_ASSAYS_COUNT,
+    API_ASSAYS_SUMMARY,
+    API_COLUMNS,
     API_COMPOUNDS,
+    API_COMPOUNDS_BATCH,
+    API_COMPOUNDS_COUNT,
+    API_COMPOUNDS_DENSITY,
+    API_COMPOUNDS_SUMMARY,
     API_SINGLE_ASSAY,
     API_SINGLE_COMPOUND,
+    API_VERSION,
+    DATA_BACKEND,
+    MAX_BATCH_IDS,
+)
+from flaskapp import database, queries, snapshot
+from flaskapp.cache import LRUCache
+from flaskapp.models import Assay, Compound
+
+# Connections kept open to the API. Dash serves callbacks from several
+# threads, so keep enough for each of them.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 60)
+# Retry refused connections and gateway errors, backing off 0.2s, 0.4s, ...
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.2,
+    status_forcelist=[502, 503, 504],
+    allowed_methods=["GET"],
 )
 
+# Most requests in flight at once when fetching rows one by one
+FAN_OUT_CONCURRENCY = 8
+
+# Parsed API responses, keyed by url and query parameters. Entries younger
+# than CACHE_TTL seconds are used as they are; older ones are revalidated
+# with If-None-Match, which costs a round trip but not a download or parse.
+CACHE_TTL = 5.0
+response_cache = LRUCache(max_entries=256, max_bytes=256 * 1024 * 1024)
+
+_session = {"pid": None, "session": None}
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the session shared by this process, with its pool of keep-alive
+    connections to the API. A forked process gets a session of its own.
+
+    Returns:
+        requests.Session: the shared session
+    """
+    with _session_lock:
+        if _session["pid"] != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE,
+                max_retries=RETRY,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session.update(pid=os.getpid(), session=session)
+        return _session["session"]
+
+
+def get_json(url: str, params: dict = None):
+    """
+    GET url from the API and parse the json response, using the cached copy
+    if it's fresh (see CACHE_TTL) or the API says it's not modified
+
+    The same parsed object is handed to every caller, so it mustn't be
+    modified.
+
+    Args:
+        url (str): the API url
+        params (dict): optional query parameters
+
+    Raises:
+        requests.HTTPError: if the API responds with an error
+
+    Returns:
+        the parsed json
+    """
+    return get_cached(url, params, requests.Response.json)
+
+
+def get_cached(url: str, params: dict, parse):
+    """
+    GET url from the API and parse the response with parse, caching the
+    result as described in get_json
+    """
+    key = (url, tuple(sorted((params or {}).items())))
+    headers = {}
+    cached = response_cache.get(key)
+    if cached is not None:
+        etag, data, fetched_at, size = cached
+        if time.monotonic() - fetched_at < CACHE_TTL:
+            return data
+        if etag:
+            headers["If-None-Match"] = etag
+
+    r = get_session().get(url, params=params, headers=headers, timeout=TIMEOUT)
+    if r.status_code == 304 and cached is not None:
+        etag = r.headers.get("ETag", etag)
+    else:
+        r.raise_for_status()
+        etag, data, size = r.headers.get("ETag"), parse(r), len(r.content)
+    response_cache.set(key, (etag, data, time.monotonic(), size), size=size)
+    return data
+
+
+def parse_npy(r: requests.Response) -> np.ndarray:
+    """
+    Parse a .npy response without copying: the array is a read-only view of
+    the response body
+
+    Returns:
+        np.ndarray: the column
+    """
+    body = r.content
+    stream = io.BytesIO(body)
+    major, _ = np.lib.format.read_magic(stream)
+    if major == 1:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order or len(shape) != 1:
+        raise ValueError(f"Expected a 1d column from {r.url}")
+    return np.frombuffer(body, dtype=dtype, count=shape[0], offset=stream.tell())
+
+
+async def fetch_all(urls: list, concurrency: int = FAN_OUT_CONCURRENCY) -> list:
+    """
+    GET every url concurrently with get_json, with at most concurrency
+    requests in flight at once
+
+    Args:
+        urls (list): the API urls
+        concurrency (int): the most requests to make at once
+
+    Returns:
+        list: the parsed json of each url, in the order of urls
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return await asyncio.gather(
+            *[loop.run_in_executor(executor, get_json, url) for url in urls]
+        )
+
+
+def get_batch(batch_url: str, id_name: str, ids: list, single_url: str) -> list:
+    """
+    Fetch many rows by id with a POST to a batch endpoint for every
+    MAX_BATCH_IDS ids, falling back to fetching them one at a time,
+    concurrently (see fetch_all), if the API doesn't have the batch endpoint
+
+    Args:
+        batch_url (str): the batch endpoint e.g. API_COMPOUNDS_BATCH
+        id_name (str): the key the batch endpoint expects the ids under
+        ids (list): the ids to fetch
+        single_url (str): the url of one row, to format with its id
+
+    Raises:
+        requests.HTTPError: if the API responds with an error
+
+    Returns:
+        list: the rows in the order of ids, skipping any that don't exist
+    """
+    # The API skips repeats within a request, so drop them across requests too
+    ids = list(dict.fromkeys(ids))
+    rows = []
+    for chunk in queries.chunks(ids, MAX_BATCH_IDS):
+        r = get_session().post(batch_url, json={id_name: chunk}, timeout=TIMEOUT)
+        # An older API without batch endpoints
+        if r.status_code in [404, 405]:
+            break
+        r.raise_for_status()
+        rows.extend(r.json())
+    else:
+        return rows
+
+    rows = asyncio.run(fetch_all([single_url.format(id) for id in ids]))
+    return [row for row in rows if row]
+
+
+def read_rows(model, params: dict = None) -> list:
+    """
+    Read a listing of model straight from the database, in the same form the
+    API would return it
+
+    Args:
+        model: the model class to list e.g. Compound
+        params (dict): optional query parameters, see
+            flaskapp.queries.parse_list_args
+
+    Raises:
+        ValueError: if any of the parameters are invalid
+
+    Returns:
+        list: a dict for each row
+    """
+    params = queries.parse_list_args(model, params or {})
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        return queries.list_page(session, model, params).rows
+
+
+def read_count(model, params: dict = None) -> int:
+    """
+    Count the rows of model matching the filters in params straight from the
+    database
+
+    Args:
+        model: the model class to count e.g. Compound
+        params (dict): optional filters, see flaskapp.queries.parse_filters
+
+    Raises:
+        ValueError: if any of the parameters are invalid
+
+    Returns:
+        int: the number of matching rows
+    """
+    params = queries.parse_list_args(model, params or {})
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        return queries.count_rows(session, model, params)
+
+
+def read_density(params: dict = None) -> dict:
+    """
+    Bin the compounds matching the filters in params straight from the
+    database, see flaskapp.queries.compound_density
+
+    Args:
+        params (dict): optional filters, plus the number of bins along each
+            axis (bins)
+
+    Raises:
+        ValueError: if any of the parameters are invalid
+
+    Returns:
+        dict: the total count and the bins
+    """
+    params = dict(params or {})
+    bins = int(params.pop("bins"))
+    params = queries.parse_list_args(Compound, params)
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        return queries.compound_density(session, params, bins)
+
+
+def read_summary(summarize):
+    """
+    Run an aggregate query e.g. flaskapp.queries.compound_trendlines on the
+    database, caching its result until the dataset version changes
+
+    Args:
+        summarize: the query function, taking a session
+
+    Returns:
+        the result of summarize
+    """
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        version, _ = queries.get_dataset_version(session)
+        key = (summarize.__name__, version)
+        summary = response_cache.get(key)
+        if summary is None:
+            summary = summarize(session)
+            response_cache.set(key, summary)
+        return summary
+
+
+def read_one(model, id: int) -> dict:
+    """
+    Read one row of model, by primary key, straight from the database, in
+    the same form the API would return it
+
+    Args:
+        model: the model class e.g. Compound
+        id (int): the primary key of the row
+
+    Returns:
+        dict: the row, or None if there isn't one with that id
+    """
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        return queries.get_by_id(session, model, id)
+
+
+def read_many(model, ids: list) -> list:
+    """
+    Read many rows of model, by primary key, straight from the database, in
+    the same form the batch API endpoints would return them
+
+    Args:
+        model: the model class e.g. Compound
+        ids (list): the primary keys of the rows
 
-def get_compounds() -> dict:
+    Returns:
+        list: the rows in the order of ids, skipping any that don't exist
+    """
+    fields = queries.parse_fields(model)
+    pk = queries.primary_key(model)
+    ids = [queries.coerce_value(pk, str(id)) for id in ids]
+    with database.connect(database.DEFAULT_DB, readonly=True) as session:
+        return queries.get_by_ids(session, model, ids, fields)
+
+
+def get_dataset_version() -> int:
+    """
+    Get the version of the dataset, which changes whenever the ETL flow
+    changes the data
+
+    Returns:
+        int: the dataset version
+    """
+    if DATA_BACKEND == "sqlite":
+        with database.connect(database.DEFAULT_DB, readonly=True) as session:
+            return queries.get_dataset_version(session)[0]
+    return get_json(API_VERSION)["version"]
+
+
+def get_compounds(params: dict = None) -> dict:
     """
     Poll the API for all compound data; return as a dict
 
+    Args:
+        params (dict): optional query parameters e.g. filters or fields, see
+            flaskapp.queries.list_page
+
     Returns:
         dict: a dictionary representation of the json data
     """
-    r = requests.get(API_COMPOUNDS)
-    return r.json()
+    if DATA_BACKEND == "sqlite":
+        return read_rows(Compound, params)
+    return get_json(API_COMPOUNDS, params)
+
+
+def count_compounds(params: dict = None) -> int:
+    """
+    Count the compounds matching the filters in params
+
+    Args:
+        params (dict): optional filters, see flaskapp.queries.parse_filters
+
+    Returns:
+        int: the number of matching compounds
+    """
+    if DATA_BACKEND == "sqlite":
+        return read_count(Compound, params)
+    return get_json(API_COMPOUNDS_COUNT, params)["count"]
+
+
+def get_compounds_summary() -> dict:
+    """
+    Get the OLS trendlines of ALogP against molecular weight for each number
+    of rings, see flaskapp.queries.compound_trendlines
+
+    Returns:
+        dict: the trendlines, under "trendlines"
+    """
+    if DATA_BACKEND == "sqlite":
+        return {"trendlines": read_summary(queries.compound_trendlines)}
+    return get_json(API_COMPOUNDS_SUMMARY)
+
+
+def get_compounds_density(params: dict) -> dict:
+    """
+    Get the compounds matching the filters in params binned by molecular
+    weight and ALogP, see flaskapp.queries.compound_density
+
+    Args:
+        params (dict): optional filters, plus the number of bins along each
+            axis (bins)
+
+    Returns:
+        dict: the total count and the bins
+    """
+    if DATA_BACKEND == "sqlite":
+        return read_density(params)
+    return get_json(API_COMPOUNDS_DENSITY, params)
 
 
 def get_compound(compound_id: int) -> dict:
@@ -30,19 +405,87 @@ def get_compound(compound_id: int) -> dict:
     Returns:
         dict: a dictionary representation of the json data
     """
-    r = requests.get(API_SINGLE_COMPOUND.format(compound_id))
-    return r.json()
+    if DATA_BACKEND == "sqlite":
+        return read_one(Compound, compound_id)
+    return get_json(API_SINGLE_COMPOUND.format(compound_id))
+
+
+def get_compounds_by_id(compound_ids: list) -> list:
+    """
+    Get the data of many compounds, with their assay results, at once
 
+    Args:
+        compound_ids (list): the compound_ids e.g. [694811, 1175669]
 
-def get_assays() -> dict:
+    Returns:
+        list: a dict for each compound, in the order of compound_ids, skipping
+            any that don't exist
+    """
+    if DATA_BACKEND == "sqlite":
+        return read_many(Compound, compound_ids)
+    return get_batch(
+        API_COMPOUNDS_BATCH, "compound_ids", compound_ids, API_SINGLE_COMPOUND
+    )
+
+
+def get_assays(params: dict = None) -> dict:
     """
     Poll the API for all assay data; return as a dict
 
+    Args:
+        params (dict): optional query parameters e.g. filters or fields, see
+            flaskapp.queries.list_page
+
     Returns:
         dict: a dictionary representation of the json data
     """
-    r = requests.get(API_ASSAYS)
-    return r.json()
+    if DATA_BACKEND == "sqlite":
+        return read_rows(Assay, params)
+    return get_json(API_ASSAYS, params)
+
+
+def get_assays_by_id(result_ids: list) -> list:
+    """
+    Get the data of many assays at once
+
+    Args:
+        result_ids (list): the result_ids e.g. [6364731, 18201147]
+
+    Returns:
+        list: a dict for each assay, in the order of result_ids, skipping any
+            that don't exist
+    """
+    if DATA_BACKEND == "sqlite":
+        return read_many(Assay, result_ids)
+    return get_batch(API_ASSAYS_BATCH, "result_ids", result_ids, API_SINGLE_ASSAY)
+
+
+def count_assays(params: dict = None) -> int:
+    """
+    Count the assays matching the filters in params
+
+    Args:
+        params (dict): optional filters, see flaskapp.queries.parse_filters
+
+    Returns:
+        int: the number of matching assays
+    """
+    if DATA_BACKEND == "sqlite":
+        return read_count(Assay, params)
+    return get_json(API_ASSAYS_COUNT, params)["count"]
+
+
+def get_assays_summary() -> dict:
+    """
+    Get the number of assay results for each target and result type, see
+    flaskapp.queries.assay_counts
+
+    Returns:
+        dict: the counts, under "counts"
+    """
+    if DATA_BACKEND == "sqlite":
+        return {"counts": read_summary(queries.assay_counts)}
+    return get_json(API_ASSAYS_SUMMARY)
 
 
 def get_assay(result_id: int) -> dict:
@@ -56,5 +499,39 @@ def get_assay(result_id: int) -> dict:
     Returns:
         dict: a dictionary representation of the json data
     """
-    r = requests.get(API_SINGLE_ASSAY.format(result_id))
-    return r.json()
+    if DATA_BACKEND == "sqlite":
+        return read_one(Assay, result_id)
+    return get_json(API_SINGLE_ASSAY.format(result_id))
+
+
+def get_columns(table: str, columns: list) -> dict:
+    """
+    Get numeric columns of table from the columnar snapshot written by the ETL
+    flow, see flaskapp.snapshot. With the sqlite backend the .npy files are
+    memory-mapped; otherwise they're downloaded from the API and wrapped
+    without decoding or copying.
+
+    The arrays are shared between callers and read-only.
+
+    Args:
+        table (str): "compound", "assay" or "compound_assay"
+        columns (list): the columns e.g. ["molecular_weight", "ALogP"], see
+            flaskapp.snapshot.SNAPSHOT_COLUMNS
+
+    Raises:
+        KeyError: if there's no snapshot (sqlite backend) or the column isn't
+            in it
+        requests.HTTPError: if the API responds with an error
+
+    Returns:
+        dict: the array of each column
+    """
+    if DATA_BACKEND == "sqlite":
+        directory = snapshot.snapshot_dir(database.local_name(database.DEFAULT_DB))
+        return {
+            column: snapshot.load_column(directory, table, column) for column in columns
+        }
+    return {
+        column: get_cached(API_COLUMNS.format(table, column), None, parse_npy)
+        for column in columns
+    }
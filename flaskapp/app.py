@@ -1,43 +1,750 @@
-from flask import Flask, jsonify
+import functools
+import hashlib
+import itertools
+import os
+import threading
+import time
+import zlib
 
-from flaskapp import database
+import brotli
+from flask import Flask, Response, abort, g, jsonify, request, send_file
+from flask import stream_with_context, url_for
+from flask_compress import Compress
+from flaskapp import database, fingerprints, images, queries, serializers, snapshot
+from flaskapp.cache import LRUCache
 from flaskapp.models import Assay, Compound
 
 app = Flask(__name__)
-app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
-mydb = database.DEFAULT_SQLITE_DB
+# Pretty printing roughly doubles the payload, so only do it when debugging
+app.config["JSONIFY_PRETTYPRINT_REGULAR"] = app.debug
+mydb = database.DEFAULT_DB
+
+# Bins along each axis of /api/compounds/density, by default and at most
+DEFAULT_DENSITY_BINS = 100
+MAX_DENSITY_BINS = 1000
+
+# Most ids that can be looked up in one batch request
+MAX_BATCH_IDS = 10000
+
+# Compounds returned by a similarity or substructure search, by default and
+# at most
+DEFAULT_SIMILAR_LIMIT = 10
+DEFAULT_SUBSTRUCTURE_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+SEARCH_METHOD_HEADER = "X-Search-Method"
+
+# Rows fetched from the db at a time when streaming a response
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+# Columns of the snapshot are served as .npy files, see snapshot.py
+NPY_MIMETYPE = "application/x-npy"
+
+# How long (in seconds) browsers may use a compound image or thumbnail
+# before revalidating it
+IMAGE_MAX_AGE = 24 * 60 * 60
+
+# Serialized responses, keyed by dataset version, path, query arguments and
+# format (json or msgpack, see serializers.negotiate)
+response_cache = LRUCache(max_entries=512, max_bytes=256 * 1024 * 1024)
+
+# Compressed copies of the cached responses, keyed by the response_cache key
+# and the client's Accept-Encoding header, so each is only compressed once
+compressed_cache = LRUCache(max_entries=1024, max_bytes=128 * 1024 * 1024)
+
+# Responses smaller than this (in bytes) aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_ALGORITHMS = ["br", "gzip"]
+
+# How long (in seconds) to trust the dataset version before checking the db
+DATASET_VERSION_TTL = 1.0
+_dataset_version = {"version": None, "updated_at": None, "checked_at": 0.0}
+_dataset_version_lock = threading.Lock()
+
+
+def dataset_version() -> tuple:
+    """
+    Return the current dataset version and when it was last changed (see
+    queries.get_dataset_version), checking the db at most once every
+    DATASET_VERSION_TTL seconds. The response cache is emptied whenever the
+    version changes.
+
+    Returns:
+        tuple: (version, updated_at datetime or None)
+    """
+    with _dataset_version_lock:
+        if time.monotonic() - _dataset_version["checked_at"] > DATASET_VERSION_TTL:
+            with database.connect(mydb, readonly=True) as session:
+                version, updated_at = queries.get_dataset_version(session)
+            if version != _dataset_version["version"]:
+                response_cache.clear()
+                compressed_cache.clear()
+            _dataset_version.update(
+                version=version, updated_at=updated_at, checked_at=time.monotonic()
+            )
+        return _dataset_version["version"], _dataset_version["updated_at"]
+
+
+def set_validators(response: Response, etag: str, updated_at) -> Response:
+    """
+    Add the ETag, Last-Modified and Cache-Control headers that let clients
+    make conditional requests for response
+
+    Args:
+        response (Response): the response to add the headers to
+        etag (str): the entity tag of the response
+        updated_at (datetime): when the dataset last changed, if known
+
+    Returns:
+        Response: the same response
+    """
+    response.set_etag(etag)
+    if updated_at:
+        response.last_modified = updated_at
+    # Clients may keep the response but should check it's still current
+    response.cache_control.no_cache = True
+    # The body is json or msgpack depending on the Accept header
+    response.vary.add("Accept")
+    return response
+
+
+def response_etag(key: tuple) -> str:
+    """
+    Return the entity tag of the response cached under key in response_cache
+    """
+    return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+
+def cached_response(view):
+    """
+    Decorate a view so its responses are cached in response_cache until the
+    dataset version changes, and so requests with a matching If-None-Match or
+    If-Modified-Since header get an empty 304 response.
+
+    Streamed responses (see wants_stream) and errors aren't cached.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if wants_stream():
+            return view(*args, **kwargs)
+
+        version, updated_at = dataset_version()
+        key = (
+            version,
+            request.path,
+            tuple(sorted(request.args.items(multi=True))),
+            serializers.negotiate(request.accept_mimetypes),
+        )
+        etag = response_etag(key)
+        g.response_cache_key = key
+
+        # Answer conditional requests without even looking in the cache.
+        # Compressed responses carry the etag with the encoding appended.
+        for tag in [etag] + [
+            f"{etag}:{algorithm}" for algorithm in COMPRESS_ALGORITHMS
+        ]:
+            if tag in request.if_none_match:
+                etag = tag
+                break
+        conditional = set_validators(Response(), etag, updated_at)
+        conditional.make_conditional(request)
+        if conditional.status_code == 304:
+            return conditional
+
+        cached = response_cache.get(key)
+        if cached is None:
+            response = view(*args, **kwargs)
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            cached = (body, response.mimetype, response.headers.get("Link"))
+            response_cache.set(key, cached, size=len(body))
+
+        body, mimetype, link = cached
+        response = Response(body, mimetype=mimetype)
+        if link:
+            response.headers["Link"] = link
+        return set_validators(response, etag, updated_at)
+
+    return wrapper
+
+
+def compressed_cache_key(request) -> tuple:
+    """
+    The compressed_cache key for the response to request, or None if the
+    response isn't one kept in response_cache
+    """
+    key = g.get("response_cache_key")
+    if key is None:
+        return None
+    return key, request.headers.get("Accept-Encoding", "")
+
+
+class CompressedCache:
+    """
+    The Flask-Compress cache backend, storing compressed bodies in
+    compressed_cache. Responses without a cache key are never stored.
+    """
+
+    def get(self, key):
+        return None if key is None else compressed_cache.get(key)
+
+    def set(self, key, value):
+        if key is not None:
+            compressed_cache.set(key, value, size=len(value))
+
+
+app.config.update(
+    COMPRESS_ALGORITHM=COMPRESS_ALGORITHMS,
+    COMPRESS_MIMETYPES=[
+        "text/html",
+        "application/json",
+        NDJSON_MIMETYPE,
+        serializers.MSGPACK_MIMETYPE,
+    ],
+    COMPRESS_MIN_SIZE=COMPRESS_MIN_SIZE,
+    # Brotli's highest qualities are far too slow to use on the fly
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_LEVEL=6,
+    COMPRESS_CACHE_BACKEND=CompressedCache,
+    COMPRESS_CACHE_KEY=compressed_cache_key,
+    # compress_response decides which responses Flask-Compress handles
+    COMPRESS_REGISTER=False,
+)
+compress = Compress(app)
+
+
+def compress_stream(response: Response) -> Response:
+    """
+    Compress a streamed response chunk by chunk as it is sent, rather than
+    buffering the whole body as Flask-Compress would
+
+    Args:
+        response (Response): the streamed response
+
+    Returns:
+        Response: the same response, compressed if the client accepts it
+    """
+    algorithm = request.accept_encodings.best_match(COMPRESS_ALGORITHMS)
+    if (
+        algorithm is None
+        or not 200 <= response.status_code < 300
+        or response.mimetype not in app.config["COMPRESS_MIMETYPES"]
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    if algorithm == "br":
+        compressor = brotli.Compressor(quality=app.config["COMPRESS_BR_LEVEL"])
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        # wbits of 16 + MAX_WBITS gives a gzip header and trailer
+        compressor = zlib.compressobj(
+            app.config["COMPRESS_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS
+        )
+        compress_chunk, finish = compressor.compress, compressor.flush
+
+    chunks = response.iter_encoded()
+
+    def generate():
+        for chunk in chunks:
+            compressed = compress_chunk(chunk)
+            if compressed:
+                yield compressed
+        yield finish()
+
+    response.response = generate()
+    response.headers["Content-Encoding"] = algorithm
+    response.headers.pop("Content-Length", None)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """
+    Compress the response with brotli or gzip, whichever the client prefers,
+    if it's large enough to be worth it (see COMPRESS_MIN_SIZE)
+    """
+    if response.is_streamed:
+        return compress_stream(response)
+    response = compress.after_request(response)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def wants_ndjson() -> bool:
+    """
+    Whether the client asked for newline delimited json, either with
+    ?format=ndjson or an Accept header preferring it
+    """
+    if request.args.get("format") == "ndjson":
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def wants_stream() -> bool:
+    """
+    Whether the client asked for a streamed response, either as ndjson (see
+    wants_ndjson) or with ?stream=1
+    """
+    return wants_ndjson() or request.args.get("stream") in ["1", "true"]
+
+
+def render(data) -> Response:
+    """
+    Build a response holding data as json, or as msgpack if the client's
+    Accept header prefers it (see serializers.negotiate)
+
+    Args:
+        data: the rows or other json serializable data to send
+
+    Returns:
+        Response: the response
+    """
+    mimetype = serializers.negotiate(request.accept_mimetypes)
+    return Response(serializers.dumps(data, mimetype), mimetype=mimetype)
+
+
+def stream_response(model, params: queries.ListParams, ndjson: bool) -> Response:
+    """
+    Stream a listing of model row by row, as a json array or as newline
+    delimited json, so the full result set is never held in memory
+
+    Args:
+        model: the model class to list e.g. Compound
+        params (queries.ListParams): the parsed request arguments
+        ndjson (bool): whether to send newline delimited json rather than a
+            json array
+
+    Returns:
+        Response: the streamed response
+    """
+
+    def generate():
+        with database.connect(mydb, readonly=True) as session:
+            rows = queries.iter_rows(session, model, params, STREAM_BATCH_SIZE)
+            if ndjson:
+                for row in rows:
+                    yield serializers.dumps_json(row)
+                return
+
+            yield b"["
+            for i, row in enumerate(rows):
+                yield (b"," if i else b"") + serializers.dumps_json(row, newline=False)
+            yield b"]\n"
+
+    mimetype = NDJSON_MIMETYPE if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def list_response(model) -> Response:
+    """
+    Build a json or msgpack response (see render) listing model, filtered,
+    sorted, projected and paginated according to the request arguments (see
+    queries.parse_list_args)
+
+    If there are more rows to come, a Link header points to the next page.
+    Responses are streamed instead if the client asks for it (see
+    wants_stream), in which case there is no Link header.
+
+    Args:
+        model: the model class to list e.g. Compound
+
+    Returns:
+        Response: the json response
+    """
+    try:
+        params = queries.parse_list_args(model, request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    if wants_stream():
+        return stream_response(model, params, wants_ndjson())
+
+    with database.connect(mydb, readonly=True) as session:
+        page = queries.list_page(session, model, params)
+
+    response = render(page.rows)
+    if page.next_cursor:
+        args = request.args.to_dict()
+        args["after"] = page.next_cursor
+        # The cursor already starts after the skipped rows
+        args.pop("offset", None)
+        next_url = url_for(request.endpoint, **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def batch_response(model, id_name: str) -> Response:
+    """
+    Build a json or msgpack response (see render) holding every row of model
+    whose id is in the list posted as id_name, e.g. {"compound_ids": [694811, 1175669]}
+
+    Rows come back in the order their ids were posted; ids that don't exist
+    are left out. The fields argument works as it does for listings.
+
+    Args:
+        model: the model class to look up e.g. Compound
+        id_name (str): the key of the list of ids in the posted json
+
+    Returns:
+        Response: the json response
+    """
+    body = request.get_json(silent=True)
+    ids = body.get(id_name) if isinstance(body, dict) else None
+    if not isinstance(ids, list):
+        abort(400, f"Expected a json object holding a list of {id_name}")
+    if len(ids) > MAX_BATCH_IDS:
+        abort(400, f"At most {MAX_BATCH_IDS} {id_name} can be requested at once")
+
+    pk = queries.primary_key(model)
+    try:
+        fields = queries.parse_fields(model, request.args.get("fields"))
+        ids = [queries.coerce_value(pk, str(id)) for id in ids]
+    except ValueError as e:
+        abort(400, str(e))
+
+    with database.connect(mydb, readonly=True) as session:
+        return render(queries.get_by_ids(session, model, ids, fields))
 
 
 @app.route("/api/compounds", methods=["GET"])
+@cached_response
 def api_compounds():
-    with database.connect_to_sqlite(mydb) as session:
-        compounds = session.query(Compound).all()
-        return jsonify(compounds)
+    return list_response(Compound)
 
 
 @app.route("/api/compound/<compound_id>", methods=["GET"])
+@cached_response
 def api_compound(compound_id: str):
-    with database.connect_to_sqlite(mydb) as session:
-        compound = (
-            session.query(Compound)
-            .filter(Compound.compound_id == compound_id)
-            .one_or_none()
+    with database.connect(mydb, readonly=True) as session:
+        return render(queries.get_by_id(session, Compound, compound_id))
+
+
+def thumbnail_args(default_size: int = None) -> tuple:
+    """
+    Parse the size and format arguments of an image request
+
+    Returns:
+        tuple: (size, or default_size if it's missing, format)
+    """
+    size = request.args.get("size", default_size)
+    format = request.args.get("format", images.DEFAULT_FORMAT)
+    try:
+        return (int(size) if size is not None else None), format
+    except ValueError:
+        abort(400, f"Invalid size: {size}")
+
+
+@app.route("/api/compound/<compound_id>/image", methods=["GET"])
+def api_compound_image(compound_id: str):
+    try:
+        compound_id = queries.coerce_value(Compound.compound_id, compound_id)
+    except ValueError:
+        abort(404)
+    with database.connect(mydb, readonly=True) as session:
+        image = queries.compound_images(session, [compound_id]).get(compound_id)
+
+    # The original image unless a thumbnail size is asked for
+    size, format = thumbnail_args()
+    try:
+        if size is None:
+            path, mimetype = images.source_path(image), None
+        else:
+            directory = images.thumbnail_dir(database.local_name(mydb))
+            path = images.thumbnail(directory, image, size, format)
+            mimetype = images.FORMATS[format]
+    except ValueError as e:
+        abort(400, str(e))
+    except RuntimeError as e:
+        abort(503, str(e))
+    if path is None:
+        abort(404)
+    # Conditional so clients can revalidate with the file's ETag, and so
+    # Range requests get partial responses
+    return send_file(
+        os.path.abspath(path),
+        mimetype=mimetype,
+        conditional=True,
+        max_age=IMAGE_MAX_AGE,
+    )
+
+
+@app.route("/api/compounds/sprite", methods=["GET"])
+@cached_response
+def api_compounds_sprite():
+    # e.g. ?compound_ids=694811,1175669&size=64&format=webp&columns=10
+    size, format = thumbnail_args(images.SPRITE_SIZE)
+    try:
+        ids = [
+            queries.coerce_value(Compound.compound_id, id)
+            for id in request.args.get("compound_ids", "").split(",")
+            if id
+        ]
+        if not ids:
+            raise ValueError("Expected a comma separated compound_ids argument")
+        if len(ids) > images.MAX_SPRITE_IMAGES:
+            raise ValueError(
+                f"At most {images.MAX_SPRITE_IMAGES} compound_ids can be requested"
+            )
+        columns = int(request.args.get("columns", images.SPRITE_COLUMNS))
+        if columns < 1:
+            raise ValueError("columns must be at least 1")
+        with database.connect(mydb, readonly=True) as session:
+            paths = queries.compound_images(session, ids)
+        body = images.sprite(
+            images.thumbnail_dir(database.local_name(mydb)),
+            [paths.get(id) for id in ids],
+            size,
+            format,
+            columns,
+        )
+    except ValueError as e:
+        abort(400, str(e))
+    except RuntimeError as e:
+        abort(503, str(e))
+    return Response(body, mimetype=images.FORMATS[format])
+
+
+def count_response(model) -> Response:
+    """
+    Build a json response holding the number of rows of model that match the
+    filters in the request arguments (see queries.parse_filters), e.g.
+    {"count": 42}
+
+    Args:
+        model: the model class to count e.g. Compound
+
+    Returns:
+        Response: the json response
+    """
+    try:
+        params = queries.parse_list_args(model, request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    with database.connect(mydb, readonly=True) as session:
+        return render({"count": queries.count_rows(session, model, params)})
+
+
+@app.route("/api/compounds/count", methods=["GET"])
+@cached_response
+def api_compounds_count():
+    return count_response(Compound)
+
+
+@app.route("/api/compounds/summary", methods=["GET"])
+@cached_response
+def api_compounds_summary():
+    with database.connect(mydb, readonly=True) as session:
+        return render({"trendlines": queries.compound_trendlines(session)})
+
+
+@app.route("/api/compounds/density", methods=["GET"])
+@cached_response
+def api_compounds_density():
+    args = request.args.to_dict()
+    try:
+        bins = int(args.pop("bins", DEFAULT_DENSITY_BINS))
+        if not 1 <= bins <= MAX_DENSITY_BINS:
+            raise ValueError(f"bins must be between 1 and {MAX_DENSITY_BINS}")
+        params = queries.parse_list_args(Compound, args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    with database.connect(mydb, readonly=True) as session:
+        return render(queries.compound_density(session, params, bins))
+
+
+def fingerprint_index() -> fingerprints.FingerprintIndex:
+    """
+    Return the fingerprint index of the latest snapshot, memory-mapping it the
+    first time it's used, or abort with a 503 if there isn't one
+    """
+    directory = snapshot.snapshot_dir(database.local_name(mydb))
+    manifest = snapshot.read_manifest(directory)
+    if manifest is None or "fingerprint" not in manifest["columns"]["compound"]:
+        abort(503, "No fingerprint index, run the transform flow to build one")
+    try:
+        return _load_fingerprint_index(
+            snapshot.current_snapshot(directory), manifest["fingerprint_method"]
         )
-        return jsonify(compound)
+    except ValueError as e:
+        abort(503, str(e))
+
+
+@functools.lru_cache(maxsize=2)
+def _load_fingerprint_index(version_dir: str, method: str):
+    # Keyed by the snapshot's directory, which changes with the dataset version
+    directory = os.path.dirname(version_dir)
+    ids, similarity, screening = (
+        snapshot.load_column(directory, "compound", column)
+        for column in ["compound_id", "fingerprint", "screening_fingerprint"]
+    )
+    return fingerprints.FingerprintIndex(ids, similarity, screening, method)
+
+
+def search_args(default_limit: int) -> tuple:
+    """
+    Parse the smiles, limit and fields arguments of a search
+
+    Returns:
+        tuple: (smiles, limit, fields)
+    """
+    smiles = request.args.get("smiles")
+    try:
+        if not smiles:
+            raise ValueError("Expected a smiles argument")
+        limit = int(request.args.get("limit", default_limit))
+        if not 1 <= limit <= MAX_SEARCH_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+        fields = queries.parse_fields(Compound, request.args.get("fields"))
+    except ValueError as e:
+        abort(400, str(e))
+    return smiles, limit, fields
+
+
+def search_response(rows: list) -> Response:
+    """
+    Render the results of a similarity or substructure search, naming the
+    fingerprints and matching used (see fingerprints.METHOD) in the
+    SEARCH_METHOD_HEADER header: "rdkit" for chemical matching, "ngram" for
+    the SMILES text fallback
+    """
+    response = render(rows)
+    response.headers[SEARCH_METHOD_HEADER] = fingerprints.METHOD
+    return response
+
+
+@app.route("/api/compounds/similar", methods=["GET"])
+def api_compounds_similar():
+    smiles, limit, fields = search_args(DEFAULT_SIMILAR_LIMIT)
+    index = fingerprint_index()
+    try:
+        threshold = float(request.args.get("threshold", 0.0))
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError("threshold must be between 0 and 1")
+        scores = dict(index.similar(smiles, limit, threshold))
+    except ValueError as e:
+        abort(400, str(e))
+
+    # The primary key matches each row to its score even if it wasn't asked for
+    pk = queries.primary_key(Compound).key
+    with database.connect(mydb, readonly=True) as session:
+        rows = queries.get_by_ids(
+            session,
+            Compound,
+            list(scores),
+            queries.parse_fields(Compound, ",".join(fields + [pk])),
+        )
+    for row in rows:
+        row["similarity"] = scores[row[pk]]
+        if pk not in fields:
+            del row[pk]
+    return search_response(rows)
+
+
+@app.route("/api/compounds/substructure", methods=["GET"])
+def api_compounds_substructure():
+    smiles, limit, fields = search_args(DEFAULT_SUBSTRUCTURE_LIMIT)
+    index = fingerprint_index()
+    try:
+        # Only the compounds passing the fingerprint screen are matched exactly
+        candidates = iter(index.screen(smiles).tolist())
+        matches = []
+        with database.connect(mydb, readonly=True) as session:
+            while len(matches) < limit:
+                chunk = list(itertools.islice(candidates, queries.MAX_SQL_VARIABLES))
+                if not chunk:
+                    break
+                rows = queries.compound_smiles(session, chunk)
+                found = fingerprints.has_substructure([row[1] for row in rows], smiles)
+                matches.extend(row[0] for row, match in zip(rows, found) if match)
+            rows = queries.get_by_ids(session, Compound, matches[:limit], fields)
+    except ValueError as e:
+        abort(400, str(e))
+    return search_response(rows)
+
+
+@app.route("/api/compounds/batch", methods=["POST"])
+def api_compounds_batch():
+    return batch_response(Compound, "compound_ids")
 
 
 @app.route("/api/assays", methods=["GET"])
+@cached_response
 def api_assays():
-    with database.connect_to_sqlite(mydb) as session:
-        assays = session.query(Assay).all()
-        return jsonify(assays)
+    return list_response(Assay)
 
 
 @app.route("/api/assay/<result_id>", methods=["GET"])
+@cached_response
 def api_assay(result_id: str):
-    with database.connect_to_sqlite(mydb) as session:
-        assay = session.query(Assay).filter(Assay.result_id == result_id).one_or_none()
-        return jsonify(assay)
+    with database.connect(mydb, readonly=True) as session:
+        return render(queries.get_by_id(session, Assay, result_id))
+
+
+@app.route("/api/assays/count", methods=["GET"])
+@cached_response
+def api_assays_count():
+    return count_response(Assay)
+
+
+@app.route("/api/assays/summary", methods=["GET"])
+@cached_response
+def api_assays_summary():
+    with database.connect(mydb, readonly=True) as session:
+        return render({"counts": queries.assay_counts(session)})
+
+
+@app.route("/api/assays/batch", methods=["POST"])
+def api_assays_batch():
+    return batch_response(Assay, "result_ids")
+
+
+@app.route("/api/columns", methods=["GET"])
+def api_columns():
+    manifest = snapshot.read_manifest(snapshot.snapshot_dir(database.local_name(mydb)))
+    if manifest is None:
+        abort(404, "No columnar snapshot, run the transform flow to write one")
+    columns = {
+        table: {
+            column: {
+                **details,
+                "url": url_for("api_column", table=table, column=column),
+            }
+            for column, details in table_columns.items()
+        }
+        for table, table_columns in manifest["columns"].items()
+    }
+    return jsonify({"version": manifest["version"], "columns": columns})
+
+
+@app.route("/api/columns/<table>/<column>", methods=["GET"])
+def api_column(table, column):
+    path = snapshot.column_path(
+        snapshot.snapshot_dir(database.local_name(mydb)), table, column
+    )
+    if path is None:
+        abort(404)
+    try:
+        # Conditional so clients can revalidate with the file's ETag; the
+        # path includes the dataset version so a new snapshot means a new ETag.
+        # send_file resolves relative paths against the app's root, not cwd.
+        return send_file(
+            os.path.abspath(path), mimetype=NPY_MIMETYPE, conditional=True, max_age=0
+        )
+    except FileNotFoundError:
+        abort(404)
+
+
+@app.route("/api/version", methods=["GET"])
+def api_version():
+    version, updated_at = dataset_version()
+    return jsonify({"version": version, "updated_at": updated_at})
 
 
 @app.route("/")
@@ -0,0 +1,339 @@
+"""
+An ASGI app serving the compound and assay endpoints of app.py -
+/api/compounds, /api/compound/<id>, /api/assays and /api/assay/<id> - with
+the same arguments, responses, caching and conditional requests, for running
+under an asyncio server such as uvicorn (see runservers.py).
+
+Database queries and serialization run in a thread pool, so while a client
+is slow to send its request or read the response it only holds a coroutine,
+not a thread, and one process can keep thousands of them connected.
+
+Responses aren't compressed here; put a compressing proxy in front if
+that's needed.
+
+Run it on its own with:
+
+    uvicorn flaskapp.asgi:app
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+import functools
+import re
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import http_date, is_resource_modified, parse_accept_header
+from werkzeug.urls import url_encode
+
+from flaskapp import app as flaskapp
+from flaskapp import database, queries, serializers
+from flaskapp.models import Assay, Compound
+
+# Threads running db queries and serialization. Any number of clients can be
+# connected, but only this many requests are worked on at once.
+THREADS = 8
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi")
+
+LIST_ROUTES = {"/api/compounds": Compound, "/api/assays": Assay}
+SINGLE_ROUTES = [
+    (re.compile(r"/api/compound/([^/]+)"), Compound),
+    (re.compile(r"/api/assay/([^/]+)"), Assay),
+]
+
+
+# Request headers read by werkzeug's is_resource_modified, and their WSGI keys
+CONDITIONAL_HEADERS = {
+    "if-none-match": "HTTP_IF_NONE_MATCH",
+    "if-modified-since": "HTTP_IF_MODIFIED_SINCE",
+}
+
+
+class HTTPError(Exception):
+    """
+    Raised to answer a request with an error status and a plain text message
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    """
+    The parts of an ASGI http scope the endpoints need
+
+    Args:
+        scope (dict): the ASGI connection scope
+    """
+
+    def __init__(self, scope: dict):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = MultiDict(
+            parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        )
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+
+    def wants_ndjson(self) -> bool:
+        """
+        Whether the client asked for newline delimited json, as in
+        app.wants_ndjson
+        """
+        if self.args.get("format") == "ndjson":
+            return True
+        accept = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        best = accept.best_match(["application/json", flaskapp.NDJSON_MIMETYPE])
+        return best == flaskapp.NDJSON_MIMETYPE
+
+    def wants_stream(self) -> bool:
+        """
+        Whether the client asked for a streamed response, as in
+        app.wants_stream
+        """
+        return self.wants_ndjson() or self.args.get("stream") in ["1", "true"]
+
+    def mimetype(self) -> str:
+        """
+        The format to answer in, json or msgpack, as in app.render
+        """
+        accept = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        return serializers.negotiate(accept)
+
+    def is_modified(self, etag: str, updated_at) -> bool:
+        """
+        Whether the client's copy (if any) is out of date, going by its
+        If-None-Match and If-Modified-Since headers. Compressed responses
+        from app.py carry the etag with the encoding appended.
+        """
+        environ = {"REQUEST_METHOD": self.method}
+        for header, key in CONDITIONAL_HEADERS.items():
+            if header in self.headers:
+                environ[key] = self.headers[header]
+        return all(
+            is_resource_modified(environ, tag, last_modified=updated_at)
+            for tag in [etag]
+            + [f"{etag}:{algorithm}" for algorithm in flaskapp.COMPRESS_ALGORITHMS]
+        )
+
+
+async def run(function, *args):
+    """
+    Run function(*args) in the thread pool and wait for the result
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+async def send_response(
+    send, status: int, body: bytes = b"", headers: dict = None, head: bool = False
+):
+    """
+    Send a complete response; only the headers if head is True
+    """
+    headers = dict(headers or {})
+    if status != 304:
+        headers["content-length"] = str(len(body))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+def list_body(model, request: Request) -> tuple:
+    """
+    Build a listing of model as list_response in app.py does
+
+    Returns:
+        tuple: (body, mimetype, Link header or None), as kept in
+            app.response_cache
+    """
+    try:
+        params = queries.parse_list_args(model, request.args)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+
+    with database.connect(flaskapp.mydb, readonly=True) as session:
+        page = queries.list_page(session, model, params)
+    mimetype = request.mimetype()
+    body = serializers.dumps(page.rows, mimetype)
+    link = None
+    if page.next_cursor:
+        args = request.args.to_dict()
+        args["after"] = page.next_cursor
+        link = f'<{request.path}?{url_encode(args)}>; rel="next"'
+    return body, mimetype, link
+
+
+def single_body(model, id: str, request: Request) -> tuple:
+    """
+    Look up one row of model by primary key, as api_compound and api_assay in
+    app.py do
+
+    Returns:
+        tuple: (body, mimetype, None), as kept in app.response_cache
+    """
+    with database.connect(flaskapp.mydb, readonly=True) as session:
+        row = queries.get_by_id(session, model, id)
+    mimetype = request.mimetype()
+    return serializers.dumps(row, mimetype), mimetype, None
+
+
+async def cached_response(send, request: Request, build, *args):
+    """
+    Answer request from app.response_cache, with the same key, ETag and
+    validators as app.cached_response, calling build(*args) in the thread
+    pool to make the response if it isn't cached
+    """
+    version, updated_at = await run(flaskapp.dataset_version)
+    key = (
+        version,
+        request.path,
+        tuple(sorted(request.args.items(multi=True))),
+        request.mimetype(),
+    )
+    etag = flaskapp.response_etag(key)
+    headers = {"etag": f'"{etag}"', "cache-control": "no-cache", "vary": "Accept"}
+    if updated_at:
+        headers["last-modified"] = http_date(updated_at)
+
+    if not request.is_modified(etag, updated_at):
+        await send_response(send, 304, headers=headers)
+        return
+
+    cached = flaskapp.response_cache.get(key)
+    if cached is None:
+        cached = await run(build, *args)
+        flaskapp.response_cache.set(key, cached, size=len(cached[0]))
+
+    body, mimetype, link = cached
+    headers["content-type"] = mimetype
+    if link:
+        headers["link"] = link
+    await send_response(send, 200, body, headers, head=request.method == "HEAD")
+
+
+def list_batch(model, params: queries.ListParams) -> queries.Page:
+    """
+    Fetch one batch of a streamed listing, in a session of its own so no
+    thread is held between batches
+    """
+    with database.connect(flaskapp.mydb, readonly=True) as session:
+        return queries.list_page(session, model, params)
+
+
+async def stream_response(send, model, request: Request):
+    """
+    Stream a listing of model as stream_response in app.py does, fetching
+    STREAM_BATCH_SIZE rows at a time by cursor and sending each batch as the
+    client reads it
+    """
+    try:
+        params = queries.parse_list_args(model, request.args)
+    except ValueError as e:
+        raise HTTPError(400, str(e))
+    ndjson = request.wants_ndjson()
+    mimetype = flaskapp.NDJSON_MIMETYPE if ndjson else "application/json"
+
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", mimetype.encode())],
+        }
+    )
+    sent, remaining = 0, params.limit
+    opening = b"" if ndjson else b"["
+    batch_params = params
+    while remaining is None or remaining > 0:
+        size = flaskapp.STREAM_BATCH_SIZE
+        if remaining is not None:
+            size = min(size, remaining)
+            remaining -= size
+        page = await run(
+            list_batch, model, dataclasses.replace(batch_params, limit=size)
+        )
+
+        rows = [serializers.dumps_json(row, newline=ndjson) for row in page.rows]
+        if ndjson:
+            chunk = b"".join(rows)
+        else:
+            chunk = opening + (b"," if sent and rows else b"") + b",".join(rows)
+            opening = b""
+        sent += len(rows)
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if not page.next_cursor:
+            break
+        batch_params = dataclasses.replace(
+            params,
+            after=queries.decode_cursor(page.next_cursor, model, params.sort_name),
+            offset=0,
+        )
+
+    closing = b"" if ndjson else b"]\n"
+    await send({"type": "http.response.body", "body": closing})
+
+
+async def lifespan(receive, send):
+    """
+    Answer the server's startup and shutdown messages
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: dict, receive, send):
+    """
+    The ASGI application
+    """
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope)
+    try:
+        if request.path in LIST_ROUTES:
+            route = (LIST_ROUTES[request.path], None)
+        else:
+            route = next(
+                (
+                    (model, match.group(1))
+                    for pattern, model in SINGLE_ROUTES
+                    for match in [pattern.fullmatch(request.path)]
+                    if match
+                ),
+                None,
+            )
+        if route is None:
+            raise HTTPError(404, "Not Found")
+        if request.method not in ["GET", "HEAD"]:
+            raise HTTPError(405, "Method Not Allowed")
+
+        model, id = route
+        if id is not None:
+            await cached_response(send, request, single_body, model, id, request)
+        elif request.wants_stream():
+            await stream_response(send, model, request)
+        else:
+            await cached_response(send, request, list_body, model, request)
+    except HTTPError as e:
+        headers = {"content-type": "text/plain; charset=utf-8"}
+        if e.status == 405:
+            headers["allow"] = "GET, HEAD"
+        await send_response(send, e.status, e.message.encode(), headers)
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+
+class LRUCache:
+    """
+    A thread-safe least recently used cache, bounded both by the number of
+    entries and by their total size in bytes
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_entries (int): the most entries to hold at once
+            max_bytes (int): the most bytes of values to hold at once
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under key (marking it as recently used), or
+        default if there isn't one
+        """
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value, size: int = 0):
+        """
+        Cache value under key, evicting the least recently used entries to
+        stay within the limits. Values bigger than max_bytes aren't cached.
+
+        Args:
+            key: the key to cache under
+            value: the value to cache
+            size (int): the size of value in bytes
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+
+    def _discard(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self._bytes -= self._sizes.pop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache:
+    """
+    A least recently used cache of pickled values in a directory, bounded by
+    their total size in bytes, which several processes can share
+
+    Files are written atomically, so readers never see a partial value.
+    Recency is tracked by file modification time.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            directory (str): where to keep the cache files; created if needed
+            max_bytes (int): the most bytes of files to hold at once
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pickle")
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under key (marking it as recently used), or
+        default if there isn't one
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # Missing, or removed by another process while we read it
+            return default
+        return value
+
+    def set(self, key, value, size: int = 0):
+        """
+        Cache value under key, removing the least recently used files to stay
+        within max_bytes
+
+        Args:
+            key: the key to cache under; its repr must identify it
+            value: the picklable value to cache
+            size (int): unused; the size of the pickled value is used instead
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, self._path(key))
+        self._prune()
+
+    def _prune(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove every entry
+        """
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pickle"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
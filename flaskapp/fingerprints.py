@@ -0,0 +1,305 @@
+"""
+Bit-vector fingerprints of compound SMILES for similarity and substructure
+search.
+
+Each compound gets two fingerprints of FINGERPRINT_BITS bits, packed into
+bytes: one scored against a query's with the Tanimoto coefficient for
+similarity search, and one used to screen out compounds that can't contain a
+query before the exact (and much slower) substructure match. The ETL flow
+stores them in the columnar snapshot, see snapshot.py.
+
+With RDKit installed these are Morgan (radius 2) and pattern fingerprints
+and substructures are matched chemically. Without it they're hashed
+character n-grams of the SMILES string and a substructure is a substring of
+the SMILES, which is much cruder but needs nothing beyond NumPy.
+"""
+import numpy as np
+
+try:
+    from rdkit import Chem, DataStructs, RDLogger
+    from rdkit.Chem import rdFingerprintGenerator
+
+    # RDKit logs every SMILES it can't parse; those are reported as errors
+    RDLogger.DisableLog("rdApp.*")
+except ImportError:
+    Chem = None
+
+FINGERPRINT_BITS = 1024
+FINGERPRINT_BYTES = FINGERPRINT_BITS // 8
+METHOD = "rdkit" if Chem is not None else "ngram"
+
+# Lengths of the SMILES substrings hashed into the n-gram fingerprints
+NGRAM_SIZES = range(1, 5)
+# Multiplier for the rolling n-gram hash and for spreading it over the bits
+NGRAM_PRIME = np.uint64(1000003)
+NGRAM_MIX = np.uint64(0x9E3779B97F4A7C15)
+NGRAM_SHIFT = np.uint64(64 - FINGERPRINT_BITS.bit_length() + 1)
+
+# SMILES fingerprinted at a time, and fingerprint rows scored at a time
+BATCH_SIZE = 65536
+
+# Bits set in each byte, for NumPy versions without bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def batches(length: int) -> list:
+    """
+    Return the slices that split range(length) into BATCH_SIZE pieces
+    """
+    return [slice(start, start + BATCH_SIZE) for start in range(0, length, BATCH_SIZE)]
+
+
+def words(array: np.ndarray) -> np.ndarray:
+    """
+    View the rows of a 2d uint8 array as 64 bit words where they fit, so
+    bitwise operations take an eighth of the steps
+    """
+    array = np.ascontiguousarray(array)
+    return array.view(np.uint64) if array.shape[1] % 8 == 0 else array
+
+
+def popcount(array: np.ndarray) -> np.ndarray:
+    """
+    Count the bits set in each row of a 2d uint8 array
+
+    Returns:
+        np.ndarray: the count for each row
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words(array)).sum(axis=1, dtype=np.int64)
+    return _POPCOUNT[array].sum(axis=1, dtype=np.int64)
+
+
+def ngram_fingerprints(smiles: list) -> np.ndarray:
+    """
+    Hash every substring of each SMILES with a length in NGRAM_SIZES into
+    FINGERPRINT_BITS bits. A SMILES contained in another sets a subset of
+    its bits.
+
+    Args:
+        smiles (list): the SMILES strings
+
+    Returns:
+        np.ndarray: uint8 array of shape (len(smiles), FINGERPRINT_BYTES)
+    """
+    encoded = [s.encode() for s in smiles]
+    lengths = np.array([len(s) for s in encoded], dtype=np.int64)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    rows = np.repeat(np.arange(len(encoded)), lengths)
+    # How many characters are left in the SMILES from each position
+    remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(len(data))
+
+    bits = np.zeros((len(encoded), FINGERPRINT_BITS), dtype=bool)
+    code = np.zeros(len(data), dtype=np.uint64)
+    for size in NGRAM_SIZES:
+        # code[i] becomes the hash of data[i:i + size]
+        end = len(data) - size + 1
+        if end <= 0:
+            break
+        code[:end] = code[:end] * NGRAM_PRIME + data[-end:]
+        starts = np.flatnonzero(remaining[:end] >= size)
+        bits[rows[starts], (code[starts] * NGRAM_MIX) >> NGRAM_SHIFT] = True
+    return np.packbits(bits, axis=1, bitorder="little")
+
+
+def parse_smiles(smiles: str):
+    """
+    Parse a SMILES string into an RDKit molecule
+
+    Raises:
+        ValueError: if RDKit can't parse it
+    """
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        raise ValueError(f"Invalid SMILES: {smiles}")
+    return mol
+
+
+def rdkit_fingerprints(smiles: list) -> tuple:
+    """
+    Work out the Morgan and pattern fingerprints of each SMILES with RDKit.
+    SMILES it can't parse get empty fingerprints, so they never match.
+
+    Returns:
+        tuple: (Morgan, pattern) uint8 arrays of shape
+            (len(smiles), FINGERPRINT_BYTES)
+    """
+    generator = rdFingerprintGenerator.GetMorganGenerator(
+        radius=2, fpSize=FINGERPRINT_BITS
+    )
+    morgan = np.zeros((len(smiles), FINGERPRINT_BITS), dtype=np.uint8)
+    pattern = np.zeros((len(smiles), FINGERPRINT_BITS), dtype=np.uint8)
+    for i, s in enumerate(smiles):
+        mol = Chem.MolFromSmiles(s or "")
+        if mol is None:
+            continue
+        morgan[i] = generator.GetFingerprintAsNumPy(mol)
+        DataStructs.ConvertToNumpyArray(
+            Chem.PatternFingerprint(mol, fpSize=FINGERPRINT_BITS), pattern[i]
+        )
+    return (
+        np.packbits(morgan, axis=1, bitorder="little"),
+        np.packbits(pattern, axis=1, bitorder="little"),
+    )
+
+
+def fingerprint(smiles: list) -> tuple:
+    """
+    Work out the similarity and screening fingerprints of each SMILES, with
+    RDKit if it's installed, BATCH_SIZE at a time
+
+    Args:
+        smiles (list): the SMILES strings; None is treated as empty
+
+    Returns:
+        tuple: (similarity, screening) uint8 arrays of shape
+            (len(smiles), FINGERPRINT_BYTES)
+    """
+    similarity, screening = [], []
+    for rows in batches(len(smiles)):
+        batch = [s or "" for s in smiles[rows]]
+        if Chem is not None:
+            morgan, pattern = rdkit_fingerprints(batch)
+        else:
+            morgan = pattern = ngram_fingerprints(batch)
+        similarity.append(morgan)
+        screening.append(pattern)
+    if not similarity:
+        empty = np.zeros((0, FINGERPRINT_BYTES), dtype=np.uint8)
+        return empty, empty
+    return np.concatenate(similarity), np.concatenate(screening)
+
+
+def query_fingerprint(smiles: str) -> tuple:
+    """
+    Work out the fingerprints of one query SMILES
+
+    Raises:
+        ValueError: if the SMILES is empty or RDKit can't parse it
+
+    Returns:
+        tuple: (similarity, screening) uint8 arrays of FINGERPRINT_BYTES
+    """
+    if not smiles:
+        raise ValueError("Expected a SMILES string")
+    if Chem is not None:
+        parse_smiles(smiles)
+    similarity, screening = fingerprint([smiles])
+    return similarity[0], screening[0]
+
+
+def has_substructure(smiles: list, query: str) -> list:
+    """
+    Check which SMILES contain the query exactly, chemically with RDKit or as
+    a substring without it
+
+    Returns:
+        list: a bool for each SMILES
+    """
+    if Chem is None:
+        return [query in (s or "") for s in smiles]
+    pattern = parse_smiles(query)
+    matches = []
+    for s in smiles:
+        mol = Chem.MolFromSmiles(s or "")
+        matches.append(mol is not None and mol.HasSubstructMatch(pattern))
+    return matches
+
+
+class FingerprintIndex:
+    """
+    Search the fingerprints of many compounds, held as (n, FINGERPRINT_BYTES)
+    uint8 arrays which may be memory-mapped
+
+    Args:
+        ids (np.ndarray): the compound_id of each row
+        similarity (np.ndarray): the similarity fingerprint of each row
+        screening (np.ndarray): the screening fingerprint of each row
+        method (str): how the fingerprints were made, which must match
+            METHOD for queries to be comparable
+
+    Raises:
+        ValueError: if method isn't METHOD
+    """
+
+    def __init__(self, ids, similarity, screening, method: str):
+        if method != METHOD:
+            raise ValueError(
+                f"The fingerprints were made with {method} but {METHOD} is in "
+                "use here; run the transform flow again to rebuild them"
+            )
+        self.ids = ids
+        self.similarity = similarity
+        self.screening = screening
+        self._counts = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def counts(self) -> np.ndarray:
+        # Bits set in each similarity fingerprint, worked out on first use
+        if self._counts is None:
+            self._counts = np.concatenate(
+                [
+                    popcount(np.asarray(self.similarity[rows]))
+                    for rows in batches(len(self))
+                ]
+                or [np.zeros(0, dtype=np.int64)]
+            )
+        return self._counts
+
+    def similar(self, smiles: str, k: int, threshold: float = 0.0) -> list:
+        """
+        Find the k compounds most similar to smiles by the Tanimoto
+        coefficient of their fingerprints
+
+        Args:
+            smiles (str): the query SMILES
+            k (int): the most compounds to return
+            threshold (float): the least similarity to return
+
+        Raises:
+            ValueError: if the SMILES is invalid
+
+        Returns:
+            list: (compound_id, similarity) tuples, most similar first
+        """
+        query = query_fingerprint(smiles)[0]
+        query_count = popcount(query[np.newaxis])[0]
+        scores = np.empty(len(self), dtype=np.float64)
+        for rows in batches(len(self)):
+            common = popcount(np.bitwise_and(self.similarity[rows], query))
+            union = self.counts[rows] + query_count - common
+            # Two empty fingerprints have nothing in common
+            scores[rows] = np.where(union > 0, common / np.maximum(union, 1), 0.0)
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((self.ids[top], -scores[top]))]
+        return [
+            (int(self.ids[i]), float(scores[i])) for i in top if scores[i] >= threshold
+        ]
+
+    def screen(self, smiles: str) -> np.ndarray:
+        """
+        Find the compounds whose screening fingerprint has every bit of the
+        query's set; only these can contain the query
+
+        Raises:
+            ValueError: if the SMILES is invalid
+
+        Returns:
+            np.ndarray: the candidate compound_ids in index order
+        """
+        query = words(query_fingerprint(smiles)[1][np.newaxis])
+        candidates = []
+        for rows in batches(len(self)):
+            block = words(self.screening[rows])
+            hit = (np.bitwise_and(block, query) == query).all(axis=1)
+            candidates.append(np.asarray(self.ids[rows])[hit])
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(candidates)
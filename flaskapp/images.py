@@ -0,0 +1,169 @@
+"""
+Structure images of the compounds, and thumbnails and sprites made from them.
+
+Compound.image holds the path of each image relative to the data directory,
+e.g. images/27648.png. Thumbnails are made on first request and kept on disk
+next to the db, under {db name}_thumbnails/{size}/, so each is only resized
+once; one older than its image is made again.
+
+A sprite is one image holding the thumbnails of many compounds in a grid,
+tile i of a sprite with c columns and tiles of s pixels sitting at
+((i % c) * s, (i // c) * s). Compounds without an image get an empty tile.
+
+Thumbnails and sprites need Pillow; without it only the original images can
+be served.
+"""
+import io
+import os
+import tempfile
+
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+IMAGES_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+# Thumbnail sizes (the longest side, in pixels) that can be requested; a
+# handful keeps the disk cache from growing with every size a client asks for
+THUMBNAIL_SIZES = [32, 64, 128, 256]
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+DEFAULT_FORMAT = "webp" if Image is not None and features.check("webp") else "png"
+
+# Tile size and tiles per row of a sprite, by default
+SPRITE_SIZE = 64
+SPRITE_COLUMNS = 10
+MAX_SPRITE_IMAGES = 500
+
+# Encoder settings for each format
+SAVE_OPTIONS = {"png": {"optimize": True}, "webp": {"quality": 80, "method": 4}}
+
+
+def source_path(image: str) -> str:
+    """
+    Return the path of an image named by Compound.image, or None if it would
+    lie outside IMAGES_ROOT or doesn't exist
+    """
+    path = safe_join(IMAGES_ROOT, image) if image else None
+    return path if path and os.path.isfile(path) else None
+
+
+def thumbnail_dir(db_name: str) -> str:
+    """
+    Return the directory caching the thumbnails made for the sqlite db at
+    db_name
+
+    Args:
+        db_name (str): the name of the sqlite db without the .sqlite extension
+    """
+    return f"{db_name}_thumbnails"
+
+
+def check_thumbnail_args(size: int, format: str):
+    """
+    Check a thumbnail of size pixels can be made in format
+
+    Raises:
+        ValueError: if size or format can't be made
+        RuntimeError: if Pillow isn't installed
+    """
+    if size not in THUMBNAIL_SIZES:
+        sizes = ", ".join(str(s) for s in THUMBNAIL_SIZES)
+        raise ValueError(f"size must be one of {sizes}")
+    if format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if Image is None:
+        raise RuntimeError("Thumbnails need Pillow, install it to make them")
+
+
+def thumbnail(directory: str, image: str, size: int, format: str) -> str:
+    """
+    Return the path of a thumbnail of an image, making it first if it isn't
+    in directory or is older than the image
+
+    Args:
+        directory (str): the thumbnail cache, see thumbnail_dir
+        image (str): the image's path, as in Compound.image
+        size (int): the longest side of the thumbnail, one of THUMBNAIL_SIZES
+        format (str): one of FORMATS
+
+    Raises:
+        ValueError: if size or format can't be made
+        RuntimeError: if Pillow isn't installed
+
+    Returns:
+        str: the path of the thumbnail, or None if the image doesn't exist
+    """
+    check_thumbnail_args(size, format)
+    source = source_path(image)
+    if source is None:
+        return None
+
+    name = os.path.splitext(os.path.relpath(source, IMAGES_ROOT))[0]
+    path = os.path.join(directory, str(size), f"{name}.{format}")
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(source):
+            return path
+    except OSError:
+        pass
+
+    with Image.open(source) as original:
+        original.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        original.save(buffer, format=format.upper(), **SAVE_OPTIONS[format])
+
+    # Write to a temporary file and rename it into place, so concurrent
+    # requests never see half a thumbnail
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    with os.fdopen(fd, "wb") as file:
+        file.write(buffer.getvalue())
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+    return path
+
+
+def sprite(
+    directory: str,
+    images: list,
+    size: int,
+    format: str,
+    columns: int = SPRITE_COLUMNS,
+) -> bytes:
+    """
+    Draw the thumbnails of many images into one sprite, in rows of columns
+    tiles of size pixels, each thumbnail centred in its tile
+
+    Args:
+        directory (str): the thumbnail cache, see thumbnail_dir
+        images (list): the image paths, as in Compound.image; None leaves
+            its tile empty
+        size (int): the size of each tile, one of THUMBNAIL_SIZES
+        format (str): one of FORMATS
+        columns (int): the number of tiles in each row
+
+    Raises:
+        ValueError: if size or format can't be made
+        RuntimeError: if Pillow isn't installed
+
+    Returns:
+        bytes: the encoded sprite
+    """
+    check_thumbnail_args(size, format)
+    rows = max(-(-len(images) // columns), 1)
+    width = max(min(len(images), columns), 1) * size
+    canvas = Image.new("RGBA", (width, rows * size))
+    for i, image in enumerate(images):
+        path = thumbnail(directory, image, size, format) if image else None
+        if path is None:
+            continue
+        with Image.open(path) as tile:
+            x = (i % columns) * size + (size - tile.width) // 2
+            y = (i // columns) * size + (size - tile.height) // 2
+            canvas.paste(tile.convert("RGBA"), (x, y))
+
+    buffer = io.BytesIO()
+    canvas.save(buffer, format=format.upper(), **SAVE_OPTIONS[format])
+    return buffer.getvalue()
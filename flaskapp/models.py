@@ -1,6 +1,17 @@
 from dataclasses import dataclass
 
-from sqlalchemy import Column, Enum, Float, ForeignKey, Integer, String, Table
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Table,
+)
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -11,10 +22,37 @@ compound_assay = Table(
     "compound_assay",
     Base.metadata,
     Column("compound_id", Integer, ForeignKey("compound.compound_id")),
-    Column("result_id", Integer, ForeignKey("assay.result_id")),
+    Column("result_id", Integer, ForeignKey("assay.result_id"), index=True),
+    # Lets the ETL insert links with ON CONFLICT DO NOTHING
+    Index("ux_compound_assay", "compound_id", "result_id", unique=True),
 )
 
 
+class AssayValue(Integer):
+    """
+    The type of Assay.value: an integer column, which sqlite lets hold the
+    fractional values as they are but PostgreSQL would round, so it's a
+    double precision column there. Whole numbers are read back as ints from
+    either, as sqlite stores them.
+    """
+
+    def result_processor(self, dialect, coltype):
+        if dialect.name != "postgresql":
+            return super().result_processor(dialect, coltype)
+
+        def process(value):
+            if value is not None and value.is_integer():
+                return int(value)
+            return value
+
+        return process
+
+
+@compiles(AssayValue, "postgresql")
+def compile_assay_value(type_, compiler, **kw):
+    return "DOUBLE PRECISION"
+
+
 # define the Compound class model to the compound database table
 @dataclass
 class Compound(Base):
@@ -31,10 +69,10 @@ class Compound(Base):
 
     compound_id = Column(Integer, primary_key=True)
     smiles = Column(String)
-    molecular_weight = Column(Float)
-    ALogP = Column(Float)
+    molecular_weight = Column(Float, index=True)
+    ALogP = Column(Float, index=True)
     molecular_formula = Column(String)
-    num_rings = Column(Integer)
+    num_rings = Column(Integer, index=True)
     image = Column(String)
     assay_results = relationship(
         "Assay", secondary=compound_assay, back_populates="compounds"
@@ -51,6 +89,8 @@ class Compound(Base):
 @dataclass
 class Assay(Base):
     __tablename__ = "assay"
+    # Covers the target/result counts behind the assays summary
+    __table_args__ = (Index("ix_assay_target_result", "target", "result"),)
 
     result_id: int
     target: str
@@ -60,10 +100,13 @@ class Assay(Base):
     unit: str
 
     result_id = Column(Integer, primary_key=True)
-    target = Column(String)
-    result = Column(Enum("IC50", "Ki", "Kd"))
-    operator = Column(Enum("=", ">", "<", "<=", ">=", "~", "*"))
-    value = Column(Integer)
+    target = Column(String, index=True)
+    # PostgreSQL needs a name for each enum type; sqlite ignores it
+    result = Column(Enum("IC50", "Ki", "Kd", name="assay_result"), index=True)
+    operator = Column(
+        Enum("=", ">", "<", "<=", ">=", "~", "*", name="assay_operator"), index=True
+    )
+    value = Column(AssayValue, index=True)
     unit = Column(String)
     compounds = relationship(
         "Compound", secondary=compound_assay, back_populates="assay_results"
@@ -71,3 +114,42 @@ class Assay(Base):
 
     def __repr__(self):
         return f"<Assay object with result_id={self.result_id}>"
+
+
+# The ETL flow's bookkeeping tables, not served by the API
+
+# define the CompoundHash class model to the compound_hash database table
+class CompoundHash(Base):
+    __tablename__ = "compound_hash"
+
+    compound_id = Column(Integer, ForeignKey("compound.compound_id"), primary_key=True)
+    # hash of the compound's json record, including its assay results
+    content_hash = Column(String)
+
+    def __repr__(self):
+        return f"<CompoundHash object with compound_id={self.compound_id}>"
+
+
+# define the SourceFile class model to the source_file database table
+class SourceFile(Base):
+    __tablename__ = "source_file"
+
+    path = Column(String, primary_key=True)
+    checksum = Column(String)
+    loaded_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<SourceFile object with path={self.path}>"
+
+
+# define the DatasetVersion class model to the dataset_version database table,
+# which holds a single row bumped whenever the ETL flow changes the data
+class DatasetVersion(Base):
+    __tablename__ = "dataset_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer)
+    updated_at = Column(DateTime)
+
+    def __repr__(self):
+        return f"<DatasetVersion object with version={self.version}>"
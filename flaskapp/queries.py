@@ -0,0 +1,816 @@
+import base64
+import binascii
+import itertools
+import json
+from dataclasses import dataclass, fields as dataclass_fields
+
+from sqlalchemy import Integer, String, and_, cast, func, or_, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from flaskapp.models import Assay, Compound, DatasetVersion
+
+# Query parameters that aren't filters
+RESERVED_ARGS = {"after", "offset", "limit", "sort", "fields", "format", "stream"}
+
+# Columns that can be filtered or sorted on, per model. Apart from the free
+# text molecular_formula and unit, every one of these is indexed in models.py
+# so filters and keyset pages don't scan the table.
+FILTERABLE_COLUMNS = {
+    Compound: {
+        "compound_id",
+        "molecular_weight",
+        "ALogP",
+        "molecular_formula",
+        "num_rings",
+    },
+    Assay: {"result_id", "target", "result", "operator", "value", "unit"},
+}
+
+# Filter operators, used as e.g. ?molecular_weight__gte=400
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "in": lambda column, value: column.in_(value),
+    "contains": lambda column, value: column.contains(value, autoescape=True),
+}
+
+# Most ids looked up by get_by_ids in one IN query; sqlite allows 999 bound
+# variables per statement
+MAX_SQL_VARIABLES = 900
+
+# Relationships that can be requested with fields=. Each is a many to many
+# through an association table, see models.py.
+RELATIONSHIPS = {
+    Compound: {"assay_results": Compound.assay_results},
+    Assay: {},
+}
+
+
+@dataclass
+class Page:
+    """
+    One page of serialized rows from list_page
+    """
+
+    rows: list
+    next_cursor: str = None
+
+
+@dataclass
+class ListParams:
+    """
+    The validated arguments of a listing request, from parse_list_args
+    """
+
+    fields: list
+    filters: list
+    sort_name: str
+    descending: bool
+    limit: int = None
+    after: list = None
+    offset: int = 0
+
+
+def primary_key(model):
+    """
+    Return the primary key column of model e.g. Compound.compound_id
+    """
+    return getattr(model, model.__mapper__.primary_key[0].name)
+
+
+def chunks(ids: list, size: int = MAX_SQL_VARIABLES):
+    """
+    Split ids into lists of at most size, by default MAX_SQL_VARIABLES for
+    IN queries
+    """
+    remaining = iter(ids)
+    while True:
+        chunk = list(itertools.islice(remaining, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_fields(model, fields: str = None) -> list:
+    """
+    Turn a comma separated fields= argument into a list of field names,
+    defaulting to every dataclass field of model
+
+    Args:
+        model: the model class e.g. Compound
+        fields (str): the fields requested e.g. "compound_id,smiles"
+
+    Raises:
+        ValueError: if any of the requested fields don't exist on model
+
+    Returns:
+        list: the field names to return, in model order
+    """
+    available = [field.name for field in dataclass_fields(model)]
+    if not fields:
+        return available
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(available)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return [field for field in available if field in requested]
+
+
+def coerce_value(column, raw: str):
+    """
+    Convert a raw query string value to the python type of column
+
+    Args:
+        column: the column the value will be compared against
+        raw (str): the value from the query string
+
+    Raises:
+        ValueError: if raw can't be converted
+
+    Returns:
+        the converted value
+    """
+    python_type = column.type.python_type
+    if python_type is int:
+        # Integer columns can still hold non-integer values in sqlite
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if python_type is float:
+        return float(raw)
+    return raw
+
+
+def parse_filters(model, args: dict) -> list:
+    """
+    Pull the filters out of the request arguments
+
+    Filters take the form column=value or column__operator=value, where the
+    operator is one of OPERATORS. For "in" the value is comma separated, and
+    "contains" only works on text columns.
+
+    Args:
+        model: the model class being queried
+        args (dict): the request arguments
+
+    Raises:
+        ValueError: if a filter names an unknown column, operator or has a
+            value of the wrong type
+
+    Returns:
+        list: (column name, operator, converted value) for each filter
+    """
+    filters = []
+    for key, raw in args.items():
+        if key in RESERVED_ARGS:
+            continue
+        name, _, op = key.partition("__")
+        op = op or "eq"
+        if name not in FILTERABLE_COLUMNS[model]:
+            raise ValueError(f"Cannot filter on {name}")
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown filter operator {op}")
+
+        column = getattr(model, name)
+        if op == "contains" and column.type.python_type is not str:
+            raise ValueError(f"Cannot use contains on {name}")
+        try:
+            if op == "in":
+                value = [coerce_value(column, v) for v in raw.split(",")]
+            else:
+                value = coerce_value(column, raw)
+        except ValueError:
+            raise ValueError(f"Invalid value for {key}: {raw}")
+        filters.append((name, op, value))
+    return filters
+
+
+def apply_filters(query, model, filters: list):
+    """
+    Add a WHERE clause to query for every filter from parse_filters
+    """
+    for name, op, value in filters:
+        query = query.filter(OPERATORS[op](getattr(model, name), value))
+    return query
+
+
+def parse_sort(model, sort: str = None) -> tuple:
+    """
+    Turn a sort= argument e.g. "-molecular_weight" into a column name and
+    direction, defaulting to the primary key ascending
+
+    Args:
+        model: the model class being queried
+        sort (str): the column to sort by, prefixed with - for descending
+
+    Raises:
+        ValueError: if the column can't be sorted on
+
+    Returns:
+        tuple: (column name, True if descending)
+    """
+    if not sort:
+        return primary_key(model).key, False
+    descending = sort.startswith("-")
+    name = sort.lstrip("-+")
+    if name not in FILTERABLE_COLUMNS[model]:
+        raise ValueError(f"Cannot sort on {name}")
+    return name, descending
+
+
+def encode_cursor(values: list) -> str:
+    """
+    Encode the sort key of the last row of a page as an opaque cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, model, sort_name: str) -> list:
+    """
+    Decode a cursor made by encode_cursor for a listing of model sorted by
+    sort_name
+
+    Raises:
+        ValueError: if the cursor isn't one we made
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid cursor")
+    sort_value, pk_value = values
+    if not (
+        is_value_of(primary_key(model), pk_value)
+        and (sort_value is None or is_value_of(getattr(model, sort_name), sort_value))
+    ):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def is_value_of(column, value) -> bool:
+    """
+    Whether a value decoded from json can be compared against column
+    """
+    python_type = column.type.python_type
+    # bool is a subclass of int, but never a value of ours
+    if isinstance(value, bool):
+        return False
+    if python_type is int and column.primary_key:
+        return isinstance(value, int)
+    if python_type in [int, float]:
+        # Integer columns can still hold non-integer values in sqlite
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+
+def apply_keyset(query, model, sort_name: str, descending: bool, after: list):
+    """
+    Order query by the sort column (then the primary key as a tie break) and,
+    if a cursor is given, only return rows that come after it
+
+    NULLs in the sort column sort before every value, as sqlite sorts them,
+    so they come first in ascending order and last in descending order;
+    PostgreSQL is told to do the same.
+
+    Args:
+        query: the query to order
+        model: the model class being queried
+        sort_name (str): the column to sort by
+        descending (bool): whether to sort in descending order
+        after (list): the decoded cursor of the previous page, or None for
+            the first page
+
+    Returns:
+        the ordered query
+    """
+    pk = primary_key(model)
+    sort_column = getattr(model, sort_name)
+
+    if sort_column is pk:
+        if after:
+            last_pk = after[1]
+            query = query.filter(pk < last_pk if descending else pk > last_pk)
+        return query.order_by(pk.desc() if descending else pk)
+
+    if after:
+        last_sort_value, last_pk = after
+        if last_sort_value is None:
+            tie = and_(
+                sort_column.is_(None), pk < last_pk if descending else pk > last_pk
+            )
+            # Every value comes after the NULLs in ascending order, and none
+            # of them in descending order
+            query = query.filter(
+                tie if descending else or_(tie, sort_column.isnot(None))
+            )
+        elif descending:
+            query = query.filter(
+                or_(
+                    sort_column < last_sort_value,
+                    and_(sort_column == last_sort_value, pk < last_pk),
+                    sort_column.is_(None),
+                )
+            )
+        else:
+            query = query.filter(
+                or_(
+                    sort_column > last_sort_value,
+                    and_(sort_column == last_sort_value, pk > last_pk),
+                )
+            )
+
+    if descending:
+        return query.order_by(sort_column.desc().nullslast(), pk.desc())
+    return query.order_by(sort_column.asc().nullsfirst(), pk)
+
+
+def select_fields(model, fields: list, extra: list = None):
+    """
+    Build a Core select of just the columns in fields, followed by any extra
+    column names not already among them, so rows come back as plain tuples
+    rather than model instances tracked by the session
+
+    Args:
+        model: the model class being queried
+        fields (list): the field names from parse_fields; relationships are
+            left for serialize_rows to load
+        extra (list): more column names needed, e.g. to build a cursor
+
+    Returns:
+        the select
+    """
+    relationships = RELATIONSHIPS[model]
+    names = [f for f in fields if f not in relationships] + (extra or [])
+    return select(*[getattr(model, name) for name in dict.fromkeys(names)])
+
+
+def related_rows(session, relationship, ids: list) -> dict:
+    """
+    Look up the rows linked to many rows through a many to many relationship,
+    with one joined query per MAX_SQL_VARIABLES ids
+
+    Args:
+        session: the session to query with
+        relationship: the relationship e.g. Compound.assay_results
+        ids (list): the primary keys of the rows to look up the links of
+
+    Returns:
+        dict: the linked rows of each id, serialized with every field, for
+            the ids that have any
+    """
+    prop = relationship.property
+    target = prop.mapper.class_
+    # The association table's columns pointing at each side
+    local = prop.synchronize_pairs[0][1]
+    remote_pk, remote = prop.secondary_synchronize_pairs[0]
+    names = parse_fields(target)
+    query = (
+        select(local, *[getattr(target, name) for name in names])
+        .join_from(prop.secondary, target, remote == remote_pk)
+        .order_by(local, remote)
+    )
+
+    related = {}
+    for chunk in chunks(ids):
+        for id, *values in session.execute(query.where(local.in_(chunk))):
+            related.setdefault(id, []).append(dict(zip(names, values)))
+    return related
+
+
+def serialize_rows(session, model, rows: list, columns: list, fields: list) -> list:
+    """
+    Turn rows of a select_fields query into dicts holding only the requested
+    fields, loading any requested relationships for all the rows at once
+
+    Args:
+        session: the session to query with
+        model: the model class being queried
+        rows (list): the result rows
+        columns (list): the column names of the rows, in order
+        fields (list): the field names from parse_fields
+
+    Returns:
+        list: the json serializable representation of each row
+    """
+    relationships = RELATIONSHIPS[model]
+    names = [f for f in fields if f not in relationships]
+    data = [dict(zip(names, row)) for row in rows]
+
+    requested = [name for name in relationships if name in fields]
+    if requested and rows:
+        position = columns.index(primary_key(model).key)
+        ids = [row[position] for row in rows]
+        for name in requested:
+            related = related_rows(session, relationships[name], ids)
+            for id, item in zip(ids, data):
+                item[name] = related.get(id, [])
+    return data
+
+
+def parse_list_args(model, args: dict) -> ListParams:
+    """
+    Validate the request arguments for a listing of model
+
+    Recognised arguments are the filters described in parse_filters, plus
+    sort (see parse_sort), fields (see parse_fields), limit (the page size;
+    every matching row is returned if it's missing), after (the cursor
+    returned for the previous page) and offset (the number of rows to skip,
+    for jumping straight to a page; cursors are quicker for deep pages).
+
+    Args:
+        model: the model class to list
+        args (dict): the request arguments
+
+    Raises:
+        ValueError: if any of the arguments are invalid
+
+    Returns:
+        ListParams: the parsed arguments
+    """
+    sort_name, descending = parse_sort(model, args.get("sort"))
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f"Invalid limit: {limit}")
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+
+    offset = args.get("offset", 0)
+    try:
+        offset = int(offset)
+    except ValueError:
+        raise ValueError(f"Invalid offset: {offset}")
+    if offset < 0:
+        raise ValueError("offset can't be negative")
+
+    after = args.get("after")
+    return ListParams(
+        fields=parse_fields(model, args.get("fields")),
+        filters=parse_filters(model, args),
+        sort_name=sort_name,
+        descending=descending,
+        limit=limit,
+        after=decode_cursor(after, model, sort_name) if after else None,
+        offset=offset,
+    )
+
+
+def build_list_query(model, params: ListParams):
+    """
+    Build the filtered, sorted and projected select described by params
+
+    Args:
+        model: the model class to list
+        params (ListParams): the parsed request arguments
+
+    Returns:
+        the select, without any limit applied
+    """
+    # The sort column and primary key are needed to build the next cursor
+    query = select_fields(
+        model, params.fields, [params.sort_name, primary_key(model).key]
+    )
+    query = apply_filters(query, model, params.filters)
+    return apply_keyset(query, model, params.sort_name, params.descending, params.after)
+
+
+def list_page(session, model, params: ListParams) -> Page:
+    """
+    Run the listing of model described by params
+
+    Args:
+        session: the session to query with
+        model: the model class to list
+        params (ListParams): the parsed request arguments
+
+    Returns:
+        Page: the serialized rows and the cursor for the next page, if any
+    """
+    query = build_list_query(model, params).offset(params.offset)
+    columns = list(query.selected_columns.keys())
+    fields, limit = params.fields, params.limit
+
+    if limit is None:
+        rows = session.execute(query).all()
+        return Page(serialize_rows(session, model, rows, columns, fields))
+
+    # Fetch one extra row to find out whether there's another page
+    rows = session.execute(query.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        pk_name = primary_key(model).key
+        next_cursor = encode_cursor(
+            [
+                last[columns.index(params.sort_name)],
+                last[columns.index(pk_name)],
+            ]
+        )
+    return Page(serialize_rows(session, model, rows, columns, fields), next_cursor)
+
+
+def iter_rows(session, model, params: ListParams, batch_size: int = 1000):
+    """
+    Lazily run the listing of model described by params, fetching batch_size
+    rows at a time so memory use doesn't grow with the size of the table
+
+    No cursor is produced, but params.limit is still respected.
+
+    Args:
+        session: the session to query with
+        model: the model class to list
+        params (ListParams): the parsed request arguments
+        batch_size (int): the number of rows to fetch from the db at a time
+
+    Yields:
+        dict: each serialized row in turn
+    """
+    query = build_list_query(model, params).offset(params.offset)
+    if params.limit is not None:
+        query = query.limit(params.limit)
+    columns = list(query.selected_columns.keys())
+    result = session.execute(query.execution_options(stream_results=True))
+    for rows in result.partitions(batch_size):
+        yield from serialize_rows(session, model, rows, columns, params.fields)
+
+
+def count_rows(session, model, params: ListParams) -> int:
+    """
+    Count the rows of model that match the filters in params
+
+    Args:
+        session: the session to query with
+        model: the model class to count
+        params (ListParams): the parsed request arguments; only the filters
+            are used
+
+    Returns:
+        int: the number of matching rows
+    """
+    query = session.query(func.count(primary_key(model)))
+    return apply_filters(query, model, params.filters).scalar()
+
+
+def get_by_ids(session, model, ids: list, fields: list) -> list:
+    """
+    Look up many rows of model by primary key with as few IN queries as
+    possible, loading any requested relationships
+
+    Args:
+        session: the session to query with
+        model: the model class e.g. Compound
+        ids (list): the primary keys to look up
+        fields (list): the field names from parse_fields
+
+    Returns:
+        list: the serialized rows in the order of ids, skipping ids that
+            don't exist (and repeats)
+    """
+    pk = primary_key(model)
+    query = select_fields(model, fields, [pk.key])
+    columns = list(query.selected_columns.keys())
+    position = columns.index(pk.key)
+    found = {}
+    unique_ids = list(dict.fromkeys(ids))
+    for chunk in chunks(unique_ids):
+        rows = session.execute(query.where(pk.in_(chunk))).all()
+        for row, data in zip(
+            rows, serialize_rows(session, model, rows, columns, fields)
+        ):
+            found[row[position]] = data
+    return [found[id] for id in unique_ids if id in found]
+
+
+def get_by_id(session, model, id: str) -> dict:
+    """
+    Look up one row of model by primary key, with every field
+
+    Args:
+        session: the session to query with
+        model: the model class e.g. Compound
+        id (str): the primary key, as given in the url
+
+    Returns:
+        dict: the serialized row, or None if there isn't one with that id
+    """
+    try:
+        ids = [coerce_value(primary_key(model), str(id))]
+    except ValueError:
+        return None
+    rows = get_by_ids(session, model, ids, parse_fields(model))
+    return rows[0] if rows else None
+
+
+def compound_smiles(session, compound_ids: list) -> list:
+    """
+    Look up the SMILES of many compounds with as few IN queries as possible
+
+    Args:
+        session: the session to query with
+        compound_ids (list): the compound_ids to look up
+
+    Returns:
+        list: (compound_id, smiles) tuples ordered by compound_id
+    """
+    rows = []
+    query = select(Compound.compound_id, Compound.smiles)
+    for chunk in chunks(compound_ids):
+        rows.extend(
+            tuple(row)
+            for row in session.execute(query.where(Compound.compound_id.in_(chunk)))
+        )
+    return sorted(rows)
+
+
+def compound_images(session, compound_ids: list) -> dict:
+    """
+    Look up the image paths of many compounds with as few IN queries as
+    possible
+
+    Args:
+        session: the session to query with
+        compound_ids (list): the compound_ids to look up
+
+    Returns:
+        dict: the image of each compound_id that exists
+    """
+    images = {}
+    query = select(Compound.compound_id, Compound.image)
+    for chunk in chunks(compound_ids):
+        images.update(
+            session.execute(query.where(Compound.compound_id.in_(chunk))).all()
+        )
+    return images
+
+
+def compound_trendlines(session) -> list:
+    """
+    Fit an ordinary least squares line of ALogP against molecular_weight for
+    each number of rings, from sums aggregated in the db rather than from
+    every row
+
+    Args:
+        session: the session to query with
+
+    Returns:
+        list: for each num_rings, a dict holding the number of compounds
+            (count), the slope, intercept and r_squared of the line (None if
+            it can't be fitted) and the range of molecular_weight it spans
+            (x_min and x_max)
+    """
+    x, y = Compound.molecular_weight, Compound.ALogP
+    rows = (
+        session.query(
+            Compound.num_rings,
+            func.count(),
+            func.sum(x),
+            func.sum(y),
+            func.sum(x * x),
+            func.sum(x * y),
+            func.sum(y * y),
+            func.min(x),
+            func.max(x),
+        )
+        .filter(x.isnot(None), y.isnot(None))
+        .group_by(Compound.num_rings)
+        .order_by(Compound.num_rings)
+    )
+
+    trendlines = []
+    for num_rings, n, sx, sy, sxx, sxy, syy, x_min, x_max in rows:
+        # n times the variances and covariance
+        var_x, var_y, cov = n * sxx - sx * sx, n * syy - sy * sy, n * sxy - sx * sy
+        slope = intercept = r_squared = None
+        if n > 1 and var_x > 0:
+            slope = cov / var_x
+            intercept = (sy - slope * sx) / n
+            r_squared = cov * cov / (var_x * var_y) if var_y > 0 else 1.0
+        trendlines.append(
+            {
+                "num_rings": num_rings,
+                "count": n,
+                "slope": slope,
+                "intercept": intercept,
+                "r_squared": r_squared,
+                "x_min": x_min,
+                "x_max": x_max,
+            }
+        )
+    return trendlines
+
+
+def bin_number(session, value):
+    """
+    Round a non-negative value down to a whole number in SQL. CAST does that
+    in sqlite but rounds to the nearest in PostgreSQL.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        value = func.floor(value)
+    return cast(value, Integer)
+
+
+def compound_density(session, params: ListParams, bins: int) -> dict:
+    """
+    Bin the compounds matching the filters in params on a bins x bins grid of
+    molecular_weight against ALogP, separately for each number of rings, so
+    a scatter plot of many compounds can be drawn from a few points
+
+    Args:
+        session: the session to query with
+        params (ListParams): the parsed request arguments; only the filters
+            are used
+        bins (int): the number of bins along each axis
+
+    Returns:
+        dict: the number of compounds plotted (count) and the non-empty bins
+            (bins), each a dict of num_rings, count and the mean
+            molecular_weight and ALogP of the compounds in the bin
+    """
+    x, y = Compound.molecular_weight, Compound.ALogP
+    query = session.query().filter(x.isnot(None), y.isnot(None))
+    query = apply_filters(query, Compound, params.filters)
+
+    count, x_min, x_max, y_min, y_max = query.with_entities(
+        func.count(), func.min(x), func.max(x), func.min(y), func.max(y)
+    ).one()
+    if not count:
+        return {"count": 0, "bins": []}
+
+    # Widen the bins a touch so the maximum falls in the last bin
+    x_width = (x_max - x_min) / bins * 1.000001 or 1.0
+    y_width = (y_max - y_min) / bins * 1.000001 or 1.0
+    x_bin = bin_number(session, (x - x_min) / x_width)
+    y_bin = bin_number(session, (y - y_min) / y_width)
+    rows = (
+        query.with_entities(Compound.num_rings, func.count(), func.avg(x), func.avg(y))
+        .group_by(Compound.num_rings, x_bin, y_bin)
+        .order_by(Compound.num_rings, x_bin, y_bin)
+    )
+
+    return {
+        "count": count,
+        "bins": [
+            {
+                "num_rings": num_rings,
+                "count": n,
+                "molecular_weight": mean_x,
+                "ALogP": mean_y,
+            }
+            for num_rings, n, mean_x, mean_y in rows
+        ],
+    }
+
+
+def assay_counts(session) -> list:
+    """
+    Count the assay results for each target and result type
+
+    Args:
+        session: the session to query with
+
+    Returns:
+        list: a dict of target, result and count for each combination
+    """
+    rows = (
+        session.query(Assay.target, Assay.result, func.count()).group_by(
+            Assay.target, Assay.result
+        )
+        # PostgreSQL would sort the enum in declaration order, sqlite by name
+        .order_by(Assay.target, cast(Assay.result, String))
+    )
+    return [
+        {"target": target, "result": result, "count": count}
+        for target, result, count in rows
+    ]
+
+
+def get_dataset_version(session) -> tuple:
+    """
+    Return the version of the dataset, which the ETL flow bumps every time
+    it changes the data, and when it was last changed
+
+    Args:
+        session: the session to query with
+
+    Returns:
+        tuple: (version, updated_at datetime); (0, None) for a db that has
+            never been versioned
+    """
+    try:
+        row = session.query(DatasetVersion.version, DatasetVersion.updated_at).first()
+    except (OperationalError, ProgrammingError):
+        # The db was made before dataset versions existed
+        session.rollback()
+        return 0, None
+    return tuple(row) if row else (0, None)
@@ -0,0 +1,75 @@
+"""
+Encoding API responses as json, with orjson when it's installed, or as
+msgpack for clients whose Accept header prefers it.
+
+The json is laid out as jsonify lays it out - sorted keys, no padding and a
+trailing newline - except that orjson may write a float differently (1e-5
+rather than 1e-05) and non-ASCII characters are sent as UTF-8 rather than
+escaped.
+"""
+import json
+
+import msgpack
+
+try:
+    import orjson
+
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+except ImportError:
+    orjson = None
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+# The unregistered name some msgpack clients still send
+MSGPACK_ALIASES = ["application/x-msgpack"]
+
+
+def dumps_json(data, newline: bool = True) -> bytes:
+    """
+    Encode data as compact json with sorted keys
+
+    Args:
+        data: the json serializable data
+        newline (bool): whether to end with a newline, as jsonify does
+
+    Returns:
+        bytes: the UTF-8 encoded json
+    """
+    if orjson is not None:
+        options = ORJSON_OPTIONS | (orjson.OPT_APPEND_NEWLINE if newline else 0)
+        return orjson.dumps(data, option=options)
+    body = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return (body + "\n" if newline else body).encode()
+
+
+def dumps_msgpack(data) -> bytes:
+    """
+    Encode data as msgpack
+    """
+    return msgpack.packb(data, use_bin_type=True)
+
+
+def negotiate(accept) -> str:
+    """
+    Choose between json and msgpack for a client's Accept header, defaulting
+    to json
+
+    Args:
+        accept (MIMEAccept): the parsed Accept header
+
+    Returns:
+        str: JSON_MIMETYPE or MSGPACK_MIMETYPE
+    """
+    best = accept.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE] + MSGPACK_ALIASES)
+    if best == MSGPACK_MIMETYPE or best in MSGPACK_ALIASES:
+        return MSGPACK_MIMETYPE
+    return JSON_MIMETYPE
+
+
+def dumps(data, mimetype: str) -> bytes:
+    """
+    Encode data as mimetype, one of those returned by negotiate
+    """
+    if mimetype == MSGPACK_MIMETYPE:
+        return dumps_msgpack(data)
+    return dumps_json(data)
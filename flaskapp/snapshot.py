@@ -0,0 +1,223 @@
+"""
+A columnar snapshot of the numeric columns of the db, written by the ETL flow
+as one NumPy .npy file per column so readers can memory-map them rather than
+query and decode rows.
+
+Each dataset version gets its own directory, v{version}, holding the column
+files and a manifest.json; the CURRENT file names the latest complete one.
+"""
+import functools
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import sqlalchemy as db
+
+# The columns written to the snapshot, per table, and their dtypes. Rows are
+# in the order of the first column. Nullable columns are stored as floats so
+# NULL can be NaN.
+SNAPSHOT_COLUMNS = {
+    "compound": {
+        "compound_id": "int64",
+        "molecular_weight": "float64",
+        "ALogP": "float64",
+        "num_rings": "float64",
+    },
+    "assay": {"result_id": "int64", "value": "float64"},
+    "compound_assay": {"compound_id": "int64", "result_id": "int64"},
+}
+
+# Rows fetched from the db at a time when writing a snapshot
+FETCH_SIZE = 100000
+
+CURRENT = "CURRENT"
+MANIFEST = "manifest.json"
+
+
+def snapshot_dir(db_name: str) -> str:
+    """
+    Return the directory holding the snapshots of the sqlite db at db_name
+
+    Args:
+        db_name (str): the name of the sqlite db without the .sqlite extension
+    """
+    return f"{db_name}_columns"
+
+
+def current_snapshot(directory: str) -> str:
+    """
+    Return the directory of the latest complete snapshot in directory, or None
+    if there isn't one
+    """
+    try:
+        with open(os.path.join(directory, CURRENT), "r") as file:
+            name = file.read().strip()
+    except OSError:
+        return None
+    return os.path.join(directory, name)
+
+
+def read_manifest(directory: str) -> dict:
+    """
+    Return the manifest of the latest snapshot in directory, holding its
+    dataset version and the dtype and length of each column, or None if
+    there isn't a snapshot
+    """
+    current = current_snapshot(directory)
+    if current is None:
+        return None
+    path = os.path.join(current, MANIFEST)
+    return _read_manifest(path, _file_version(path))
+
+
+def _file_version(path: str) -> tuple:
+    """
+    Return what identifies the file now at path, so the caches below miss when
+    a snapshot directory is written again for the same dataset version
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_ino
+
+
+@functools.lru_cache(maxsize=16)
+def _read_manifest(path: str, file_version: tuple) -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def column_path(directory: str, table: str, column: str) -> str:
+    """
+    Return the path of the .npy file of table.column in the latest snapshot
+    in directory, or None if there isn't one or the column isn't in it
+
+    Args:
+        directory (str): the snapshot directory, see snapshot_dir
+        table (str): the table e.g. "compound"
+        column (str): the column e.g. "molecular_weight"
+    """
+    manifest = read_manifest(directory)
+    if manifest is None or column not in manifest["columns"].get(table, {}):
+        return None
+    return os.path.join(current_snapshot(directory), f"{table}.{column}.npy")
+
+
+def load_column(directory: str, table: str, column: str) -> np.ndarray:
+    """
+    Memory-map the .npy file of table.column from the latest snapshot in
+    directory, so the data is paged in from disk rather than copied
+
+    Raises:
+        KeyError: if there's no snapshot or the column isn't in it
+
+    Returns:
+        np.ndarray: the read-only column
+    """
+    path = column_path(directory, table, column)
+    if path is None:
+        raise KeyError(f"No snapshot of {table}.{column} in {directory}")
+    return _load(path, _file_version(path))
+
+
+@functools.lru_cache(maxsize=64)
+def _load(path: str, file_version: tuple) -> np.ndarray:
+    return np.load(path, mmap_mode="r")
+
+
+def read_column_arrays(connection, table: str, columns: dict) -> dict:
+    """
+    Read columns of table into NumPy arrays, FETCH_SIZE rows at a time
+
+    Args:
+        connection: the connection to read with
+        table (str): the table to read
+        columns (dict): the dtype of each column to read
+
+    Returns:
+        dict: the array of each column
+    """
+    names = list(columns)
+    # Mixed case names like ALogP need quoting in PostgreSQL
+    quote = connection.dialect.identifier_preparer.quote
+    quoted = [quote(name) for name in names]
+    result = connection.execute(
+        db.text(f"SELECT {', '.join(quoted)} FROM {quote(table)} ORDER BY {quoted[0]}")
+    )
+    parts = {name: [] for name in names}
+    while True:
+        rows = result.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for name, values in zip(names, zip(*rows)):
+            # None becomes NaN in a float array
+            parts[name].append(np.array(values, dtype=columns[name]))
+    return {
+        name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+        for name, dtype in columns.items()
+    }
+
+
+def write_snapshot(
+    connection,
+    directory: str,
+    version: int,
+    extra_columns: dict = None,
+    metadata: dict = None,
+) -> str:
+    """
+    Write a snapshot of SNAPSHOT_COLUMNS for dataset version and make it the
+    current one
+
+    The snapshot is written to a temporary directory which is then renamed,
+    so readers only ever see complete snapshots. Snapshots older than the
+    one it replaces are removed.
+
+    Args:
+        connection: the connection to read the db with
+        directory (str): the snapshot directory, see snapshot_dir
+        version (int): the dataset version being written
+        extra_columns (dict): optional arrays worked out from the db to add to
+            the snapshot, keyed by (table, column), e.g. fingerprints
+        metadata (dict): optional values to add to the manifest
+
+    Returns:
+        str: the directory of the new snapshot
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"v{version}"
+    previous = current_snapshot(directory)
+    temp_dir = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    os.chmod(temp_dir, 0o755)
+
+    manifest = {**(metadata or {}), "version": version, "columns": {}}
+    arrays = {
+        (table, column): array
+        for table, columns in SNAPSHOT_COLUMNS.items()
+        for column, array in read_column_arrays(connection, table, columns).items()
+    }
+    for (table, column), array in {**arrays, **(extra_columns or {})}.items():
+        np.save(os.path.join(temp_dir, f"{table}.{column}.npy"), array)
+        manifest["columns"].setdefault(table, {})[column] = {
+            "dtype": array.dtype.str,
+            "length": len(array),
+        }
+    with open(os.path.join(temp_dir, MANIFEST), "w") as file:
+        json.dump(manifest, file)
+
+    version_dir = os.path.join(directory, name)
+    shutil.rmtree(version_dir, ignore_errors=True)
+    os.replace(temp_dir, version_dir)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    with os.fdopen(fd, "w") as file:
+        file.write(name)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, os.path.join(directory, CURRENT))
+
+    # Keep the snapshot just replaced for readers that still have it open
+    keep = {name, os.path.basename(previous) if previous else None}
+    for entry in os.scandir(directory):
+        if entry.is_dir() and entry.name.startswith("v") and entry.name not in keep:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return version_dir
@@ -1,94 +1,676 @@
+from datetime import datetime
+import functools
+import hashlib
+import itertools
 import json
 import os
-from prefect import task, Flow
+import pickle
+import re
+import shutil
+import tempfile
+import time
+
+import jsonschema
+import prefect
+from prefect import task, Flow, Parameter
+from prefect.executors import LocalDaskExecutor
 import sqlalchemy as db
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-if __name__ == "__main__":
+# Worker processes import the main module as __mp_main__
+if __name__ in ["__main__", "__mp_main__"]:
     import database
-    from models import Assay, Base, Compound
+    import fingerprints
+    import snapshot
+    from models import Assay, Compound, CompoundHash, DatasetVersion
+    from models import SourceFile, compound_assay
 elif __name__ == "flaskapp.transform":
-    from flaskapp import database
-    from flaskapp.models import Assay, Base, Compound
+    from flaskapp import database, fingerprints, snapshot
+    from flaskapp.models import Assay, Compound, CompoundHash, DatasetVersion
+    from flaskapp.models import SourceFile, compound_assay
+
+# Compounds per chunk for the worker processes and per executemany when
+# writing; each file is still written in one transaction
+BATCH_SIZE = 10000
+
+# sqlite's default SQLITE_MAX_VARIABLE_NUMBER before 3.32 is 999
+MAX_SQL_VARIABLES = 900
+
+# Characters read from the json file at a time
+CHUNK_SIZE = 1 << 20
+
+WHITESPACE = re.compile(r"\s*")
+
+SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "data", "schema.json"
+)
+
+COMPOUND_COLUMNS = [column.name for column in Compound.__table__.columns]
+ASSAY_COLUMNS = [column.name for column in Assay.__table__.columns]
 
 
 @task
 def create_sqlite_tables(db_name: str) -> bool:
     """
-    Create tables from models.py in a sqlite db at db_name.
+    Create tables from models.py in the db at db_name, along with any
+    indexes missing from tables that already existed.
 
     Args:
-        db_name (str): the name of the sqlite db without the .sqlite extension
+        db_name (str): the name of the sqlite db without the .sqlite
+            extension, or a database URL
 
     Returns:
         bool: True if the function runs without any errors
     """
-    engine = db.create_engine(f"sqlite:///{db_name}.sqlite")
-    Base.metadata.create_all(engine)
+    engine = database.get_engine(db_name)
+    # Reach the metadata through a model rather than Base: tasks are pickled
+    # for the worker processes and Base itself can't be
+    metadata = Compound.metadata
+    metadata.create_all(engine)
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
     return True
 
 
+def iter_json_array(json_path: str, chunk_size: int = CHUNK_SIZE, raw: bool = False):
+    """
+    Lazily parse the json file at json_path, which must hold a single array,
+    yielding its elements one at a time. Only chunk_size characters (plus
+    the element being parsed) are held in memory at once, however large the
+    file is.
+
+    Args:
+        json_path (str): the path to the json file
+        chunk_size (int): the number of characters to read at a time
+        raw (bool): yield the json text of each element rather than the
+            parsed element
+
+    Raises:
+        ValueError: if the file isn't a json array
+
+    Yields:
+        the next element of the array
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path, "r", encoding="utf-8-sig") as file:
+        buffer, pos = "", 0
+
+        def next_char() -> str:
+            # Skip whitespace, reading more of the file if we run out, and
+            # return the next character ("" at the end of the file)
+            nonlocal buffer, pos
+            while True:
+                pos = WHITESPACE.match(buffer, pos).end()
+                if pos < len(buffer):
+                    return buffer[pos]
+                buffer, pos = file.read(chunk_size), 0
+                if not buffer:
+                    return ""
+
+        if next_char() != "[":
+            raise ValueError(f"{json_path} does not contain a json array")
+        pos += 1
+        if next_char() == "]":
+            return
+
+        while True:
+            if not next_char():
+                raise ValueError(f"Unexpected end of {json_path}")
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # A number at the end of the buffer may carry on too, even
+                # as a fraction or exponent if it was cut off before one
+                complete = end < len(buffer) and buffer[end] not in ".eE"
+            except json.JSONDecodeError:
+                # Most likely the element carries on into the next chunk
+                complete = False
+            if not complete:
+                more = file.read(chunk_size)
+                if more:
+                    buffer, pos = buffer[pos:] + more, 0
+                    continue
+                # Nothing left to read, so raise any decoding error
+                element, end = decoder.raw_decode(buffer, pos)
+            yield buffer[pos:end] if raw else element
+            pos = end
+
+            char = next_char()
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in {json_path}, got {char!r}")
+            pos += 1
+
+
+def batched(iterable, batch_size: int):
+    """
+    Yield lists of up to batch_size items from iterable
+
+    Args:
+        iterable: the items to batch
+        batch_size (int): the maximum number of items per batch
+
+    Yields:
+        list: the next batch of items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prepare_compound(compound: dict) -> tuple:
+    """
+    Flatten a compound record into rows for the compound and assay tables,
+    along with its content hash
+
+    Only plain tuples, dicts and lists are returned so the result can be
+    pickled by one process and read by another.
+
+    Args:
+        compound (dict): a compound dict as found in the json file
+
+    Returns:
+        tuple: (compound id, content hash, compound row, list of assay rows)
+    """
+    compound_row = {col: compound.get(col) for col in COMPOUND_COLUMNS}
+    assay_rows = [
+        {col: assay.get(col) for col in ASSAY_COLUMNS}
+        for assay in compound.get("assay_results", [])
+    ]
+    return compound["compound_id"], content_hash(compound), compound_row, assay_rows
+
+
+def content_hash(compound: dict) -> str:
+    """
+    Hash a compound record (including its assay results) so changes to it
+    can be spotted between loads
+
+    Args:
+        compound (dict): a compound dict as found in the json file
+
+    Returns:
+        str: the hex digest of the record
+    """
+    canonical = json.dumps(compound, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def file_checksum(path: str) -> str:
+    """
+    Return the sha256 hex digest of the file at path, read in chunks
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def list_source_files(json_path: str) -> list:
+    """
+    Return the json files to load: json_path itself if it's a file, or every
+    .json file in it (in name order, so deltas apply in sequence) if it's a
+    directory
+
+    Args:
+        json_path (str): the path to a json file or a directory of them
+
+    Returns:
+        list: the paths of the json files to load
+    """
+    if not os.path.isdir(json_path):
+        return [json_path]
+    return [
+        os.path.join(json_path, name)
+        for name in sorted(os.listdir(json_path))
+        if name.endswith(".json")
+    ]
+
+
+def fetch_content_hashes(connection, compound_ids: list) -> dict:
+    """
+    Return the stored content hash of each of compound_ids that has one
+
+    Args:
+        connection: the connection to query with
+        compound_ids (list): the compound ids to look up
+
+    Returns:
+        dict: content hashes keyed by compound id
+    """
+    hashes = {}
+    # Keep under sqlite's limit on the number of variables in a statement
+    for ids in batched(compound_ids, MAX_SQL_VARIABLES):
+        query = db.select(CompoundHash.compound_id, CompoundHash.content_hash).where(
+            CompoundHash.compound_id.in_(ids)
+        )
+        hashes.update(connection.execute(query).all())
+    return hashes
+
+
+def insert(connection, table):
+    """
+    Start an INSERT into table in the dialect of connection, which can take
+    an ON CONFLICT clause (spelt the same in PostgreSQL and sqlite)
+    """
+    if connection.dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+def upsert(connection, table, rows: list):
+    """
+    Insert rows into table with one executemany, overwriting any rows that
+    already have the same primary key
+
+    Args:
+        connection: the connection to insert with
+        table: the table to insert into
+        rows (list): the rows to insert, as dicts
+    """
+    statement = insert(connection, table)
+    primary_key = [column.name for column in table.primary_key]
+    statement = statement.on_conflict_do_update(
+        index_elements=primary_key,
+        set_={
+            column.name: statement.excluded[column.name]
+            for column in table.columns
+            if column.name not in primary_key
+        },
+    )
+    connection.execute(statement, rows)
+
+
+def write_prepared_batch(connection, prepared: list) -> tuple:
+    """
+    Write a batch of compounds from prepare_compound, their assays and the
+    links between them, skipping compounds whose content hash hasn't changed
+    since they were last loaded. New and changed compounds and assays are
+    upserted and the links of changed compounds are replaced.
+
+    Args:
+        connection: the connection (with a transaction already begun) to
+            write with
+        prepared (list): tuples from prepare_compound
+
+    Returns:
+        tuple: (the number of new or changed compounds, the number of rows
+            written across all tables)
+    """
+    stored = fetch_content_hashes(connection, [p[0] for p in prepared])
+    changed = [p for p in prepared if stored.get(p[0]) != p[1]]
+    if not changed:
+        return 0, 0
+
+    compound_rows = [compound_row for _, _, compound_row, _ in changed]
+    assay_rows = [row for _, _, _, rows in changed for row in rows]
+    link_rows = [
+        {"compound_id": compound_id, "result_id": row["result_id"]}
+        for compound_id, _, _, rows in changed
+        for row in rows
+    ]
+    hash_rows = [
+        {"compound_id": compound_id, "content_hash": content_hash}
+        for compound_id, content_hash, _, _ in changed
+    ]
+
+    upsert(connection, Compound.__table__, compound_rows)
+    if assay_rows:
+        upsert(connection, Assay.__table__, assay_rows)
+
+    # Replace the links of changed compounds in case assays were removed
+    connection.execute(
+        compound_assay.delete().where(
+            compound_assay.c.compound_id == db.bindparam("changed_id")
+        ),
+        [{"changed_id": row["compound_id"]} for row in compound_rows],
+    )
+    if link_rows:
+        connection.execute(
+            insert(connection, compound_assay).on_conflict_do_nothing(), link_rows
+        )
+    upsert(connection, CompoundHash.__table__, hash_rows)
+
+    num_rows = len(compound_rows) + len(assay_rows) + len(link_rows)
+    return len(changed), num_rows + len(hash_rows)
+
+
+def bump_dataset_version(connection):
+    """
+    Increment the dataset version, so the API knows its cached responses are
+    out of date
+
+    Args:
+        connection: the connection (with a transaction already begun) to
+            write with
+    """
+    statement = insert(connection, DatasetVersion.__table__).values(
+        id=1, version=1, updated_at=datetime.utcnow()
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["id"],
+        set_={
+            "version": DatasetVersion.__table__.c.version + 1,
+            "updated_at": statement.excluded.updated_at,
+        },
+    )
+    connection.execute(statement)
+
+
+@functools.lru_cache()
+def compound_validator() -> jsonschema.Draft7Validator:
+    """
+    Return a validator for a single compound record, built from
+    data/schema.json (which describes the properties of each item of the
+    array rather than of the array itself)
+    """
+    with open(SCHEMA_PATH, "r", encoding="utf-8") as file:
+        schema = json.load(file)
+    item_schema = {
+        "type": "object",
+        "required": schema["required"],
+        "properties": schema["properties"],
+    }
+    return jsonschema.Draft7Validator(item_schema)
+
+
 @task
-def extract_compounds_from_json(json_path: str) -> list:
+def split_json_files(
+    db_name: str, json_path: str, chunk_size: int = BATCH_SIZE
+) -> list:
     """
-    Read the json file located at json_path and return a list of Compound
-    objects based on the contents of the file.
+    Split the json files at json_path (a json file or a directory of them,
+    see list_source_files) into chunks of up to chunk_size compounds, written
+    to a temporary spool directory, so they can be transformed in parallel.
+
+    Files whose checksum matches the last time they were loaded are skipped
+    without being parsed. Elements are copied as json text, so the file is
+    only scanned here, not re-serialized.
 
     Args:
-        json_path (str): the path to the json file containing compound data
+        db_name (str): the name of the sqlite db, or a database URL
+        json_path (str): the path to a json file or directory of json files
+            containing compound data
+        chunk_size (int): the number of compounds per chunk
 
     Returns:
-        list: a list of Compound objects
+        list: a dict describing each chunk (the source file, its checksum
+            and the path of the chunk); a file with no compounds gets a single
+            chunk with no path so its checksum is still recorded
     """
-    with open(json_path, "r", encoding="utf-8-sig") as file:
-        data = json.load(file)
-    compounds = []
-    for comp in data:
-        assays = [Assay(**assay) for assay in comp["assay_results"]]
-        comp["assay_results"] = assays
-        compound = Compound(**comp)
-        compounds.append(compound)
-    return compounds
+    logger = prefect.context.get("logger")
+    engine = database.get_engine(db_name)
+    spool_dir = None
+    chunks = []
+
+    for path in list_source_files(json_path):
+        source = os.path.abspath(path)
+        checksum = file_checksum(path)
+
+        with engine.connect() as connection:
+            query = db.select(SourceFile.checksum).where(SourceFile.path == source)
+            if connection.execute(query).scalar() == checksum:
+                logger.info(f"Skipping {path}: unchanged since it was last loaded")
+                continue
+
+        file_chunks = []
+        for texts in batched(iter_json_array(path, raw=True), chunk_size):
+            if spool_dir is None:
+                spool_dir = tempfile.mkdtemp(prefix="compounds_etl_")
+            chunk_path = os.path.join(
+                spool_dir, f"{len(chunks) + len(file_chunks)}.json"
+            )
+            with open(chunk_path, "w", encoding="utf-8") as file:
+                file.write("[" + ",".join(texts) + "]")
+            file_chunks.append(
+                {"source": source, "checksum": checksum, "path": chunk_path}
+            )
+
+        logger.info(f"Split {path} into {len(file_chunks)} chunks")
+        chunks.extend(
+            file_chunks or [{"source": source, "checksum": checksum, "path": None}]
+        )
+    return chunks
 
 
 @task
-def add_compounds_to_db(db_name: str, compounds: list) -> bool:
+def transform_chunk(chunk: dict) -> dict:
     """
-    Given a db name and a list of compounds, add the compounds to the db
+    Parse, validate and flatten a chunk from split_json_files, pickling the
+    results (see prepare_compound) to the spool directory for write_chunks.
+    Compounds that don't match data/schema.json are left out.
 
     Args:
-        db_name (str): the name of the sqlite db
-        compounds (list): a list of Compound objects
+        chunk (dict): a chunk from split_json_files
 
     Returns:
-        bool: True if the function runs without any errors
+        dict: the chunk, now pointing at the pickled results, with the number
+            of compounds read and the ids of any invalid compounds added
     """
+    if chunk["path"] is None:
+        return {**chunk, "num_compounds": 0, "invalid": []}
+
+    with open(chunk["path"], "r", encoding="utf-8") as file:
+        compounds = json.load(file)
+
+    validator = compound_validator()
+    prepared, invalid = [], []
     for compound in compounds:
-        with database.connect_to_sqlite(db_name) as session:
-            compound_in_table = (
-                session.query(Compound)
-                .filter(Compound.compound_id == compound.compound_id)
-                .one_or_none()
+        if validator.is_valid(compound):
+            prepared.append(prepare_compound(compound))
+        else:
+            invalid.append(compound.get("compound_id"))
+
+    result_path = os.path.splitext(chunk["path"])[0] + ".pickle"
+    with open(result_path, "wb") as file:
+        pickle.dump(prepared, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.remove(chunk["path"])
+
+    return {
+        **chunk,
+        "path": result_path,
+        "num_compounds": len(compounds),
+        "invalid": invalid,
+    }
+
+
+@task
+def write_chunks(db_name: str, chunks: list, batch_size: int = BATCH_SIZE) -> bool:
+    """
+    Write the transformed chunks to the db, in order, from this one task so
+    only one process ever writes to sqlite. Each source file is written in
+    its own transaction and its checksum recorded once all of its chunks are
+    in; only new or changed compounds are written (see write_prepared_batch).
+
+    Args:
+        db_name (str): the name of the sqlite db, or a database URL
+        chunks (list): the chunks from transform_chunk
+        batch_size (int): the number of compounds to write at a time
+
+    Returns:
+        bool: True if the function runs without any errors
+    """
+    logger = prefect.context.get("logger")
+    engine = database.get_engine(db_name)
+    spool_dirs = {os.path.dirname(chunk["path"]) for chunk in chunks if chunk["path"]}
+
+    try:
+        for source, source_chunks in itertools.groupby(chunks, lambda c: c["source"]):
+            start = time.perf_counter()
+            num_compounds, num_changed, num_rows = 0, 0, 0
+
+            with engine.begin() as connection:
+                for chunk in source_chunks:
+                    num_compounds += chunk["num_compounds"]
+                    if chunk["invalid"]:
+                        logger.warning(
+                            f"Skipping {len(chunk['invalid'])} compounds in {source} "
+                            f"that don't match the schema: {chunk['invalid'][:10]}"
+                        )
+                    if chunk["path"] is None:
+                        continue
+
+                    with open(chunk["path"], "rb") as file:
+                        prepared = pickle.load(file)
+                    os.remove(chunk["path"])
+                    for batch in batched(prepared, batch_size):
+                        changed, rows = write_prepared_batch(connection, batch)
+                        num_changed += changed
+                        num_rows += rows
+
+                if num_changed:
+                    bump_dataset_version(connection)
+                    # Changed compounds may have left assays without a compound
+                    connection.execute(
+                        Assay.__table__.delete().where(
+                            Assay.result_id.not_in(
+                                db.select(compound_assay.c.result_id)
+                            )
+                        )
+                    )
+                upsert(
+                    connection,
+                    SourceFile.__table__,
+                    [
+                        {
+                            "path": source,
+                            "checksum": chunk["checksum"],
+                            "loaded_at": datetime.utcnow(),
+                        }
+                    ],
+                )
+
+            elapsed = time.perf_counter() - start
+            logger.info(
+                f"Wrote {source}: {num_compounds} compounds, {num_changed} new or "
+                f"changed ({num_rows} rows) in {elapsed:.2f}s: "
+                f"{num_rows / elapsed:.0f} rows/s"
             )
-            if not compound_in_table:
-                session.add(compound)
+    finally:
+        for spool_dir in spool_dirs:
+            shutil.rmtree(spool_dir, ignore_errors=True)
     return True
 
 
-with Flow("compounds_json_to_sqlite") as flow:
+@task
+def write_snapshot(db_name: str, written: bool) -> str:
+    """
+    Write a columnar snapshot of the db (see snapshot.py) for the current
+    dataset version, unless there already is one, including the fingerprint
+    index of the compounds' SMILES used for searching (see fingerprints.py)
+
+    Args:
+        db_name (str): the name of the sqlite db without the .sqlite
+            extension, or a database URL
+        written (bool): the result of write_chunks, which must finish first
+
+    Returns:
+        str: the directory of the current snapshot
+    """
+    logger = prefect.context.get("logger")
+    directory = snapshot.snapshot_dir(database.local_name(db_name))
+    engine = database.get_engine(db_name)
+
+    with engine.connect() as connection:
+        version = connection.execute(db.select(DatasetVersion.version)).scalar() or 0
+        manifest = snapshot.read_manifest(directory) or {}
+        if (
+            manifest.get("version") == version
+            and manifest.get("fingerprint_method") == fingerprints.METHOD
+        ):
+            logger.info(f"Snapshot of dataset version {version} is up to date")
+            return snapshot.current_snapshot(directory)
+
+        start = time.perf_counter()
+        # In the same order as the compound columns of the snapshot
+        smiles = connection.execute(
+            db.select(Compound.smiles).order_by(Compound.compound_id)
+        ).scalars()
+        similarity, screening = fingerprints.fingerprint(list(smiles))
+        version_dir = snapshot.write_snapshot(
+            connection,
+            directory,
+            version,
+            extra_columns={
+                ("compound", "fingerprint"): similarity,
+                ("compound", "screening_fingerprint"): screening,
+            },
+            metadata={"fingerprint_method": fingerprints.METHOD},
+        )
+    logger.info(
+        f"Wrote snapshot of dataset version {version} to {version_dir} in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+    return version_dir
+
+
+@task
+def publish_replica(db_name: str, written: bool) -> str:
+    """
+    Publish a read-only copy of the sqlite db at db_name for the API to read
+    (see database.publish_replica) if sqlite_replica is set in settings.json,
+    unless the current copy is already of the latest dataset version
+
+    Args:
+        db_name (str): the name of the sqlite db without the .sqlite extension
+        written (bool): the result of write_chunks, which must finish first
+
+    Returns:
+        str: the path of the current replica, or None if replicas are off
+    """
+    logger = prefect.context.get("logger")
+    if not database.SQLITE_REPLICA or database.is_url(db_name):
+        return None
+
+    engine = database.get_engine(db_name)
+    with engine.connect() as connection:
+        version = connection.execute(db.select(DatasetVersion.version)).scalar() or 0
+    current = database.current_replica(db_name)
+    if current is not None and os.path.basename(current) == f"v{version}.sqlite":
+        logger.info(f"Replica of dataset version {version} is up to date")
+        return current
+
+    start = time.perf_counter()
+    path = database.publish_replica(db_name, version)
+    logger.info(
+        f"Published replica of dataset version {version} to {path} in "
+        f"{time.perf_counter() - start:.2f}s"
+    )
+    return path
+
+
+# Parsing, validation and flattening run in a pool of worker processes
+executor = LocalDaskExecutor(scheduler="processes")
+
+with Flow("compounds_json_to_sqlite", executor=executor) as flow:
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
     dir_name = os.path.basename(dir_path)
 
-    mydb = database.DEFAULT_SQLITE_DB
+    mydb = database.DEFAULT_DB
     myjson = os.path.join("data", "compounds.json")
 
     if not os.path.isfile(myjson):
-        mydb = os.path.join(dir_name, mydb)
+        if not database.is_url(mydb):
+            mydb = os.path.join(dir_name, mydb)
         myjson = os.path.join(dir_name, myjson)
 
-    tables_exist = create_sqlite_tables(mydb)
-    compounds = extract_compounds_from_json(myjson)
-    added = add_compounds_to_db(mydb, compounds, upstream_tasks=[tables_exist])
+    db_name = Parameter("db_name", default=mydb)
+    json_path = Parameter("json_path", default=myjson)
+
+    tables_exist = create_sqlite_tables(db_name)
+    chunks = split_json_files(db_name, json_path, upstream_tasks=[tables_exist])
+    transformed = transform_chunk.map(chunks)
+    added = write_chunks(db_name, transformed)
+    write_snapshot(db_name, added)
+    publish_replica(db_name, added)
 
 if __name__ == "__main__":
     flow.run()
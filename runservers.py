@@ -2,11 +2,19 @@ import json
 import logging
 import multiprocessing as mp
 import platform
+import signal
+import socket
 import threading as th
+import time
 
-from waitress import serve
+from concurrent.futures import ThreadPoolExecutor
+
+import uvicorn
+from waitress import serve, wasyncore
+from waitress.server import create_server
 
 from flaskapp import app as flaskapp
+from flaskapp import asgi, database
 from dashapp import dashapp
 
 # Load and set constants
@@ -17,23 +25,232 @@ HOST = server_info["host"]
 FLASK_PORT = server_info["flask_port"]
 DASH_PORT = server_info["dash_port"]
 
-flask_kwargs = {"host": HOST, "port": FLASK_PORT}
-dash_kwargs = {"host": HOST, "port": DASH_PORT}
+# Worker processes per app (Linux only), and the waitress settings of each
+FLASK_WORKERS = int(server_info.get("flask_workers", 1))
+DASH_WORKERS = int(server_info.get("dash_workers", 1))
+THREADS = int(server_info.get("threads", 4))
+CONNECTION_LIMIT = int(server_info.get("connection_limit", 100))
+BACKLOG = int(server_info.get("backlog", 1024))
+CHANNEL_TIMEOUT = int(server_info.get("channel_timeout", 120))
+# Seconds a stopping worker gets to finish the requests it's serving
+SHUTDOWN_TIMEOUT = float(server_info.get("shutdown_timeout", 30))
+# Serve the API's compound and assay endpoints from flaskapp/asgi.py with
+# uvicorn on this port too, if it's set
+ASGI_PORT = server_info.get("asgi_port")
+ASGI_WORKERS = int(server_info.get("asgi_workers", 1))
+
+serve_kwargs = {
+    "threads": THREADS,
+    "connection_limit": CONNECTION_LIMIT,
+    "backlog": BACKLOG,
+    "channel_timeout": CHANNEL_TIMEOUT,
+}
+flask_kwargs = {"host": HOST, "port": FLASK_PORT, **serve_kwargs}
+dash_kwargs = {"host": HOST, "port": DASH_PORT, **serve_kwargs}
+
+logger = logging.getLogger("runservers")
+
+
+def listen(host: str, port: str) -> socket.socket:
+    """
+    Open the listening socket that every worker of an app accepts from, so the
+    kernel shares out the connections between them
+
+    Returns:
+        socket.socket: the bound, listening socket
+    """
+    sock = socket.create_server((host, int(port)), backlog=BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+def prepare_worker():
+    """
+    Set up a freshly forked worker process: connections pooled before the fork
+    mustn't be shared with the parent, and each request thread should be able
+    to hold a db connection
+    """
+    database.dispose_engines()
+    database.DEFAULT_POOL_SIZE = max(THREADS, database.DEFAULT_POOL_SIZE)
+    database.get_engine(flaskapp.mydb, readonly=True)
+
+
+def run_worker(app, sock: socket.socket):
+    """
+    Serve app from sock with waitress until SIGTERM, then stop accepting
+    connections and exit once the requests in flight have been answered (or
+    after SHUTDOWN_TIMEOUT seconds)
+
+    Args:
+        app: the WSGI app
+        sock (socket.socket): the shared listening socket
+    """
+    prepare_worker()
+    server = create_server(app, sockets=[sock], **serve_kwargs)
+    stopping = {"deadline": None}
+
+    def stop(signum, frame):
+        stopping["deadline"] = time.monotonic() + SHUTDOWN_TIMEOUT
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    timeout = server.adj.asyncore_loop_timeout
+    while True:
+        wasyncore.loop(timeout=timeout, map=server._map, use_poll=True, count=1)
+        if stopping["deadline"] is None:
+            continue
+
+        # Stop taking new connections and close idle keep-alive ones
+        server.accepting = False
+        busy = False
+        for channel in list(server.active_channels.values()):
+            if channel.requests or channel.total_outbufs_len:
+                busy = True
+            else:
+                channel.will_close = True
+        if not busy or time.monotonic() > stopping["deadline"]:
+            break
+
+    server.task_dispatcher.shutdown(timeout=timeout)
+    server.close()
+
+
+def run_asgi_worker(app, sock: socket.socket):
+    """
+    Serve the ASGI app from sock with uvicorn, which stops gracefully on
+    SIGTERM by itself
+
+    Args:
+        app: the ASGI app
+        sock (socket.socket): the shared listening socket
+    """
+    prepare_worker()
+    asgi.executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="asgi")
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    # log_config=None leaves uvicorn logging through the root logger
+    config = uvicorn.Config(
+        app, backlog=BACKLOG, timeout_keep_alive=5, lifespan="on", log_config=None
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    """
+    Pre-fork worker processes for each app from its shared listening socket,
+    replacing any that die
+
+    Signals:
+        SIGTERM, SIGINT: stop every worker gracefully, then exit
+        SIGHUP: restart every worker one at a time, starting each replacement
+            before stopping the worker it replaces so the app stays up
+
+    Args:
+        apps (list): (name, worker function, app, listening socket, number of
+            workers) tuples, see run_worker and run_asgi_worker
+    """
+
+    def __init__(self, apps: list):
+        self.apps = apps
+        self.context = mp.get_context("fork")
+        self.workers = {name: [] for name, _, _, _, _ in apps}
+        self.signals = []
+
+    def spawn(self, name: str, target, app, sock: socket.socket) -> mp.Process:
+        worker = self.context.Process(
+            target=target, args=(app, sock), name=f"{name}-worker"
+        )
+        worker.start()
+        logger.info(f"Started {name} worker {worker.pid}")
+        return worker
+
+    def stop(self, workers: list):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 5
+        for worker in workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                logger.warning(f"Killing {worker.name} {worker.pid}")
+                worker.kill()
+                worker.join()
+
+    def restart(self):
+        for name, target, app, sock, _ in self.apps:
+            for i, worker in enumerate(self.workers[name]):
+                self.workers[name][i] = self.spawn(name, target, app, sock)
+                self.stop([worker])
+
+    def run(self):
+        for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGHUP]:
+            signal.signal(signum, lambda signum, frame: self.signals.append(signum))
+
+        for name, target, app, sock, count in self.apps:
+            logger.info(f"Serving {name} on http://{HOST}:{sock.getsockname()[1]}")
+            self.workers[name] = [
+                self.spawn(name, target, app, sock) for _ in range(count)
+            ]
+
+        while True:
+            time.sleep(0.5)
+            if self.signals:
+                signum = self.signals.pop(0)
+                if signum == signal.SIGHUP:
+                    logger.info("Restarting workers")
+                    self.restart()
+                    continue
+                logger.info("Stopping workers")
+                self.stop([w for workers in self.workers.values() for w in workers])
+                return
+
+            for name, target, app, sock, _ in self.apps:
+                for i, worker in enumerate(self.workers[name]):
+                    if not worker.is_alive():
+                        logger.warning(
+                            f"{name} worker {worker.pid} exited with code "
+                            f"{worker.exitcode}, replacing it"
+                        )
+                        self.workers[name][i] = self.spawn(name, target, app, sock)
+
 
 if __name__ == "__main__":
 
-    # Use multiprocessing on Linux as forking is supported
+    logging.basicConfig(level=logging.INFO)
+
+    # Pre-fork worker processes on Linux as forking is supported
     if platform.system() == "Linux":
-        multi = mp.Process
+        apps = [
+            ("flask", run_worker, flaskapp.app, FLASK_PORT, FLASK_WORKERS),
+            ("dash", run_worker, dashapp.server, DASH_PORT, DASH_WORKERS),
+        ]
+        if ASGI_PORT:
+            apps.append(("asgi", run_asgi_worker, asgi.app, ASGI_PORT, ASGI_WORKERS))
+        supervisor = Supervisor(
+            [
+                (name, target, app, listen(HOST, port), count)
+                for name, target, app, port, count in apps
+                if count > 0
+            ]
+        )
+        supervisor.run()
 
-    # Multithreading for MacOS and Windows
+    # One thread per app for MacOS and Windows
     else:
         multi = th.Thread
 
-    flask_process = multi(target=serve, args=(flaskapp.app,), kwargs=flask_kwargs)
-    dash_process = multi(target=serve, args=(dashapp.server,), kwargs=dash_kwargs)
+        flask_process = multi(target=serve, args=(flaskapp.app,), kwargs=flask_kwargs)
+        dash_process = multi(target=serve, args=(dashapp.server,), kwargs=dash_kwargs)
 
-    logging.basicConfig(level=logging.INFO)
+        flask_process.start()
+        dash_process.start()
 
-    flask_process.start()
-    dash_process.start()
+        if ASGI_PORT:
+            asgi_kwargs = {
+                "host": HOST,
+                "port": int(ASGI_PORT),
+                "backlog": BACKLOG,
+                "log_config": None,
+            }
+            multi(target=uvicorn.run, args=(asgi.app,), kwargs=asgi_kwargs).start()
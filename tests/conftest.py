@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import insert
+
+from flaskapp import app as flaskapp
+from flaskapp import database
+from flaskapp.models import Assay, Compound, DatasetVersion, compound_assay
+
+
+@pytest.fixture
+def client():
+    """
+    A test client of the Flask API, starting with empty response caches
+    """
+    flaskapp.response_cache.clear()
+    flaskapp.compressed_cache.clear()
+    flaskapp._dataset_version.update(version=None, updated_at=None, checked_at=0.0)
+    return flaskapp.app.test_client()
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    """
+    Return a function that creates a sqlite db in tmp_path holding the given
+    rows (as lists of dicts), points the API at it and returns its name
+    """
+
+    def make(compounds=(), assays=(), links=(), version=1):
+        db_name = str(tmp_path / "compound_assay")
+        Compound.metadata.create_all(database.get_engine(db_name))
+        with database.connect(db_name) as session:
+            for table, rows in [
+                (Compound.__table__, compounds),
+                (Assay.__table__, assays),
+                (compound_assay, links),
+            ]:
+                if rows:
+                    session.execute(insert(table), list(rows))
+            session.execute(insert(DatasetVersion.__table__), [{"version": version}])
+        monkeypatch.setattr(flaskapp, "mydb", db_name)
+        return db_name
+
+    yield make
+    database.dispose_engines()
@@ -0,0 +1,101 @@
+"""
+Tests of the Flask API against the db the Prefect flow builds, so run the
+flow first:
+
+    python3 flaskapp/transform.py
+    python3 -m pytest tests
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from flaskapp import app as flaskapp
+from flaskapp import fingerprints
+
+SMILES = "CCOC1=CC(=O)N(C)C=C1c2cc(NC(=O)Cc3cc(F)ccc3Cl)ccc2Oc4ccc(F)cc4F"
+
+
+@pytest.fixture
+def statements():
+    """
+    Collect the SQL of every statement run while the test runs, other than
+    the dataset version lookups made for the response cache
+    """
+    collected = []
+
+    def collect(connection, cursor, statement, *args):
+        if "dataset_version" not in statement:
+            collected.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", collect)
+    yield collected
+    event.remove(Engine, "before_cursor_execute", collect)
+
+
+@pytest.mark.parametrize(
+    "path, queries",
+    [
+        # One for the page and one for the assay results of all its compounds
+        ("/api/compounds", 2),
+        ("/api/assays", 1),
+    ],
+)
+@pytest.mark.parametrize("limit", [1, 10, 100])
+def test_list_page_queries(client, statements, path, queries, limit):
+    response = client.get(path, query_string={"limit": limit})
+    assert response.status_code == 200
+    assert len(response.get_json()) == limit
+    assert len(statements) == queries
+
+
+def test_single_compound_queries(client, statements):
+    # One for the compound and one for its assay results
+    response = client.get("/api/compound/2193125")
+    assert response.status_code == 200
+    assert response.get_json()["compound_id"] == 2193125
+    assert len(statements) == 2
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        ("compound_id,smiles", {"compound_id", "smiles"}),
+        # Rows are matched to their scores by compound_id, so it must work
+        # without it
+        ("smiles", {"smiles"}),
+    ],
+)
+def test_similar_fields(client, fields, expected):
+    response = client.get(
+        "/api/compounds/similar",
+        query_string={"smiles": SMILES, "limit": 3, "fields": fields},
+    )
+    assert response.status_code == 200
+    rows = response.get_json()
+    assert rows
+    for row in rows:
+        assert set(row) == expected | {"similarity"}
+    assert rows[0]["smiles"] == SMILES
+    assert rows[0]["similarity"] == 1.0
+
+
+def test_search_method_header(client):
+    response = client.get("/api/compounds/similar", query_string={"smiles": SMILES})
+    assert response.headers[flaskapp.SEARCH_METHOD_HEADER] == fingerprints.METHOD
+
+
+@pytest.mark.skipif(fingerprints.Chem is None, reason="needs RDKit")
+def test_substructure_spellings(client):
+    # The same ring written aromatic and Kekulé, neither of them as it's
+    # written in the compounds' SMILES
+    found = []
+    for smiles in ["Fc1ccc(O)c(F)c1", "OC1=C(F)C=C(F)C=C1"]:
+        response = client.get(
+            "/api/compounds/substructure",
+            query_string={"smiles": smiles, "fields": "compound_id"},
+        )
+        assert response.status_code == 200
+        assert response.headers[flaskapp.SEARCH_METHOD_HEADER] == "rdkit"
+        found.append(response.get_json())
+    assert found[0] and found[0] == found[1]
+    assert {"compound_id": 2193125} in found[0]
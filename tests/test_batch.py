@@ -0,0 +1,162 @@
+"""
+Tests of the batch endpoints and of the Dash app's client for them, which
+splits large batches and falls back to fetching rows one at a time
+"""
+import pytest
+import requests
+
+from dashapp import getter
+from flaskapp import app as flaskapp
+
+COMPOUNDS = [{"compound_id": id, "smiles": f"C{id}"} for id in range(1, 11)]
+ASSAYS = [{"result_id": 100 + id, "result": "Ki", "value": id} for id in range(1, 4)]
+LINKS = [{"compound_id": 2, "result_id": 101}]
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db(COMPOUNDS, ASSAYS, LINKS)
+
+
+def post_ids(client, ids, url="/api/compounds/batch", name="compound_ids"):
+    return client.post(url, json={name: ids}, query_string={"fields": name[:-1]})
+
+
+def test_batch_order(client, db):
+    response = post_ids(client, [5, 2, 9, 1])
+    assert response.status_code == 200
+    assert response.get_json() == [{"compound_id": id} for id in [5, 2, 9, 1]]
+
+
+def test_batch_repeated_and_missing_ids(client, db):
+    # Repeats come back once, where they were first asked for
+    response = post_ids(client, [3, 99, 1, 3, "2", 1, -4])
+    assert response.get_json() == [{"compound_id": id} for id in [3, 1, 2]]
+    assert post_ids(client, [99]).get_json() == []
+    assert post_ids(client, []).get_json() == []
+
+
+def test_batch_fields(client, db):
+    response = client.post("/api/compounds/batch", json={"compound_ids": [2, 1]})
+    rows = response.get_json()
+    assert [row["compound_id"] for row in rows] == [2, 1]
+    assert [a["result_id"] for a in rows[0]["assay_results"]] == [101]
+    assert rows[1]["assay_results"] == []
+
+    response = post_ids(client, [103, 101], "/api/assays/batch", "result_ids")
+    assert response.get_json() == [{"result_id": 103}, {"result_id": 101}]
+
+
+def test_batch_limit(client, db, monkeypatch):
+    monkeypatch.setattr(flaskapp, "MAX_BATCH_IDS", 3)
+    assert post_ids(client, [1, 2, 3]).status_code == 200
+    response = post_ids(client, [1, 2, 3, 4])
+    assert response.status_code == 400
+    assert b"At most 3 compound_ids" in response.get_data()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [None, [1, 2], {"result_ids": [1]}, {"compound_ids": 1}, {"compound_ids": ["x"]}],
+)
+def test_batch_bad_body(client, db, body):
+    response = client.post("/api/compounds/batch", json=body)
+    assert response.status_code == 400
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, rows: list = None):
+        self.status_code = status_code
+        self.rows = rows
+
+    def json(self):
+        return self.rows
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+
+class FakeSession:
+    """
+    Stands in for the API, answering each batch POST with the rows asked for
+    (those in rows), or with status_code if it's set
+    """
+
+    def __init__(self, rows: dict, status_code: int = None):
+        self.rows = rows
+        self.status_code = status_code
+        self.posted = []
+
+    def post(self, url, json, timeout):
+        self.posted.append(json)
+        if self.status_code:
+            return FakeResponse(self.status_code)
+        ids = next(iter(json.values()))
+        return FakeResponse(200, [self.rows[id] for id in ids if id in self.rows])
+
+
+ROWS = {id: {"compound_id": id} for id in range(1, 11)}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """
+    Return a function that points the getter at a FakeSession made with its
+    arguments, with batches of up to 3 ids
+    """
+    monkeypatch.setattr(getter, "MAX_BATCH_IDS", 3)
+
+    def make(rows=ROWS, status_code=None):
+        session = FakeSession(rows, status_code)
+        monkeypatch.setattr(getter, "get_session", lambda: session)
+        return session
+
+    return make
+
+
+def get_compounds(ids: list) -> list:
+    return getter.get_batch("/batch", "compound_ids", ids, "/compound/{}")
+
+
+def test_get_batch_chunks(api):
+    session = api()
+    rows = get_compounds([9, 1, 4, 1, 12, 7, 2, 3, 9])
+    assert rows == [ROWS[id] for id in [9, 1, 4, 7, 2, 3]]
+    # Repeats are dropped before splitting
+    assert session.posted == [
+        {"compound_ids": [9, 1, 4]},
+        {"compound_ids": [12, 7, 2]},
+        {"compound_ids": [3]},
+    ]
+
+
+def test_get_batch_empty(api):
+    session = api()
+    assert get_compounds([]) == []
+    assert session.posted == []
+
+
+@pytest.mark.parametrize("status_code", [404, 405])
+def test_get_batch_fallback(api, monkeypatch, status_code):
+    session = api(status_code=status_code)
+    fetched = []
+
+    def get_json(url):
+        fetched.append(url)
+        id = int(url.rsplit("/", 1)[1])
+        # The API responds with null for a compound that doesn't exist
+        return ROWS.get(id)
+
+    monkeypatch.setattr(getter, "get_json", get_json)
+    rows = get_compounds([5, 12, 1, 2, 3, 5, 4])
+    assert rows == [ROWS[id] for id in [5, 1, 2, 3, 4]]
+    # The first batch request tells it the endpoint is missing
+    assert len(session.posted) == 1
+    assert sorted(fetched) == sorted(f"/compound/{id}" for id in [5, 12, 1, 2, 3, 4])
+
+
+def test_get_batch_error(api):
+    api(status_code=500)
+    with pytest.raises(requests.HTTPError):
+        get_compounds([1, 2])
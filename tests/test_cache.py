@@ -0,0 +1,120 @@
+"""
+Tests of the response cache and the conditional requests it answers, against
+a small db made for each test
+"""
+import msgpack
+import pytest
+from sqlalchemy import insert, update
+
+from flaskapp import app as flaskapp
+from flaskapp import database, serializers
+from flaskapp.models import Compound, DatasetVersion
+
+# Enough compounds that the page is worth compressing
+COMPOUNDS = [
+    {"compound_id": id, "smiles": f"C{id}", "molecular_formula": f"C{id}H{id}N"}
+    for id in range(1, 101)
+]
+URL = "/api/compounds?limit=100"
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db(COMPOUNDS)
+
+
+def bump_version(db_name: str, compound_id: int):
+    """
+    Add a compound and bump the dataset version, as the flow would, and stop
+    the API trusting the version it last saw
+    """
+    with database.connect(db_name) as session:
+        session.execute(
+            insert(Compound.__table__), [{"compound_id": compound_id, "smiles": "C"}]
+        )
+        session.execute(
+            update(DatasetVersion).values(version=DatasetVersion.version + 1)
+        )
+    flaskapp._dataset_version["checked_at"] = 0.0
+
+
+def test_matching_etag(client, db):
+    response = client.get(URL)
+    assert response.status_code == 200
+    etag, _ = response.get_etag()
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = client.get(URL, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.get_etag() == (etag, False)
+
+    response = client.get(URL, headers={"If-None-Match": '"another"'})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 100
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+def test_matching_compressed_etag(client, db, encoding):
+    response = client.get(URL, headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == encoding
+    etag, _ = response.get_etag()
+    assert etag.endswith(f":{encoding}")
+
+    response = client.get(
+        URL, headers={"Accept-Encoding": encoding, "If-None-Match": f'"{etag}"'}
+    )
+    assert response.status_code == 304
+    assert response.get_etag() == (etag, False)
+
+
+def test_version_change(client, db):
+    response = client.get(URL)
+    etag, _ = response.get_etag()
+
+    bump_version(db, 0)
+    response = client.get(URL, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+    assert response.get_json()[0]["compound_id"] == 0
+
+    # Until the next bump, the new tag matches
+    new_etag, _ = response.get_etag()
+    response = client.get(URL, headers={"If-None-Match": f'"{new_etag}"'})
+    assert response.status_code == 304
+
+
+def test_cache_is_cleared_on_version_change(client, db):
+    client.get(URL)
+    assert len(flaskapp.response_cache) == 1
+
+    bump_version(db, 0)
+    client.get("/api/compounds?limit=1")
+    assert len(flaskapp.response_cache) == 1
+    assert client.get(URL).get_json()[0]["compound_id"] == 0
+
+
+def test_cache_varies_by_accept(client, db):
+    json_response = client.get(URL, headers={"Accept": serializers.JSON_MIMETYPE})
+    msgpack_response = client.get(URL, headers={"Accept": serializers.MSGPACK_MIMETYPE})
+    assert json_response.mimetype == serializers.JSON_MIMETYPE
+    assert msgpack_response.mimetype == serializers.MSGPACK_MIMETYPE
+    assert "Accept" in json_response.headers["Vary"]
+    assert len(flaskapp.response_cache) == 2
+    assert msgpack.unpackb(msgpack_response.get_data()) == json_response.get_json()
+
+    json_etag, _ = json_response.get_etag()
+    msgpack_etag, _ = msgpack_response.get_etag()
+    assert json_etag != msgpack_etag
+
+    # A tag for one format doesn't match a request for the other
+    response = client.get(
+        URL,
+        headers={
+            "Accept": serializers.MSGPACK_MIMETYPE,
+            "If-None-Match": f'"{json_etag}"',
+        },
+    )
+    assert response.status_code == 200
+    assert response.mimetype == serializers.MSGPACK_MIMETYPE
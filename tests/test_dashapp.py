@@ -0,0 +1,115 @@
+"""
+Tests of how the Dash app translates the filtering, sorting and paging of its
+tables into API query parameters
+"""
+import pytest
+
+from dashapp import dashapp
+
+COLUMNS = dashapp.COMPOUND_QUERY_COLUMNS
+
+
+@pytest.mark.parametrize(
+    "filter_query, expected",
+    [
+        (None, {}),
+        ("", {}),
+        ("{num_rings} = 2", {"num_rings__eq": "2"}),
+        ("{num_rings} s= 2", {"num_rings__eq": "2"}),
+        ("{num_rings} eq 2", {"num_rings__eq": "2"}),
+        ("{num_rings} != 2", {"num_rings__ne": "2"}),
+        ("{num_rings} ne 2", {"num_rings__ne": "2"}),
+        ("{ALogP} < -1.5", {"ALogP__lt": "-1.5"}),
+        ("{ALogP} lt -1.5", {"ALogP__lt": "-1.5"}),
+        ("{ALogP} <= -1.5", {"ALogP__lte": "-1.5"}),
+        ("{ALogP} le -1.5", {"ALogP__lte": "-1.5"}),
+        ("{molecular_weight} s> 400", {"molecular_weight__gt": "400"}),
+        ("{molecular_weight} gt 400", {"molecular_weight__gt": "400"}),
+        ("{molecular_weight} >= 400", {"molecular_weight__gte": "400"}),
+        ("{molecular_weight} ge 400", {"molecular_weight__gte": "400"}),
+        ("{molecular_formula} contains Cl", {"molecular_formula__contains": "Cl"}),
+        ("{molecular_formula} icontains Cl", {"molecular_formula__contains": "Cl"}),
+        (
+            '{molecular_weight} s> 400 && {molecular_formula} contains "Cl"',
+            {"molecular_weight__gt": "400", "molecular_formula__contains": "Cl"},
+        ),
+    ],
+)
+def test_filter_operators(filter_query, expected):
+    assert dashapp.filter_params(filter_query, COLUMNS) == expected
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ('"C2 H6"', "C2 H6"),
+        ("'C2 H6'", "C2 H6"),
+        ("`C2 H6`", "C2 H6"),
+        ('"a && b"', "a && b"),
+        ('"a \\"b\\" c"', 'a "b" c'),
+        ("'it\\'s'", "it's"),
+        ('"&&"', "&&"),
+        # Not quoted, so taken as it is
+        ('"C2', '"C2'),
+        ("C2 H6", "C2 H6"),
+    ],
+)
+def test_filter_quoted_values(value, expected):
+    filter_query = f"{{molecular_formula}} contains {value} && {{num_rings}} = 1"
+    assert dashapp.filter_params(filter_query, COLUMNS) == {
+        "molecular_formula__contains": expected,
+        "num_rings__eq": "1",
+    }
+
+
+@pytest.mark.parametrize(
+    "filter_query",
+    [
+        # Operators the API doesn't have
+        "{molecular_formula} datestartswith 2020",
+        "{molecular_formula} is blank",
+        "{num_rings} in 1",
+        # Columns it can't filter on
+        "{smiles} contains C",
+        "{assay_results} > 2",
+        "num_rings = 2",
+    ],
+)
+def test_unsupported_filters(filter_query):
+    assert dashapp.filter_params(filter_query, COLUMNS) == {}
+    # and the rest of the query still applies
+    for query in [
+        f"{filter_query} && {{num_rings}} = 2",
+        f"{{num_rings}} = 2 && {filter_query}",
+    ]:
+        assert dashapp.filter_params(query, COLUMNS) == {"num_rings__eq": "2"}
+
+
+@pytest.mark.parametrize(
+    "sort_by, expected",
+    [
+        ([], None),
+        (None, None),
+        ([{"column_id": "ALogP", "direction": "asc"}], "ALogP"),
+        ([{"column_id": "ALogP", "direction": "desc"}], "-ALogP"),
+        # Only the first sort is used
+        (
+            [
+                {"column_id": "num_rings", "direction": "desc"},
+                {"column_id": "ALogP", "direction": "asc"},
+            ],
+            "-num_rings",
+        ),
+        # Not a column the API sorts on
+        ([{"column_id": "assay_results", "direction": "asc"}], None),
+    ],
+)
+def test_sort_by(sort_by, expected):
+    params = dashapp.table_query_params(2, 25, sort_by, "{num_rings} = 1", COLUMNS)
+    assert params.pop("sort", None) == expected
+    assert params == {"num_rings__eq": "1", "offset": 50, "limit": 25}
+
+
+def test_first_page():
+    params = dashapp.table_query_params(None, 10, None, None, COLUMNS)
+    assert params == {"offset": 0, "limit": 10}
@@ -0,0 +1,115 @@
+"""
+Tests of how database.connect routes reads and writes between a db and its
+replicas, using small sqlite dbs made for each test
+"""
+import os
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from flaskapp import database
+from flaskapp.models import Compound
+
+
+def make_db(db_name: str, compound_ids: list):
+    """
+    Create the sqlite db at db_name holding a compound for each id
+    """
+    Compound.metadata.create_all(database.get_engine(db_name))
+    with database.connect(db_name) as session:
+        session.add_all(Compound(compound_id=id) for id in compound_ids)
+
+
+def read_ids(db_name: str) -> list:
+    with database.connect(db_name, readonly=True) as session:
+        return session.execute(select(Compound.compound_id)).scalars().all()
+
+
+@pytest.fixture(autouse=True)
+def engines():
+    database.dispose_engines()
+    yield
+    database.dispose_engines()
+
+
+@pytest.fixture
+def sqlite_replica(monkeypatch):
+    monkeypatch.setattr(database, "SQLITE_REPLICA", True)
+    monkeypatch.setattr(database, "REPLICA_CHECK_INTERVAL", 0.0)
+
+
+def test_connect_writes_to_primary(tmp_path, sqlite_replica):
+    db_name = str(tmp_path / "compounds")
+    make_db(db_name, [1])
+    database.publish_replica(db_name, 1)
+    with database.connect(db_name) as session:
+        session.add(Compound(compound_id=2))
+    with database.connect_to_sqlite(db_name) as session:
+        assert session.execute(select(Compound.compound_id)).scalars().all() == [1, 2]
+
+
+def test_sqlite_replica_swap(tmp_path, sqlite_replica):
+    db_name = str(tmp_path / "compounds")
+    make_db(db_name, [1])
+    # Reads go to the db itself until a replica is published
+    assert read_ids(db_name) == [1]
+
+    database.publish_replica(db_name, 1)
+    make_db(db_name, [2])
+    assert read_ids(db_name) == [1]
+    with pytest.raises(OperationalError, match="readonly"):
+        with database.connect(db_name, readonly=True) as session:
+            session.add(Compound(compound_id=3))
+
+    database.publish_replica(db_name, 2)
+    assert read_ids(db_name) == [1, 2]
+
+
+def test_publish_replica_keeps_recent_copies(tmp_path, monkeypatch):
+    db_name = str(tmp_path / "compounds")
+    make_db(db_name, [1])
+    directory = database.replica_dir(db_name)
+    for version in range(1, 5):
+        database.publish_replica(db_name, version)
+    # Every copy was replaced moments ago, so readers may still open them
+    assert len(os.listdir(directory)) == 5
+
+    monkeypatch.setattr(database, "REPLICA_GRACE_PERIOD", -1.0)
+    database.publish_replica(db_name, 5)
+    assert sorted(os.listdir(directory)) == [
+        database.REPLICA_CURRENT,
+        "v4.sqlite",
+        "v5.sqlite",
+    ]
+
+
+def test_replica_urls(tmp_path, monkeypatch):
+    primary, replica = str(tmp_path / "primary"), str(tmp_path / "replica")
+    make_db(primary, [1])
+    make_db(replica, [2])
+    primary_url = database.database_url(primary)
+    monkeypatch.setattr(database, "DATABASE_URL", primary_url)
+    monkeypatch.setattr(database, "REPLICA_URLS", [database.database_url(replica)])
+
+    assert read_ids(primary_url) == [2]
+    with database.connect(primary_url) as session:
+        assert session.execute(select(Compound.compound_id)).scalars().all() == [1]
+
+
+def test_nested_connect(tmp_path):
+    db_name = str(tmp_path / "compounds")
+    make_db(db_name, [1])
+    with database.connect(db_name) as outer:
+        outer.add(Compound(compound_id=2))
+        outer.flush()
+        # e.g. a dataset version check in the middle of a request
+        with database.connect(db_name, readonly=True) as inner:
+            assert inner is not outer
+            inner.execute(select(Compound.compound_id)).all()
+        with database.connect(db_name) as inner:
+            assert inner is not outer
+        # The outer session carries on, its changes not yet committed
+        assert outer.execute(select(Compound.compound_id)).scalars().all() == [1, 2]
+        outer.add(Compound(compound_id=3))
+    assert read_ids(db_name) == [1, 2, 3]
@@ -0,0 +1,196 @@
+"""
+Tests of the listing endpoints' filters, sorting, projection and keyset
+pagination, against a small db made for each test
+"""
+import base64
+import json
+import re
+
+import pytest
+
+# Every sortable column but the primary key can be NULL
+COMPOUNDS = [
+    {
+        "compound_id": id,
+        "smiles": f"C{id}",
+        "molecular_weight": None if id % 4 == 0 else float(id % 5 * 100),
+        "ALogP": None if id % 3 == 0 else id % 7 - 3.5,
+        "molecular_formula": None if id % 6 == 0 else f"C{id % 4}H{id}N",
+        "num_rings": None if id % 5 == 0 else id % 3,
+    }
+    for id in range(1, 31)
+]
+ASSAYS = [
+    {
+        "result_id": 100 + id,
+        "target": f"Bromodomain-containing protein {id % 3 + 2}",
+        "result": ["IC50", "Ki", "Kd"][id % 3],
+        "operator": "=",
+        "value": None if id % 4 == 0 else id * 10.5,
+        "unit": "nM",
+    }
+    for id in range(1, 11)
+]
+LINKS = [{"compound_id": 1, "result_id": 101}, {"compound_id": 1, "result_id": 102}]
+
+NEXT_LINK = re.compile(r'<([^>]+)>; rel="next"')
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db(COMPOUNDS, ASSAYS, LINKS)
+
+
+def cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def sort_key(name: str, pk: str):
+    """
+    The order the API sorts rows in: NULLs before every value, ties broken
+    by the primary key
+    """
+    return lambda row: (row[name] is not None, row[name] or 0, row[pk])
+
+
+def known(row: dict, name: str, null: float = 1e9):
+    """
+    Return row[name], or null in place of NULL, which no comparison matches
+    """
+    return null if row[name] is None else row[name]
+
+
+def walk(client, url: str) -> list:
+    """
+    Follow the next links from url to the last page, returning every row
+    """
+    rows = []
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        rows.extend(response.get_json())
+        match = NEXT_LINK.match(response.headers.get("Link", ""))
+        url = match.group(1) if match else None
+    return rows
+
+
+@pytest.mark.parametrize(
+    "sort", ["molecular_weight", "ALogP", "num_rings", "compound_id"]
+)
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 4, 7])
+def test_walk_pages(client, db, sort, descending, limit):
+    order = ("-" if descending else "") + sort
+    rows = walk(client, f"/api/compounds?sort={order}&limit={limit}")
+    expected = sorted(COMPOUNDS, key=sort_key(sort, "compound_id"), reverse=descending)
+    assert [row["compound_id"] for row in rows] == [
+        row["compound_id"] for row in expected
+    ]
+
+
+def test_walk_filtered_pages_from_offset(client, db):
+    rows = walk(client, "/api/assays?sort=-value&limit=2&offset=3&unit=nM")
+    expected = sorted(ASSAYS, key=sort_key("value", "result_id"), reverse=True)
+    assert [row["result_id"] for row in rows] == [
+        row["result_id"] for row in expected[3:]
+    ]
+
+
+def test_last_page_has_no_link(client, db):
+    response = client.get("/api/compounds?limit=30")
+    assert len(response.get_json()) == 30
+    assert "Link" not in response.headers
+
+
+@pytest.mark.parametrize(
+    "query, matches",
+    [
+        ("num_rings=1", lambda c: c["num_rings"] == 1),
+        ("num_rings__ne=1", lambda c: c["num_rings"] not in [None, 1]),
+        ("molecular_weight__lt=200", lambda c: known(c, "molecular_weight") < 200),
+        ("molecular_weight__lte=200", lambda c: known(c, "molecular_weight") <= 200),
+        ("ALogP__gt=0.5", lambda c: known(c, "ALogP", -1e9) > 0.5),
+        ("ALogP__gte=0.5", lambda c: known(c, "ALogP", -1e9) >= 0.5),
+        ("compound_id__in=3,5,99", lambda c: c["compound_id"] in [3, 5]),
+        (
+            "molecular_formula__contains=C2H",
+            lambda c: "C2H" in (c["molecular_formula"] or ""),
+        ),
+        # contains matches % and _ literally
+        ("molecular_formula__contains=C_H", lambda c: False),
+        (
+            "num_rings=2&molecular_weight__gte=300",
+            lambda c: c["num_rings"] == 2 and known(c, "molecular_weight", 0) >= 300,
+        ),
+    ],
+)
+def test_filters(client, db, query, matches):
+    response = client.get(f"/api/compounds?{query}&fields=compound_id")
+    assert response.status_code == 200
+    expected = [{"compound_id": c["compound_id"]} for c in COMPOUNDS if matches(c)]
+    assert response.get_json() == expected
+
+    count = client.get(f"/api/compounds/count?{query}").get_json()["count"]
+    assert count == len(expected)
+
+
+def test_fields(client, db):
+    response = client.get("/api/compounds?fields=smiles,compound_id&limit=2")
+    assert response.get_json() == [
+        {"compound_id": 1, "smiles": "C1"},
+        {"compound_id": 2, "smiles": "C2"},
+    ]
+
+    response = client.get("/api/compounds?fields=assay_results&compound_id__in=1,2")
+    rows = response.get_json()
+    assert [sorted(row) for row in rows] == [["assay_results"]] * 2
+    assert [a["result_id"] for a in rows[0]["assay_results"]] == [101, 102]
+    assert rows[1]["assay_results"] == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "unknown=1",
+        "smiles=C1",
+        "num_rings__like=1",
+        "num_rings=one",
+        "compound_id__in=1,x",
+        "num_rings__contains=1",
+        "sort=smiles",
+        "fields=compound_id,mass",
+        "limit=0",
+        "limit=ten",
+        "offset=-1",
+        "after=not-a-cursor",
+        f"after={cursor({'molecular_weight': 100})}",
+        f"after={cursor([100])}",
+        f"after={cursor([[1], 2])}",
+        f"after={cursor([100, '2'])}",
+        f"after={cursor([100, 2.5])}",
+        f"after={cursor([True, 2])}",
+        f"sort=molecular_weight&after={cursor(['heavy', 2])}",
+        f"sort=molecular_formula&after={cursor([5, 2])}",
+    ],
+)
+def test_bad_arguments(client, db, query):
+    assert client.get(f"/api/compounds?{query}").status_code == 400
+
+
+@pytest.mark.parametrize(
+    "sort, after, first",
+    [
+        # A NULL sort value, as the cursor of a page ending in one holds
+        ("molecular_weight", [None, 4], 8),
+        ("-molecular_weight", [None, 8], 4),
+        # Text sorts character by character
+        ("molecular_formula", ["C1H1N", 1], 21),
+        ("compound_id", [None, 28], 29),
+    ],
+)
+def test_cursor(client, db, sort, after, first):
+    response = client.get(
+        f"/api/compounds?sort={sort}&after={cursor(after)}&fields=compound_id"
+    )
+    assert response.status_code == 200
+    assert response.get_json()[0]["compound_id"] == first
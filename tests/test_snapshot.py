@@ -0,0 +1,56 @@
+"""
+Tests of writing and reading the columnar snapshot, against a small db made
+for each test
+"""
+from sqlalchemy import insert
+
+from flaskapp import database, snapshot
+from flaskapp.models import Compound
+
+COMPOUNDS = [
+    {"compound_id": id, "smiles": f"C{id}", "molecular_weight": 100.0 * id}
+    for id in range(1, 4)
+]
+
+
+def write(db_name: str, directory: str, version: int, **metadata) -> str:
+    with database.get_engine(db_name).connect() as connection:
+        return snapshot.write_snapshot(
+            connection, directory, version, metadata=metadata
+        )
+
+
+def test_read_snapshot(make_db, tmp_path):
+    db_name = make_db(COMPOUNDS)
+    directory = str(tmp_path / "columns")
+    assert snapshot.read_manifest(directory) is None
+
+    write(db_name, directory, 1, note="first")
+    manifest = snapshot.read_manifest(directory)
+    assert manifest["version"] == 1
+    assert manifest["note"] == "first"
+    assert manifest["columns"]["compound"]["compound_id"]["length"] == 3
+    weights = snapshot.load_column(directory, "compound", "molecular_weight")
+    assert weights.tolist() == [100.0, 200.0, 300.0]
+
+
+def test_rewritten_snapshot(make_db, tmp_path):
+    db_name = make_db(COMPOUNDS)
+    directory = str(tmp_path / "columns")
+    write(db_name, directory, 1, note="first")
+    snapshot.read_manifest(directory)
+    snapshot.load_column(directory, "compound", "molecular_weight")
+
+    # e.g. a rerun after a failed publish writes the same version again
+    with database.connect(db_name) as session:
+        session.execute(
+            insert(Compound.__table__),
+            [{"compound_id": 4, "smiles": "C4", "molecular_weight": 400.0}],
+        )
+    write(db_name, directory, 1, note="second")
+
+    manifest = snapshot.read_manifest(directory)
+    assert manifest["note"] == "second"
+    assert manifest["columns"]["compound"]["compound_id"]["length"] == 4
+    weights = snapshot.load_column(directory, "compound", "molecular_weight")
+    assert weights.tolist() == [100.0, 200.0, 300.0, 400.0]
@@ -0,0 +1,194 @@
+"""
+Tests of the incremental loads of the Prefect flow's tasks, run one after
+another against a sqlite db made for each test, and of the json parsing
+they start with
+"""
+import json
+
+import pytest
+from sqlalchemy import select
+
+from flaskapp import database, transform
+from flaskapp.models import Assay, Compound, DatasetVersion, compound_assay
+
+
+def compound(compound_id: int, *assays: tuple) -> dict:
+    """
+    Return a compound record with an assay result for each (result_id, value)
+    """
+    return {
+        "compound_id": compound_id,
+        "smiles": f"C{compound_id}",
+        "molecular_weight": 100.0 + compound_id,
+        "assay_results": [
+            {
+                "result_id": result_id,
+                "target": "Bromodomain-containing protein 4",
+                "result": "IC50",
+                "operator": "=",
+                "value": value,
+                "unit": "nM",
+            }
+            for result_id, value in assays
+        ],
+    }
+
+
+BASE = [compound(1, (101, 10)), compound(2, (102, 20), (103, 30)), compound(3)]
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / "compound_assay")
+    transform.create_sqlite_tables.run(db_name)
+    yield db_name
+    database.dispose_engines()
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    directory = tmp_path / "source"
+    directory.mkdir()
+    return directory
+
+
+def write_json(directory, name: str, compounds: list) -> str:
+    path = directory / name
+    path.write_text(json.dumps(compounds), encoding="utf-8")
+    return str(path)
+
+
+def load(db_name: str, json_path) -> list:
+    """
+    Run the flow's tasks from split_json_files to write_chunks, returning the
+    chunks split_json_files made
+    """
+    chunks = transform.split_json_files.run(db_name, str(json_path), chunk_size=2)
+    transformed = [transform.transform_chunk.run(chunk) for chunk in chunks]
+    transform.write_chunks.run(db_name, transformed, batch_size=2)
+    return chunks
+
+
+def read(db_name: str) -> dict:
+    """
+    Return the dataset version, assay values and links in the db
+    """
+    with database.connect_to_sqlite(db_name) as session:
+        return {
+            "version": session.execute(select(DatasetVersion.version)).scalar(),
+            "compounds": session.execute(select(Compound.compound_id)).scalars().all(),
+            "assays": dict(session.execute(select(Assay.result_id, Assay.value)).all()),
+            "links": sorted(session.execute(select(compound_assay)).all()),
+        }
+
+
+def test_first_load(db_name, source_dir):
+    write_json(source_dir, "0_base.json", BASE)
+    load(db_name, source_dir)
+    assert read(db_name) == {
+        "version": 1,
+        "compounds": [1, 2, 3],
+        "assays": {101: 10, 102: 20, 103: 30},
+        "links": [(1, 101), (2, 102), (2, 103)],
+    }
+
+
+def test_rerun_is_a_no_op(db_name, source_dir):
+    write_json(source_dir, "0_base.json", BASE)
+    load(db_name, source_dir)
+    before = read(db_name)
+
+    # The file's checksum hasn't changed, so it isn't even split
+    assert load(db_name, source_dir) == []
+    assert read(db_name) == before
+
+
+def test_unchanged_records_are_skipped(db_name, source_dir):
+    write_json(source_dir, "0_base.json", BASE)
+    load(db_name, source_dir)
+
+    # A new file, so it's split, but every record in it is already loaded
+    write_json(source_dir, "1_same.json", list(reversed(BASE)))
+    assert len(load(db_name, source_dir)) == 2
+    assert read(db_name)["version"] == 1
+
+    prepared = [transform.prepare_compound(record) for record in BASE]
+    engine = database.get_engine(db_name)
+    with engine.begin() as connection:
+        assert transform.write_prepared_batch(connection, prepared) == (0, 0)
+        prepared[0] = transform.prepare_compound(compound(1, (101, 11)))
+        # The compound, its assay, its link and its hash
+        assert transform.write_prepared_batch(connection, prepared) == (1, 4)
+
+
+def test_deltas_apply_in_name_order(db_name, source_dir):
+    write_json(source_dir, "0_base.json", BASE)
+    load(db_name, source_dir)
+
+    # Listed out of order, to be applied in order
+    write_json(source_dir, "2_delta.json", [compound(1, (101, 12))])
+    write_json(source_dir, "1_delta.json", [compound(1, (101, 11)), compound(4)])
+    load(db_name, source_dir)
+    state = read(db_name)
+    assert state["compounds"] == [1, 2, 3, 4]
+    assert state["assays"][101] == 12
+    # One bump per file that changed anything
+    assert state["version"] == 3
+
+
+def test_removed_assays_are_deleted(db_name, source_dir):
+    write_json(source_dir, "0_base.json", BASE)
+    load(db_name, source_dir)
+
+    # Compound 2 loses assay 103 and gains 104; assay 101 moves to compound 3
+    write_json(
+        source_dir,
+        "1_delta.json",
+        [compound(2, (102, 20), (104, 40)), compound(3, (101, 10)), compound(1)],
+    )
+    load(db_name, source_dir)
+    assert read(db_name) == {
+        "version": 2,
+        "compounds": [1, 2, 3],
+        "assays": {101: 10, 102: 20, 104: 40},
+        "links": [(2, 102), (2, 104), (3, 101)],
+    }
+
+
+# Starting with a byte order mark, as files saved on Windows can
+ARRAY_TEXT = """\ufeff [1.5, 1e5, -2.5E-3, 0, -7, 12345678901234567890, 3.0e+2,
+    "a, \\"b\\" ]", true, null, false, [], {}, [[1, [2.25]], {"x": [3e1]}],
+    {"compound_id": 1, "assay_results": [{"value": 19.5}]}, "\\u00e9", 6.02E23]
+"""
+
+
+@pytest.mark.parametrize("chunk_size", range(1, len(ARRAY_TEXT) + 2))
+def test_iter_json_array_chunk_boundaries(tmp_path, chunk_size):
+    path = tmp_path / "array.json"
+    path.write_text(ARRAY_TEXT, encoding="utf-8")
+    expected = json.loads(ARRAY_TEXT.lstrip("\ufeff"))
+
+    elements = transform.iter_json_array(str(path), chunk_size=chunk_size)
+    assert list(elements) == expected
+    texts = transform.iter_json_array(str(path), chunk_size=chunk_size, raw=True)
+    assert [json.loads(text) for text in texts] == expected
+
+
+@pytest.mark.parametrize("text", ["[]", " [ ] ", "[1.5]", "[-1e-1 ]", '["]"]'])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_iter_json_array_short(tmp_path, text, chunk_size):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    elements = transform.iter_json_array(str(path), chunk_size=chunk_size)
+    assert list(elements) == json.loads(text)
+
+
+@pytest.mark.parametrize(
+    "text", ['{"a": 1}', "", "[1 2]", "[1,", "[1.]", "[1e]", "[1.5e+]", "[-]"]
+)
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_iter_json_array_invalid(tmp_path, text, chunk_size):
+    path = tmp_path / "array.json"
+    path.write_text(text, encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(transform.iter_json_array(str(path), chunk_size=chunk_size))